@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import RetentionPolicy
+
+
+@admin.register(RetentionPolicy)
+class RetentionPolicyAdmin(admin.ModelAdmin):
+    list_display = ['owner', 'max_age_days', 'max_bytes', 'max_count', 'updated_at']
+    search_fields = ['owner__username']
+    raw_id_fields = ['owner']
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import queue
+import math
+
+import numpy as np
+import cv2
+
+from .preprocessing import MODEL_IMAGE_SIZE, preprocess_frame
+
+# Record of one sampled frame in a packed timeline: time in seconds, confidence and bounding box
+DETECTION_DTYPE = np.dtype([('time', '<f4'), ('confidence', '<f2'), ('bbox', '<f2', (4,))])
+
+
+def pack_detections(times, confidences, bboxes):
+    detections = np.empty(len(times), dtype=DETECTION_DTYPE)
+    detections['time'] = times
+    detections['confidence'] = confidences
+    detections['bbox'] = bboxes
+    return detections
+
+
+def unpack_detections(data):
+    return np.frombuffer(bytes(data), dtype=DETECTION_DTYPE)
+
+
+def iter_sampled_frames(video_path, sample_rate, start=0.0, end=None):
+    """
+    Read the video from start to end seconds and yield the time and the frame closest after each
+    multiple of 1 / sample_rate seconds. Frames are read one at a time, and frames between the
+    samples are only grabbed, not converted, so the whole video is never held in memory.
+    """
+    interval = 1 / sample_rate
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_MSEC, start * 1000)
+        next_time = start
+        while cap.grab():
+            # Time of the grabbed frame, which works for variable frame rate recordings as well
+            # Frame times are rounded to milliseconds, so they are compared with a small tolerance
+            frame_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if end is not None and frame_time >= end - 1e-6:
+                break
+            if frame_time < next_time - 1e-6:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            yield frame_time, frame
+            next_time = (math.floor(frame_time / interval + 1e-6) + 1) * interval
+    finally:
+        cap.release()
+
+
+def split_ranges(duration, sample_rate, workers):
+    """
+    Split the video into time ranges of equal length for the decoding threads. The ranges
+    start at multiples of the sample interval so no sample is taken twice or skipped.
+    A video of unknown duration is read by a single thread.
+    """
+    if not duration or workers <= 1:
+        return [(0.0, None)]
+    interval = 1 / sample_rate
+    samples = math.ceil(duration * sample_rate)
+    per_worker = math.ceil(samples / min(workers, samples))
+    starts = [index * interval for index in range(0, samples, per_worker)]
+    return [(start, end) for start, end in zip(starts, starts[1:] + [None])]
+
+
+def analyze_video_file(video_path, predict_fn, sample_rate, batch_size=32, workers=1, duration=None):
+    """
+    Detect faces in the frames of the video sampled at sample_rate frames per second.
+
+    The video is split into time ranges that are decoded and preprocessed in parallel threads
+    (OpenCV releases the GIL while decoding). Full batches of preprocessed frames are passed
+    through a bounded queue to the calling thread, which runs the model on one batch while the
+    next ones are being decoded. At most a few batches are in memory at a time.
+
+    Returns:
+        numpy.ndarray: Detections of the sampled frames in time order, of DETECTION_DTYPE.
+    """
+    ranges = split_ranges(duration, sample_rate, workers)
+    batches = queue.Queue(maxsize=len(ranges) * 2)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item):
+        # Give up if the model failed and nobody reads the queue anymore
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def decode(start, end):
+        try:
+            times = []
+            buffer = np.empty((batch_size, *MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+            for frame_time, frame in iter_sampled_frames(video_path, sample_rate, start, end):
+                if stop.is_set():
+                    return
+                preprocess_frame(frame, buffer[len(times)])
+                times.append(frame_time)
+                if len(times) == batch_size:
+                    put((times, buffer))
+                    times = []
+                    buffer = np.empty((batch_size, *MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+            if times:
+                put((times, buffer[:len(times)]))
+        except Exception as e:
+            put(e)
+        finally:
+            put(finished)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='video-analysis') as executor:
+        for start, end in ranges:
+            executor.submit(decode, start, end)
+        try:
+            running = len(ranges)
+            while running:
+                item = batches.get()
+                if item is finished:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    times, images = item
+                    y_pred = predict_fn(images)
+                    results.append(pack_detections(times, np.asarray(y_pred[0])[:, 0], np.asarray(y_pred[1])))
+        finally:
+            stop.set()
+
+    if not results:
+        return np.empty(0, dtype=DETECTION_DTYPE)
+    detections = np.concatenate(results)
+    return detections[np.argsort(detections['time'], kind='stable')]
+
+
+def detection_segments(detections, min_confidence, sample_rate):
+    """
+    Merge consecutive samples with a face into segments of time when someone was on camera.
+    Samples further apart than one and a half sample intervals start a new segment.
+
+    Returns:
+        list: Start and end time, highest confidence and sample count of each segment.
+    """
+    present = detections[detections['confidence'] >= min_confidence]
+    if not len(present):
+        return []
+    times = present['time'].astype(np.float64)
+    confidences = present['confidence'].astype(np.float64)
+    # Indices where a new segment starts
+    breaks = np.flatnonzero(np.diff(times) > 1.5 / sample_rate) + 1
+    segments = []
+    for indices in np.split(np.arange(len(times)), breaks):
+        segments.append({
+            "start": round(float(times[indices[0]]), 3),
+            "end": round(float(times[indices[-1]]), 3),
+            "max_confidence": round(float(confidences[indices].max()), 3),
+            "samples": len(indices),
+        })
+    return segments
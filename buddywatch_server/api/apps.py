@@ -1,17 +1,62 @@
 from django.apps import AppConfig
 from django.conf import settings
-import tensorflow as tf
-import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
-    model = None
+    registry = None
+    predictor = None
+    prediction_cache = None
 
     def ready(self):
-        file_path = os.path.join(settings.BASE_DIR, 'buddywatch_face.h5')
-        print('Loading model...')
-        # Load object detection model at start up and keep it in memory for fast access
-        ApiConfig.model = tf.keras.models.load_model(file_path)
-        print('Model loaded successfully')
+        from .inference import BatchingPredictor, PredictionCache
+        from .registry import ModelRegistry
+        # Connect the signal receivers
+        from . import signals
+
+        # TensorFlow and the model are loaded only on the first prediction or warm-up,
+        # so management commands and tests start fast
+        ApiConfig.registry = ModelRegistry(
+            settings.INFERENCE_MODEL_PATH,
+            settings.INFERENCE_BACKEND,
+            backend_options={
+                'quantization': settings.INFERENCE_QUANTIZATION,
+                'num_threads': settings.INFERENCE_NUM_THREADS,
+                'calibration_dir': settings.INFERENCE_CALIBRATION_DIR,
+            },
+            intra_op_threads=settings.INFERENCE_NUM_THREADS,
+            inter_op_threads=settings.INFERENCE_INTER_OP_THREADS,
+        )
+
+        # Collect concurrent predictions into batches so the model is called once per batch
+        ApiConfig.predictor = BatchingPredictor(
+            ApiConfig.registry.predict,
+            max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+            max_wait=settings.INFERENCE_MAX_WAIT_MS / 1000,
+        )
+
+        # Reuse predictions of repeated frames instead of running the model again
+        if settings.PREDICTION_CACHE_ENABLED:
+            ApiConfig.prediction_cache = PredictionCache(
+                max_size=settings.PREDICTION_CACHE_SIZE,
+                ttl=settings.PREDICTION_CACHE_TTL,
+                perceptual=settings.PREDICTION_CACHE_PERCEPTUAL,
+            )
+
+    def preload(self):
+        """
+        Import TensorFlow and read the model in the server's master process before workers are forked.
+        """
+        ApiConfig.registry.preload()
+
+    def warm_up(self):
+        """
+        Load the model and compile the graph before the server starts taking requests.
+        """
+        sizes = sorted({1, settings.INFERENCE_MAX_BATCH_SIZE})
+        ApiConfig.registry.warm_up(batch_sizes=sizes)
+        logger.info("Model warmed up in %.0f ms", ApiConfig.registry.timings['warm_up_ms'])
@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+import threading
+import hmac
+import time
+
+from .models import TokenRevocation
+
+# Auth of requests authenticated with the metrics token
+METRICS_SCRAPER = 'metrics-scraper'
+
+
+def revocation_cache_key(user_id):
+    return f'auth-revoked:{user_id}'
+
+
+def revocation_timeout():
+    # Access tokens get the issue time of their refresh token, so the revocation
+    # must be kept as long as the refresh tokens are valid
+    return int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+
+def revoke_user_tokens(user_id):
+    """
+    Reject all tokens of the user issued until now. Used when the user is deactivated or deleted,
+    because stateless authentication can't see the change from the token itself.
+    The revocation is stored in the database and cached for the checks of each request.
+    """
+    revoked_at = timezone.now()
+    TokenRevocation.objects.update_or_create(user_id=user_id, defaults={'revoked_at': revoked_at})
+    # Revocations older than the refresh tokens don't reject anything anymore
+    TokenRevocation.objects.filter(revoked_at__lt=revoked_at - api_settings.REFRESH_TOKEN_LIFETIME).delete()
+    cache.set(revocation_cache_key(user_id), int(revoked_at.timestamp()), revocation_timeout())
+    user_cache.discard(user_id)
+
+
+def check_revoked(validated_token):
+    """
+    Raise AuthenticationFailed if the token was issued before the user's tokens were revoked.
+    """
+    user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+    key = revocation_cache_key(user_id)
+    revoked_at = cache.get(key)
+    if revoked_at is None:
+        # Missing from the cache, for example after a cache restart, 0 when the tokens aren't revoked
+        revocation = TokenRevocation.objects.filter(user_id=user_id).values_list('revoked_at', flat=True).first()
+        revoked_at = int(revocation.timestamp()) if revocation is not None else 0
+        cache.add(key, revoked_at, revocation_timeout() if revoked_at else DEFAULT_TIMEOUT)
+    if revoked_at and validated_token.get('iat', 0) <= revoked_at:
+        raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+
+class UserCache:
+    """
+    Keep users loaded by the authentication in process memory for a few seconds,
+    so consecutive requests of the same user don't each query the database.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, user_id, user, timeout):
+        with self._lock:
+            # Remove expired users so the cache doesn't grow with every user ever seen
+            if len(self._users) >= settings.AUTH_USER_CACHE_SIZE:
+                now = time.monotonic()
+                self._users = {key: entry for key, entry in self._users.items() if entry[0] >= now}
+            if len(self._users) < settings.AUTH_USER_CACHE_SIZE:
+                self._users[user_id] = (time.monotonic() + timeout, user)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    SimpleJWT authentication that loads the full user from the database, but keeps
+    the user in process memory for AUTH_USER_CACHE_TTL seconds. Revoked tokens are rejected.
+    """
+
+    def get_user(self, validated_token):
+        check_revoked(validated_token)
+        timeout = settings.AUTH_USER_CACHE_TTL
+        if timeout <= 0:
+            return super().get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user, timeout)
+        return user
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    SimpleJWT authentication that trusts the claims of the verified access token and
+    doesn't query the database at all. The user is a lightweight TokenUser with the
+    id, username and staff status from the token. Used by the prediction views,
+    which don't need anything else from the user.
+    """
+
+    def get_user(self, validated_token):
+        # Tokens issued before the is_active claim was added are treated as active
+        if validated_token.get('is_active') is False:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        check_revoked(validated_token)
+        return super().get_user(validated_token)
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate the Prometheus scraper with the METRICS_TOKEN bearer token. Other tokens are left
+    for the JWT authentication, so admin users can read the metrics with their access token.
+    """
+
+    def authenticate(self, request):
+        expected = settings.METRICS_TOKEN
+        parts = get_authorization_header(request).split()
+        if not expected or len(parts) != 2 or parts[0].lower() != b'bearer':
+            return None
+        if not hmac.compare_digest(parts[1], expected.encode()):
+            return None
+        return AnonymousUser(), METRICS_SCRAPER
+
+    def authenticate_header(self, request):
+        # Answer unauthenticated requests with 401 like the JWT authentication
+        return 'Bearer realm="api"'
+
+
+class IsMetricsScraper(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == METRICS_SCRAPER
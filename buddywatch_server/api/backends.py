@@ -0,0 +1,233 @@
+from pathlib import Path
+import threading
+import logging
+import tempfile
+import time
+import os
+
+import numpy as np
+import tensorflow as tf
+
+logger = logging.getLogger(__name__)
+
+# Input shape of a batch for the object detection model, batch size can vary
+INPUT_SIGNATURE = [tf.TensorSpec(shape=(None, 120, 120, 3), dtype=tf.float32)]
+
+QUANTIZATIONS = ['none', 'float16', 'dynamic', 'int8']
+
+
+def configure_threads(intra_op_threads=0, inter_op_threads=0):
+    """
+    Limit the amount of threads TensorFlow uses for a single operation (intra-op)
+    and for running independent operations in parallel (inter-op). Zero lets TensorFlow decide.
+    Must be called before TensorFlow runs anything.
+    """
+    try:
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        # TensorFlow runtime has already been initialized, thread pools can't be changed anymore
+        logger.warning("Could not configure TensorFlow threads: %s", e)
+
+
+def make_serving_function(model):
+    """
+    Wrap the Keras model into tf.function with fixed input signature, so the graph
+    is traced once instead of going through model.predict for every call.
+    """
+    @tf.function(input_signature=INPUT_SIGNATURE)
+    def serve(inputs):
+        confidence, bbox = model(inputs, training=False)
+        return confidence, bbox
+
+    return serve
+
+
+class KerasBackend:
+    """
+    Run predictions with the Keras model loaded from the HDF5 file.
+    """
+    name = 'keras'
+
+    def __init__(self, model_path, **options):
+        self.model = tf.keras.models.load_model(model_path)
+
+    def predict(self, inputs):
+        return self.model.predict_on_batch(inputs)
+
+
+class FunctionBackend:
+    """
+    Run predictions with a concrete function compiled from the Keras model.
+    Avoids the per-call overhead of model.predict.
+    """
+    name = 'function'
+
+    def __init__(self, model_path, **options):
+        model = tf.keras.models.load_model(model_path)
+        self.function = make_serving_function(model).get_concrete_function()
+
+    def predict(self, inputs):
+        confidence, bbox = self.function(tf.convert_to_tensor(inputs, dtype=tf.float32))
+        return confidence.numpy(), bbox.numpy()
+
+
+class TFLiteBackend:
+    """
+    Run predictions with a TensorFlow Lite interpreter. The Keras model is converted
+    once and the converted model is cached next to the original model file.
+    Optionally the weights can be quantized to float16 or int8 to make the model
+    smaller and faster on CPU.
+    """
+    name = 'tflite'
+
+    def __init__(self, model_path, quantization='none', num_threads=0, calibration_dir=None, model_content=None,
+                 **options):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', use one of {', '.join(QUANTIZATIONS)}")
+        self.quantization = quantization
+        self.converted_path = self.converted_path_for(model_path, quantization)
+
+        if model_content is None:
+            if not self.is_converted(model_path, quantization):
+                logger.info('Converting model to TensorFlow Lite (%s)...', quantization)
+                # Write to a temporary file first, so other processes never read a half written model
+                temporary_path = self.converted_path.with_suffix(f'.{os.getpid()}.tmp')
+                temporary_path.write_bytes(self.convert(model_path, quantization, calibration_dir))
+                os.replace(temporary_path, self.converted_path)
+            model_content = self.converted_path.read_bytes()
+
+        # Interpreter uses the model bytes without copying them, so model read before
+        # forking server workers is shared by the workers
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads or None)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.batch_size = None
+        # Interpreter has internal buffers and can't be used from multiple threads at once
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def converted_path_for(model_path, quantization):
+        return Path(model_path).with_suffix(f'.{quantization}.tflite')
+
+    @staticmethod
+    def is_converted(model_path, quantization):
+        """
+        Check that the converted model exists and is newer than the Keras model.
+        """
+        converted_path = TFLiteBackend.converted_path_for(model_path, quantization)
+        return converted_path.exists() and converted_path.stat().st_mtime >= Path(model_path).stat().st_mtime
+
+    @staticmethod
+    def convert(model_path, quantization, calibration_dir=None):
+        """
+        Convert the Keras model into TensorFlow Lite flatbuffer.
+        """
+        model = tf.keras.models.load_model(model_path)
+        with tempfile.TemporaryDirectory() as saved_model_dir:
+            if hasattr(model, 'export'):
+                # Newer Keras versions export the model as SavedModel with its weights frozen in
+                model.export(saved_model_dir)
+                converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+            else:
+                converter = tf.lite.TFLiteConverter.from_keras_model(model)
+            TFLiteBackend.configure_quantization(converter, quantization, calibration_dir)
+            return converter.convert()
+
+    @staticmethod
+    def configure_quantization(converter, quantization, calibration_dir=None):
+        if quantization == 'float16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == 'dynamic':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        elif quantization == 'int8':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: representative_dataset(calibration_dir)
+
+    def _resize(self, batch_size):
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, [batch_size, 120, 120, 3])
+            self.interpreter.allocate_tensors()
+            # The outputs of the converted model have no names, tell them apart by their shapes
+            outputs = self.interpreter.get_output_details()
+            self.confidence_index = next(o['index'] for o in outputs if o['shape'][-1] == 1)
+            self.bbox_index = next(o['index'] for o in outputs if o['shape'][-1] == 4)
+            self.batch_size = batch_size
+
+    def predict(self, inputs):
+        with self.lock:
+            self._resize(len(inputs))
+            self.interpreter.set_tensor(self.input_index, np.asarray(inputs, dtype=np.float32))
+            self.interpreter.invoke()
+            return (self.interpreter.get_tensor(self.confidence_index),
+                    self.interpreter.get_tensor(self.bbox_index))
+
+
+BACKENDS = {backend.name: backend for backend in [KerasBackend, FunctionBackend, TFLiteBackend]}
+
+
+def load_backend(name, model_path, **options):
+    """
+    Load the model with the inference backend of the given name.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', use one of {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_path, **options)
+
+
+def load_images(directory, limit=None):
+    """
+    Load the images from the directory as normalized (N, 120, 120, 3) batch.
+    """
+    from .preprocessing import preprocess_batch
+
+    paths = sorted(path for path in Path(directory).iterdir()
+                   if path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.webp'])[:limit]
+    return preprocess_batch([str(path) for path in paths])
+
+
+def representative_dataset(calibration_dir=None, samples=100):
+    """
+    Yield sample inputs used to calibrate int8 quantization. Real images should be used
+    for accurate quantization, random images are used only if calibration_dir isn't given.
+    """
+    if calibration_dir and os.path.isdir(calibration_dir):
+        images = load_images(calibration_dir, samples)
+    else:
+        logger.warning('No calibration images given, calibrating int8 quantization with random images')
+        images = np.random.default_rng(0).random((samples, 120, 120, 3), dtype=np.float32)
+    for image in images:
+        yield [image[np.newaxis]]
+
+
+def compare_backends(reference, candidate, inputs, threshold=0.5):
+    """
+    Compare predictions of the candidate backend to the reference backend.
+
+    Returns:
+        dict: Largest differences in confidence and bounding box coordinates,
+        share of images where both backends agree if a face was detected,
+        and the average prediction time of both backends in milliseconds.
+    """
+    def timed(backend):
+        started = time.perf_counter()
+        confidence, bbox = backend.predict(inputs)
+        return np.asarray(confidence), np.asarray(bbox), (time.perf_counter() - started) * 1000
+
+    # Warm up both backends so tracing and allocations don't affect the timings
+    reference.predict(inputs)
+    candidate.predict(inputs)
+
+    reference_confidence, reference_bbox, reference_ms = timed(reference)
+    candidate_confidence, candidate_bbox, candidate_ms = timed(candidate)
+    return {
+        "images": len(inputs),
+        "max_confidence_diff": float(np.abs(reference_confidence - candidate_confidence).max()),
+        "max_bbox_diff": float(np.abs(reference_bbox - candidate_bbox).max()),
+        "detection_agreement": float(np.mean((reference_confidence > threshold) ==
+                                             (candidate_confidence > threshold))),
+        "reference_ms": reference_ms,
+        "candidate_ms": candidate_ms,
+    }
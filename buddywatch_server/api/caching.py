@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import VideoListVersion
+
+# Owners whose list version is bumped once at the end of a bulk change, None outside of bulk changes
+_deferred_owners = ContextVar('deferred_owners', default=None)
+
+
+def video_list_version_key(user_id):
+    return f'video-list-version:{user_id}'
+
+
+def get_video_list_version(user_id):
+    """
+    Get the current version of the user's video list. The version changes every time
+    a video of the user is created, changed or deleted.
+
+    The version is kept in the database and fronted by the shared cache, so polling an unchanged
+    list is a single cache lookup, and a cleared or evicted cache continues from the stored version.
+    """
+    key = video_list_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Users without a row have never changed their videos
+        version = VideoListVersion.objects.filter(owner_id=user_id).values_list('version', flat=True).first() or 0
+        # Expires with the default timeout, so a version read just before a change is committed isn't kept long
+        cache.add(key, version)
+    return version
+
+
+def bump_video_list_version(user_id):
+    """
+    Give the user's video list a new version, so ETags and cached lists of the old version don't match anymore.
+    The version is increased in the current transaction, so other processes see it when the change is committed.
+    """
+    deferred = _deferred_owners.get()
+    if deferred is not None:
+        deferred.add(user_id)
+        return
+    versions = VideoListVersion.objects.filter(owner_id=user_id)
+    if not versions.update(version=F('version') + 1):
+        _, created = VideoListVersion.objects.get_or_create(owner_id=user_id, defaults={'version': 1})
+        if not created:
+            versions.update(version=F('version') + 1)
+
+    # Dropped now so this transaction reads its own change, and again after the commit,
+    # because other processes may have cached the old version while the transaction was open
+    key = video_list_version_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@contextmanager
+def bulk_video_changes():
+    """
+    Bump the list version of each owner once when the block ends instead of once per changed video,
+    for example when many videos are deleted at once.
+    """
+    owners = set()
+    token = _deferred_owners.set(owners)
+    try:
+        yield
+    finally:
+        _deferred_owners.reset(token)
+    for owner_id in owners:
+        bump_video_list_version(owner_id)
+
+
+def video_list_cache_key(user_id, version, variant):
+    return f'video-list:{user_id}:{version}:{variant}'
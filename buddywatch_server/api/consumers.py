@@ -0,0 +1,156 @@
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.db import close_old_connections
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError, AuthenticationFailed
+from urllib.parse import parse_qs
+import asyncio
+import logging
+import json
+import time
+
+from .inference import predict_image
+
+# Close code sent when the access token is missing, invalid or expires during the stream
+CLOSE_UNAUTHORIZED = 4401
+
+logger = logging.getLogger(__name__)
+
+
+def get_raw_token(scope):
+    """
+    Get access token from the 'token' query parameter or from the Authorization header.
+    Browsers can't set headers for WebSocket connections, so the query parameter is the usual way.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2 and parts[0] == 'Bearer':
+                return parts[1]
+    return None
+
+
+def authenticate(raw_token):
+    """
+    Validate the access token with SimpleJWT and get the user it belongs to.
+    Returns the user and validated token, or None if the token isn't valid.
+    """
+    close_old_connections()
+    try:
+        authentication = JWTAuthentication()
+        validated_token = authentication.get_validated_token(raw_token)
+        user = authentication.get_user(validated_token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    finally:
+        close_old_connections()
+    if not user.is_active:
+        return None
+    return user, validated_token
+
+
+def predict_frame(frame):
+    """
+    Decode a single JPEG frame and predict it with the batching predictor,
+    or get the prediction from the prediction cache if it's enabled.
+    """
+    api_config = apps.get_app_config('api')
+    return predict_image(api_config.predictor, frame, api_config.prediction_cache)[0]
+
+
+class PredictConsumer:
+    """
+    WebSocket endpoint for streaming face detection. The client authenticates once with
+    SimpleJWT access token when connecting, then sends binary JPEG frames and gets
+    bounding box and confidence of each predicted frame back as JSON text messages.
+
+    Only the newest frame is kept while the previous frame is being predicted. When the
+    inference falls behind, older frames are dropped so results never lag behind the camera.
+    """
+
+    def __init__(self):
+        self.latest_frame = None
+        self.frame_available = asyncio.Event()
+        self.received = 0
+        self.dropped = 0
+        self.closed = False
+        self.token_expires_at = None
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        raw_token = get_raw_token(scope)
+        result = await sync_to_async(authenticate)(raw_token) if raw_token else None
+        if result is None:
+            # Closing before accepting rejects the handshake
+            await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+        user, validated_token = result
+        self.token_expires_at = validated_token.get('exp')
+
+        await send({'type': 'websocket.accept'})
+        inference = asyncio.create_task(self.run_inference(send))
+        try:
+            await self.receive_frames(receive, send)
+        finally:
+            self.closed = True
+            self.frame_available.set()
+            await inference
+
+    async def receive_frames(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive':
+                continue
+
+            if message.get('bytes'):
+                self.received += 1
+                # Replace the frame that is still waiting, it's stale now
+                if self.latest_frame is not None:
+                    self.dropped += 1
+                self.latest_frame = (self.received, message['bytes'])
+                self.frame_available.set()
+            else:
+                await self.send_json(send, {"success": False, "error": "Frames must be sent as binary messages"})
+
+    async def run_inference(self, send):
+        while True:
+            await self.frame_available.wait()
+            self.frame_available.clear()
+            if self.closed:
+                return
+            if self.latest_frame is None:
+                continue
+
+            if self.token_expires_at is not None and time.time() >= self.token_expires_at:
+                self.closed = True
+                await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+                return
+
+            sequence, frame = self.latest_frame
+            self.latest_frame = None
+            dropped, self.dropped = self.dropped, 0
+            try:
+                # Run decoding and prediction in a thread so the event loop keeps receiving frames
+                prediction = await asyncio.to_thread(predict_frame, frame)
+            except (OSError, ValueError) as e:
+                await self.send_json(send, {"success": False, "frame": sequence, "error": f"Invalid image: {e}"})
+                continue
+            except Exception:
+                # Any other failure is reported for the frame, so the stream keeps being predicted
+                logger.exception("Prediction of frame %s failed", sequence)
+                await self.send_json(send, {"success": False, "frame": sequence, "error": "Prediction failed"})
+                continue
+            await self.send_json(send, {"success": True, "frame": sequence, "dropped": dropped,
+                                        "prediction": prediction})
+
+    async def send_json(self, send, content):
+        if not self.closed:
+            await send({'type': 'websocket.send', 'text': json.dumps(content)})
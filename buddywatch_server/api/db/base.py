@@ -0,0 +1,108 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+import os
+
+from .pool import ConnectionPool, PoolTimeout, pools, pools_lock, close_pools
+
+
+def check_connection(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not connection.autocommit:
+        connection.rollback()
+
+
+def is_broken(connection):
+    return connection.closed != 0
+
+
+def reset_connection(connection):
+    # Roll back transaction left open, for example when the connection was closed in an atomic block
+    if connection.get_transaction_status() != base.Database.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Close the pooled connections before the test database is created or destroyed,
+    PostgreSQL can't drop a database that has open connections.
+    """
+
+    def _create_test_db(self, verbosity, autoclobber, keepdb=False):
+        close_pools(self.connection.alias)
+        return super()._create_test_db(verbosity, autoclobber, keepdb)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend that takes connections from a pool kept in the process instead of
+    opening a new connection for each request. Closing the connection returns it to the pool.
+    The pool is configured with the 'pool' dictionary in the database OPTIONS with keys
+    min_size, max_size, timeout and check_after.
+    """
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        # Pool options aren't connection parameters of psycopg2
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_pool(self, conn_params):
+        key = (self.alias, os.getpid(), tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+        pool = pools.get(key)
+        if pool is None:
+            with pools_lock:
+                pool = pools.get(key)
+                if pool is None:
+                    # Connections inherited from the parent process must not be used after fork
+                    for other in [other for other in pools if other[0] == self.alias and other[1] != key[1]]:
+                        del pools[other]
+                    options = self.settings_dict['OPTIONS'].get('pool') or {}
+                    pool = pools[key] = ConnectionPool(
+                        lambda: self.connect_new(conn_params),
+                        min_size=options.get('min_size', 0),
+                        max_size=options.get('max_size', 10),
+                        timeout=options.get('timeout', 10),
+                        check=check_connection,
+                        check_after=options.get('check_after', 30),
+                        is_broken=is_broken,
+                        reset=reset_connection,
+                    )
+        return pool
+
+    def connect_new(self, conn_params):
+        connection = self.Database.connect(**conn_params)
+        # Avoid decoding jsonb twice, same as Django does for its own connections
+        base.psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def get_new_connection(self, conn_params):
+        if base.is_psycopg3:
+            raise ImproperlyConfigured('api.db backend supports only psycopg2')
+
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = base.IsolationLevel(
+                options.get('isolation_level', base.IsolationLevel.READ_COMMITTED))
+        except ValueError:
+            raise ImproperlyConfigured(f"Invalid transaction isolation level {options['isolation_level']} specified.")
+
+        self.pool = self.get_pool(conn_params)
+        try:
+            connection = self.pool.getconn()
+        except PoolTimeout as e:
+            # Let Django handle the timeout like any other failed connection
+            raise self.Database.OperationalError(str(e))
+        # Connection may have been used with another isolation level before
+        connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,178 @@
+from collections import deque
+import threading
+import time
+import os
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of database connections. Connections are created lazily up to
+    max_size, and requests for a connection wait up to timeout seconds when all
+    connections are in use. Connections that have been idle longer than check_after
+    seconds are checked with check before they are handed out, and broken connections
+    are replaced with new ones.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=10, timeout=10, check=None, check_after=30,
+                 is_broken=None, reset=None):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check = check
+        self.check_after = check_after
+        self.is_broken = is_broken or (lambda connection: False)
+        self.reset = reset
+        self.pid = os.getpid()
+
+        self._idle = deque()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self.stats = {"checkouts": 0, "waits": 0, "timeouts": 0, "created": 0, "discarded": 0}
+
+        for _ in range(min_size):
+            self._idle.append((self._create(), time.monotonic()))
+
+    def _create(self):
+        connection = self.connect()
+        self.stats["created"] += 1
+        self._size += 1
+        return connection
+
+    def _discard(self, connection):
+        self._size -= 1
+        self.stats["discarded"] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """
+        Get a connection from the pool. Raises PoolTimeout if no connection becomes free in time.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._available:
+            waited = False
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(f'No free database connection in {self.timeout} seconds '
+                                      f'({self.max_size} connections in use)')
+                waited = True
+                self._available.wait(remaining)
+            if waited:
+                self.stats["waits"] += 1
+            self.stats["checkouts"] += 1
+
+            if self._idle:
+                connection, idle_since = self._idle.pop()
+            else:
+                # Reserve the place in the pool before connecting outside the lock
+                self._size += 1
+                connection, idle_since = None, None
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self._available:
+                    self._size -= 1
+                    self._available.notify()
+                raise
+            with self._lock:
+                self.stats["created"] += 1
+            return connection
+
+        if not self.is_healthy(connection, idle_since):
+            with self._available:
+                self._discard(connection)
+                self._available.notify()
+            return self.getconn()
+        return connection
+
+    def is_healthy(self, connection, idle_since):
+        if self.is_broken(connection):
+            return False
+        if self.check is not None and time.monotonic() - idle_since >= self.check_after:
+            try:
+                self.check(connection)
+            except Exception:
+                return False
+        return True
+
+    def putconn(self, connection):
+        """
+        Return the connection to the pool. Broken connections and connections
+        that can't be reset are closed.
+        """
+        healthy = not self.is_broken(connection)
+        if healthy and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception:
+                healthy = False
+        with self._available:
+            if healthy:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                self._discard(connection)
+            self._available.notify()
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._available:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._discard(connection)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self.stats,
+            }
+
+
+# Pools of the process by database alias, process id and connection parameters,
+# shared by the connections of all threads
+pools = {}
+pools_lock = threading.Lock()
+
+
+def close_pools(alias):
+    """
+    Close the idle connections of the alias and forget its pools.
+    """
+    with pools_lock:
+        for key in [key for key in pools if key[0] == alias]:
+            pools.pop(key).close()
+
+
+def pool_stats():
+    """
+    Connection counts and checkout statistics of the pools of this process by database alias.
+    An alias has several pools when its connection parameters changed, for example when the
+    test database replaced the database name, and the counts of its pools are added together.
+    """
+    stats = {}
+    for (alias, pid, params), pool in list(pools.items()):
+        if pid != os.getpid():
+            continue
+        totals = stats.setdefault(alias, {"pools": 0})
+        totals['pools'] += 1
+        for name, value in pool.snapshot().items():
+            totals[name] = totals.get(name, 0) + value
+    return stats
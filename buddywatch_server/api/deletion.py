@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models import F
+import logging
+
+from .caching import bulk_video_changes
+from .models import Video, StorageDeletion
+from .storage import delete_files
+
+logger = logging.getLogger(__name__)
+
+# Results of files that are gone from the storage
+DELETED_RESULTS = ('deleted', 'missing')
+
+
+def delete_stored_files(deletions):
+    """
+    Delete the files of the StorageDeletion records from the storage concurrently. Records of
+    deleted files are removed, and failed records are kept for the next retry with their error.
+
+    Returns:
+        dict: Result of each file: 'deleted', 'missing', or the error message.
+    """
+    storage = Video._meta.get_field('file').storage
+    results = delete_files(storage, [deletion.name for deletion in deletions])
+    StorageDeletion.objects.filter(pk__in=[deletion.pk for deletion in deletions
+                                           if results[deletion.name] in DELETED_RESULTS]).delete()
+    for deletion in deletions:
+        if results[deletion.name] not in DELETED_RESULTS:
+            StorageDeletion.objects.filter(pk=deletion.pk).update(attempts=F('attempts') + 1,
+                                                                  last_error=results[deletion.name])
+    return results
+
+
+def retry_storage_deletions(batch_size=1000):
+    """
+    Delete the files left in the storage by deletes that failed or were interrupted, oldest first.
+    Each file is tried once per call.
+
+    Returns:
+        tuple: Amount of files deleted and amount of files that still failed.
+    """
+    deleted = failed = 0
+    last_pk = 0
+    while True:
+        deletions = list(StorageDeletion.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not deletions:
+            return deleted, failed
+        results = delete_stored_files(deletions)
+        succeeded = sum(result in DELETED_RESULTS for result in results.values())
+        deleted += succeeded
+        failed += len(results) - succeeded
+        last_pk = deletions[-1].pk
+
+
+def delete_videos(videos):
+    """
+    Delete the videos of the queryset with a single database delete, then delete their files
+    and thumbnails from the storage concurrently.
+
+    The file fields are cleared in the same transaction before the delete, so django-cleanup
+    doesn't delete the files one at a time when the deleted rows are signalled. The files to
+    delete are recorded as StorageDeletions in the same transaction and deleted only after it
+    has committed, so a failed delete never leaves rows without their files, and files whose
+    delete fails or is interrupted are deleted later by the purge_videos command.
+
+    Returns:
+        list: ID of each deleted video and the result of deleting each of its files.
+    """
+    with transaction.atomic():
+        rows = list(videos.select_for_update().values_list('pk', 'file', 'thumbnail'))
+        pks = [pk for pk, _, _ in rows]
+        if not pks:
+            return []
+        Video.objects.filter(pk__in=pks).update(file='', thumbnail=None)
+        # Signals of the deleted rows bump the list version of each owner once
+        with bulk_video_changes():
+            Video.objects.filter(pk__in=pks).delete()
+        names = [name for _, file, thumbnail in rows for name in (file, thumbnail) if name]
+        deletions = StorageDeletion.objects.bulk_create([StorageDeletion(name=name) for name in names])
+
+    results = delete_stored_files(deletions) if deletions else {}
+    report = []
+    for pk, file, thumbnail in rows:
+        files = {field: results[name] for field, name in [('file', file), ('thumbnail', thumbnail)] if name}
+        for field, result in files.items():
+            if result not in DELETED_RESULTS:
+                logger.warning('Could not delete %s of video %s: %s', field, pk, result)
+        report.append({"id": pk, "files": files})
+    return report
@@ -0,0 +1,381 @@
+from collections import OrderedDict, deque
+import threading
+import hashlib
+import queue
+import time
+import io
+import os
+
+import numpy as np
+
+from .metrics import stage, observe_stage, timing_enabled
+from .preprocessing import MODEL_IMAGE_SIZE, preprocess_image, batch_buffer
+
+# The perceptual hash averages the input over a grid of blocks and quantizes each block to a few levels
+PERCEPTUAL_HASH_GRID = 12
+PERCEPTUAL_HASH_LEVELS = 16
+
+
+class InferenceStats:
+    """
+    Thread safe counters for batch sizes and queue wait times of the batching predictor.
+    Recent wait times are kept in a bounded window so percentiles reflect the current load.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.batches = 0
+        self.frames = 0
+        self.errors = 0
+        self.max_batch_size = 0
+        self.batch_sizes = {}
+        self.forward_seconds = 0.0
+
+    def record_batch(self, size, waits, forward_seconds):
+        with self._lock:
+            self.batches += 1
+            self.frames += size
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.forward_seconds += forward_seconds
+            self._waits.extend(waits)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        """
+        Return the collected statistics in a serializable format.
+        Wait times are reported in milliseconds.
+        """
+        with self._lock:
+            waits = np.array(self._waits, dtype=np.float64) * 1000
+            snapshot = {
+                "batches": self.batches,
+                "frames": self.frames,
+                "errors": self.errors,
+                "average_batch_size": self.frames / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "average_forward_ms": self.forward_seconds * 1000 / self.batches if self.batches else 0.0,
+            }
+        if waits.size:
+            p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+            snapshot["queue_wait_ms"] = {"p50": p50, "p95": p95, "p99": p99, "max": waits.max()}
+        else:
+            snapshot["queue_wait_ms"] = {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        return snapshot
+
+
+class PendingPrediction:
+    """
+    One or more images of a single request waiting in the queue of the batching predictor.
+    """
+
+    def __init__(self, image_arrays):
+        self.image_arrays = image_arrays
+        self.size = len(image_arrays)
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+        self.forward_seconds = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError('Prediction was not completed in time')
+        if self.error is not None:
+            raise self.error
+        # Recorded on the thread of the request, so the forward pass is in the timings of the request
+        if self.forward_seconds is not None and timing_enabled():
+            observe_stage('forward', self.forward_seconds)
+        return self.results
+
+
+def format_prediction(y_pred, index):
+    """
+    Get bounding box and confidence of one image from the model output
+    and convert them into serializable format.
+    """
+    return {
+        "bbox": y_pred[1][index].tolist(),
+        "confidence": float(y_pred[0][index][0])
+    }
+
+
+class BatchingPredictor:
+    """
+    Collect images from concurrent requests into one (N, 120, 120, 3) batch and run
+    a single forward pass for the whole batch. A batch is sent to the model when it
+    has max_batch_size images or when the oldest image has waited max_wait seconds.
+    A single request with more than max_batch_size images is predicted on its own.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait=0.005):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.stats = InferenceStats()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._carry = None
+        self._worker = None
+        self._worker_pid = None
+
+    def submit(self, image_arrays):
+        """
+        Queue preprocessed images of shape (N, 120, 120, 3) for prediction.
+        Images of one submit are always predicted in the same forward pass.
+
+        Returns:
+            PendingPrediction: Handle which can be waited for the results.
+        """
+        self._ensure_worker()
+        pending = PendingPrediction(image_arrays)
+        self._queue.put(pending)
+        return pending
+
+    def predict(self, image_array, timeout=None):
+        """
+        Predict the bounding box and confidence for a single image of shape (120, 120, 3).
+
+        Returns:
+            dict: Bounding box coordinates and confidence score.
+        """
+        return self.submit(np.expand_dims(image_array, axis=0)).wait(timeout)[0]
+
+    def predict_batch(self, image_arrays, timeout=None):
+        """
+        Predict the bounding boxes and confidences for a batch of shape (N, 120, 120, 3).
+
+        Returns:
+            list: Bounding box coordinates and confidence score of each image in order.
+        """
+        return self.submit(image_arrays).wait(timeout)
+
+    def _ensure_worker(self):
+        # Worker threads don't survive fork, so start the worker lazily in the serving process
+        if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != os.getpid() or not self._worker.is_alive():
+                if self._worker_pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._carry = None
+                self._worker = threading.Thread(target=self._run, name='batching-predictor', daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def _collect_batch(self):
+        # Request that didn't fit into the previous batch starts the next one
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+        batch = [first]
+        frames = first.size
+        deadline = first.enqueued_at + self.max_wait
+        while frames < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    pending = self._queue.get(timeout=remaining)
+                else:
+                    # Take whatever is already waiting without blocking
+                    pending = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if frames + pending.size > self.max_batch_size:
+                self._carry = pending
+                break
+            batch.append(pending)
+            frames += pending.size
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            self._process(batch)
+
+    def _process(self, batch):
+        started = time.monotonic()
+        waits = [started - pending.enqueued_at for pending in batch for _ in range(pending.size)]
+        try:
+            if len(batch) == 1:
+                inputs = batch[0].image_arrays
+            else:
+                inputs = np.concatenate([pending.image_arrays for pending in batch])
+            y_pred = self.predict_fn(inputs)
+            forward_seconds = time.monotonic() - started
+            index = 0
+            for pending in batch:
+                pending.results = [format_prediction(y_pred, i) for i in range(index, index + pending.size)]
+                pending.forward_seconds = forward_seconds
+                index += pending.size
+            self.stats.record_batch(len(inputs), waits, forward_seconds)
+        except Exception as e:
+            self.stats.record_error()
+            for pending in batch:
+                pending.error = e
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+
+def content_hash(image_file):
+    """
+    Hash of the encoded image bytes. Accepts bytes or an uploaded file, which is read in chunks
+    and rewound so it can be decoded afterwards.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(image_file, (bytes, bytearray, memoryview)):
+        digest.update(image_file)
+    else:
+        for chunk in image_file.chunks():
+            digest.update(chunk)
+        image_file.seek(0)
+    return 'content:' + digest.hexdigest()
+
+
+def perceptual_hash(image_array):
+    """
+    Hash of the preprocessed (120, 120, 3) input that is the same for frames which differ only by
+    small noise, such as consecutive frames of a static camera. The grayscale input is averaged over
+    a 12x12 grid of blocks and each block is quantized to 16 brightness levels.
+    """
+    block = MODEL_IMAGE_SIZE[0] // PERCEPTUAL_HASH_GRID
+    gray = image_array.mean(axis=2)
+    blocks = gray.reshape(PERCEPTUAL_HASH_GRID, block, PERCEPTUAL_HASH_GRID, block).mean(axis=(1, 3))
+    levels = np.minimum(blocks * PERCEPTUAL_HASH_LEVELS, PERCEPTUAL_HASH_LEVELS - 1).astype(np.uint8)
+    return 'perceptual:' + hashlib.blake2b(levels.tobytes(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """
+    Least recently used cache of predictions in process memory. Predictions are cached by the
+    hash of the image bytes, and optionally by the perceptual hash of the preprocessed input, so
+    repeated frames of a static camera skip the forward pass. Entries expire after ttl seconds and
+    at most max_size entries are kept.
+    """
+
+    def __init__(self, max_size=1024, ttl=5.0, perceptual=False):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self.perceptual = perceptual
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.content_hits = 0
+        self.perceptual_hits = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, keys, prediction):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (expires_at, prediction)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def record_lookup(self, hit=None):
+        with self._lock:
+            self.lookups += 1
+            if hit == 'content':
+                self.content_hits += 1
+            elif hit == 'perceptual':
+                self.perceptual_hits += 1
+
+    def snapshot(self):
+        """
+        Return the hit counts and hit ratio in a serializable format.
+        """
+        with self._lock:
+            hits = self.content_hits + self.perceptual_hits
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "perceptual": self.perceptual,
+                "lookups": self.lookups,
+                "content_hits": self.content_hits,
+                "perceptual_hits": self.perceptual_hits,
+                "misses": self.lookups - hits,
+                "hit_ratio": hits / self.lookups if self.lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def predict_image(predictor, image_file, cache=None, gate=None):
+    """
+    Preprocess a single image, given as bytes or a file, and predict it with the batching predictor.
+    When the prediction cache is given, a cached prediction of the same image is returned without
+    preprocessing it, and a cached prediction of a nearly identical image without running the model.
+    When the motion gate of a camera session is given, the prediction of the session's previous
+    frame is returned if the image has no motion.
+    Raises InvalidImageError if the image can't be decoded.
+
+    Returns:
+        tuple: Bounding box coordinates and confidence score, and where they came from:
+        'model', 'cache' or 'motion'.
+    """
+    data = image_file
+    if isinstance(image_file, (bytes, bytearray, memoryview)):
+        image_file = io.BytesIO(image_file)
+
+    keys = []
+    if cache is not None:
+        keys.append(content_hash(data))
+        prediction = cache.get(keys[0])
+        if prediction is not None:
+            cache.record_lookup('content')
+            return dict(prediction), 'cache'
+
+    image_array = preprocess_image(image_file, batch_buffer(1)[0])
+    if gate is not None:
+        prediction = gate.check(image_array)
+        if prediction is not None:
+            # The content lookup missed, count it so gated frames don't raise the hit ratio
+            if cache is not None:
+                cache.record_lookup()
+            return dict(prediction), 'motion'
+
+    source = 'model'
+    prediction = None
+    if cache is not None and cache.perceptual:
+        keys.append(perceptual_hash(image_array))
+        prediction = cache.get(keys[1])
+        if prediction is not None:
+            cache.record_lookup('perceptual')
+            # Exact same bytes are found without preprocessing next time
+            cache.set(keys[:1], prediction)
+            source = 'cache'
+
+    if prediction is None:
+        # Time waiting for the batch and the forward pass, the forward pass alone is timed by the predictor
+        with stage('inference'):
+            prediction = predictor.predict(image_array)
+        if cache is not None:
+            cache.record_lookup()
+            cache.set(keys, prediction)
+    if gate is not None:
+        gate.update(prediction)
+    return dict(prediction), source
@@ -0,0 +1,174 @@
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+import traceback
+import logging
+
+from .caching import bump_video_list_version
+from .analysis import analyze_video_file
+from .models import Video, VideoJob, VideoTimeline
+from .utils import local_video_path, create_thumbnail, read_video_metadata, save_thumbnail
+
+logger = logging.getLogger(__name__)
+
+
+def process_video(video, source=None):
+    """
+    Generate thumbnail and read metadata of an uploaded video. The uploaded file can be
+    given as source to avoid reading the video back from the storage.
+    """
+    source = source or video.file
+    try:
+        with local_video_path(source) as video_path:
+            metadata = read_video_metadata(video_path)
+            thumbnail = create_thumbnail(video_path)
+    finally:
+        if source is video.file:
+            video.file.close()
+
+    for field, value in metadata.items():
+        setattr(video, field, value)
+    video.size = source.size
+    if thumbnail is not None:
+        save_thumbnail(thumbnail, video, save=False)
+    video.processing_status = Video.PROCESSING_READY
+    video.save(update_fields=['size', 'duration', 'fps', 'width', 'height', 'thumbnail', 'processing_status'])
+
+    if settings.VIDEO_ANALYSIS_ON_UPLOAD:
+        request_analysis(video)
+
+
+def analyze_video(video):
+    """
+    Detect faces in the sampled frames of the video with the loaded model
+    and store them as the video's timeline.
+    """
+    timeline = VideoTimeline.objects.get(video=video)
+    timeline.status = VideoTimeline.STATUS_RUNNING
+    timeline.save(update_fields=['status', 'updated_at'])
+
+    registry = apps.get_app_config('api').registry
+    try:
+        with local_video_path(video.file) as video_path:
+            detections = analyze_video_file(
+                video_path,
+                registry.predict,
+                timeline.sample_rate,
+                batch_size=settings.VIDEO_ANALYSIS_BATCH_SIZE,
+                workers=settings.VIDEO_ANALYSIS_WORKERS,
+                duration=video.duration,
+            )
+    finally:
+        video.file.close()
+
+    timeline.detections = detections.tobytes()
+    timeline.samples = len(detections)
+    timeline.status = VideoTimeline.STATUS_READY
+    timeline.error = ''
+    timeline.save(update_fields=['detections', 'samples', 'status', 'error', 'updated_at'])
+
+
+def request_analysis(video, sample_rate=None):
+    """
+    Reset the timeline of the video to pending and queue the analyze job for it.
+    """
+    sample_rate = sample_rate or settings.VIDEO_ANALYSIS_SAMPLE_RATE
+    timeline, _ = VideoTimeline.objects.update_or_create(
+        video=video, defaults={'status': VideoTimeline.STATUS_PENDING, 'sample_rate': sample_rate, 'error': ''})
+    enqueue_job(video, kind=VideoJob.KIND_ANALYZE)
+    timeline.refresh_from_db()
+    return timeline
+
+
+def fail_processing(job):
+    Video.objects.filter(pk=job.video_id).update(processing_status=Video.PROCESSING_FAILED)
+    # Queryset updates don't send signals, so the list is invalidated here
+    bump_video_list_version(job.video.owner_id)
+
+
+def fail_analysis(job):
+    VideoTimeline.objects.filter(video_id=job.video_id).update(status=VideoTimeline.STATUS_FAILED,
+                                                              error=job.last_error)
+
+
+# Functions that run each kind of job, they get the video of the job as argument
+JOB_HANDLERS = {
+    VideoJob.KIND_PROCESS: process_video,
+    VideoJob.KIND_ANALYZE: analyze_video,
+}
+
+# Functions called with the job when it has failed for the last time
+JOB_FAILURE_HANDLERS = {
+    VideoJob.KIND_PROCESS: fail_processing,
+    VideoJob.KIND_ANALYZE: fail_analysis,
+}
+
+
+def enqueue_job(video, kind=VideoJob.KIND_PROCESS, **kwargs):
+    """
+    Queue a background job for the video. If VIDEO_JOBS_ASYNC is off, the job is run
+    immediately in the current process and extra arguments are passed to the job handler.
+    """
+    job = VideoJob.objects.create(video=video, kind=kind)
+    if not settings.VIDEO_JOBS_ASYNC:
+        job.status = VideoJob.STATUS_RUNNING
+        job.attempts = 1
+        job.started_at = timezone.now()
+        job.save()
+        run_job(job, **kwargs)
+    return job
+
+
+def claim_job(worker):
+    """
+    Take the oldest due job from the queue and mark it running. Jobs that have been
+    running longer than VIDEO_JOB_TIMEOUT are taken again, their worker has most likely died.
+    Locked rows are skipped so multiple workers can take jobs at the same time.
+
+    Returns:
+        VideoJob: Claimed job, or None if there are no due jobs.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.VIDEO_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = (VideoJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(Q(status=VideoJob.STATUS_QUEUED, run_after__lte=now) |
+                       Q(status=VideoJob.STATUS_RUNNING, started_at__lt=stale))
+               .order_by('run_after', 'id')
+               .first())
+        if job is None:
+            return None
+        job.status = VideoJob.STATUS_RUNNING
+        job.attempts += 1
+        job.started_at = now
+        job.worker = worker
+        job.save(update_fields=['status', 'attempts', 'started_at', 'worker', 'updated_at'])
+    return job
+
+
+def run_job(job, **kwargs):
+    """
+    Run the claimed job. Failed jobs are retried with exponential backoff until
+    VIDEO_JOB_MAX_ATTEMPTS is reached, after which the video or its timeline is marked as failed.
+    """
+    try:
+        JOB_HANDLERS[job.kind](job.video, **kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < settings.VIDEO_JOB_MAX_ATTEMPTS:
+            job.status = VideoJob.STATUS_QUEUED
+            delay = settings.VIDEO_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+        else:
+            job.status = VideoJob.STATUS_FAILED
+            JOB_FAILURE_HANDLERS[job.kind](job)
+        logger.warning('Job %s (%s) failed on attempt %s: %s', job.pk, job.kind, job.attempts, job.last_error)
+    else:
+        job.status = VideoJob.STATUS_DONE
+        job.last_error = ''
+    job.save(update_fields=['status', 'run_after', 'last_error', 'updated_at'])
+    return job.status == VideoJob.STATUS_DONE
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+import numpy as np
+import json
+import os
+
+from api.backends import BACKENDS, QUANTIZATIONS, load_backend, load_images, compare_backends
+
+
+class Command(BaseCommand):
+    help = ('Compare predictions of an inference backend to the Keras model to make sure '
+            'switching the backend does not change the results.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=settings.INFERENCE_BACKEND, choices=list(BACKENDS),
+                            help='Backend to compare against the Keras model.')
+        parser.add_argument('--quantization', default=settings.INFERENCE_QUANTIZATION, choices=QUANTIZATIONS,
+                            help='Quantization used when the backend converts the model.')
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, 'testing'),
+                            help='Directory of images used for the comparison.')
+        parser.add_argument('--random', type=int, default=32,
+                            help='Amount of random images added to the comparison.')
+        parser.add_argument('--tolerance', type=float, default=0.02,
+                            help='Largest allowed difference in confidence and bounding box coordinates.')
+
+    def handle(self, *args, **options):
+        inputs = [np.random.default_rng(0).random((options['random'], 120, 120, 3), dtype=np.float32)]
+        if os.path.isdir(options['images']):
+            inputs.append(load_images(options['images']))
+        inputs = np.concatenate(inputs)
+        if not len(inputs):
+            raise CommandError('No images to compare')
+
+        reference = load_backend('keras', settings.INFERENCE_MODEL_PATH)
+        candidate = load_backend(options['backend'], settings.INFERENCE_MODEL_PATH,
+                                 quantization=options['quantization'],
+                                 num_threads=settings.INFERENCE_NUM_THREADS,
+                                 calibration_dir=settings.INFERENCE_CALIBRATION_DIR)
+        result = compare_backends(reference, candidate, inputs)
+        self.stdout.write(json.dumps(result, indent=2))
+
+        # Comparison is written so that NaN values fail the check
+        if not max(result['max_confidence_diff'], result['max_bbox_diff']) <= options['tolerance']:
+            raise CommandError(f"Backend '{options['backend']}' differs from the Keras model "
+                               f"more than the tolerance {options['tolerance']}")
+        self.stdout.write(self.style.SUCCESS(f"Backend '{options['backend']}' matches the Keras model"))
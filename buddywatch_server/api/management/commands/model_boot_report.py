@@ -0,0 +1,72 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+import numpy as np
+import subprocess
+import json
+import time
+import sys
+import os
+
+from api.registry import max_rss_mb
+
+# Script run in a fresh interpreter to measure how long starting Django takes without the model
+DJANGO_SETUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_ms = (time.perf_counter() - started) * 1000
+from api.registry import max_rss_mb
+import sys
+print(json.dumps({"django_setup_ms": setup_ms, "max_rss_mb": max_rss_mb(),
+                  "tensorflow_imported": "tensorflow" in sys.modules}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure how long starting Django, loading the model and warming it up takes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Amount of predictions used to measure the steady state latency.')
+        parser.add_argument('--output', help='Write the report as JSON to this file.')
+
+    def handle(self, *args, **options):
+        # Measure a process that never predicts, like migrate or shell
+        api_config = apps.get_app_config('api')
+        project_dir = os.path.dirname(api_config.path)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE',
+                                                                      'buddywatch_server.settings'))
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', DJANGO_SETUP_SCRIPT], cwd=project_dir, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        without_model = json.loads(output.strip().splitlines()[-1])
+        without_model['process_ms'] = (time.perf_counter() - started) * 1000
+
+        # Measure loading and warming up the model in this process
+        rss_before = max_rss_mb()
+        api_config.warm_up()
+
+        image = np.zeros((1, 120, 120, 3), dtype=np.float32)
+        latencies = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            api_config.registry.predict(image)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        model = api_config.registry.report()
+        report = {
+            "without_model": without_model,
+            "model": {
+                "backend": model['backend'],
+                **model['timings'],
+                "steady_predict_ms": float(np.median(latencies)),
+                "rss_before_load_mb": rss_before,
+                "rss_after_warm_up_mb": model['max_rss_mb'],
+            },
+        }
+        report_json = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(report_json)
+        self.stdout.write(report_json)
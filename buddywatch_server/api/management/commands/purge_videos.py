@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from api.deletion import retry_storage_deletions
+from api.models import Video
+from api.retention import purge_user
+
+
+class Command(BaseCommand):
+    help = ('Delete the oldest videos of each user that are over the limits of the user\'s retention policy, '
+            'and the files left in the storage by earlier deletes. Safe to run again after an interruption, '
+            'for example periodically from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Purge only the videos of the user with this username.')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Videos deleted per transaction (default RETENTION_CHUNK_SIZE).')
+        parser.add_argument('--time-limit', type=float, default=None,
+                            help='Stop after this many seconds, the next run continues where this one stopped.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only show how many videos and bytes would be purged.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        deadline = started + options['time_limit'] if options['time_limit'] else None
+
+        if not options['dry_run']:
+            deleted, failed = retry_storage_deletions()
+            if deleted or failed:
+                self.stdout.write(f'Deleted {deleted} files left by earlier deletes, {failed} still failed')
+
+        if options['user']:
+            try:
+                owner_ids = [User.objects.get(username=options['user']).pk]
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+        else:
+            # Only users with videos, read from the owner index
+            owner_ids = list(Video.objects.order_by('owner_id').values_list('owner_id', flat=True).distinct())
+
+        total_videos = total_bytes = 0
+        for owner_id in owner_ids:
+            result = purge_user(owner_id, options['chunk_size'], options['dry_run'], deadline)
+            if result['videos']:
+                self.stdout.write(f"User {owner_id}: {'would purge' if options['dry_run'] else 'purged'} "
+                                  f"{result['videos']} videos, {result['bytes']} bytes")
+            total_videos += result['videos']
+            total_bytes += result['bytes']
+            if not result['complete'] or (deadline is not None and time.monotonic() >= deadline):
+                self.stdout.write('Time limit reached, run again to continue')
+                break
+
+        self.stdout.write(f"{'Would purge' if options['dry_run'] else 'Purged'} {total_videos} videos, "
+                          f"{total_bytes} bytes in {time.monotonic() - started:.1f} s")
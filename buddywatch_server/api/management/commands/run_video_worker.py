@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import socket
+import time
+import os
+
+from api.jobs import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = ('Run background jobs of uploaded videos, such as thumbnail generation and metadata extraction. '
+            'Multiple workers can be run at the same time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before checking the queue again when it is empty.')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit when there are no more due jobs instead of waiting for new ones.')
+
+    def handle(self, *args, **options):
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f'Video worker {worker} started')
+        while True:
+            close_old_connections()
+            try:
+                job = claim_job(worker)
+                if job is not None:
+                    succeeded = run_job(job)
+                    self.stdout.write(f"Job {job.pk} ({job.kind}) of video {job.video_id}: "
+                                      f"{'done' if succeeded else job.status}")
+                    continue
+            except Exception as e:
+                # Keep the worker alive, for example when the video was deleted while it was processed
+                self.stderr.write(f'Error while running job: {e}')
+                time.sleep(options['poll_interval'])
+                continue
+            if options['burst']:
+                return
+            time.sleep(options['poll_interval'])
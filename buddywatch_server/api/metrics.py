@@ -0,0 +1,282 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from django.conf import settings
+import threading
+import bisect
+import time
+import math
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Counter:
+    """
+    Monotonically increasing count for each combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + '_total', tuple(zip(self.labelnames, key)), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets for each combination of label values,
+    so percentiles can be calculated over any time window by the monitoring system.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts of each bucket, the overflow bucket, and the sum of the values
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', format_value(bound)),), cumulative
+            yield self.name + '_count', labels, cumulative
+            yield self.name + '_sum', labels, counts[-1]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """
+    Current values read by a function when the metrics are collected, used to export
+    statistics that are already kept elsewhere, such as the connection pools.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in self.collect():
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    'buddywatch_http_requests', 'HTTP requests by route, method and status code.',
+    ['route', 'method', 'status']))
+REQUEST_SECONDS = registry.register(Histogram(
+    'buddywatch_http_request_duration_seconds', 'Time to produce the HTTP response by route and method.',
+    ['route', 'method']))
+STAGE_SECONDS = registry.register(Histogram(
+    'buddywatch_stage_duration_seconds', 'Time spent in each stage of the request handling.', ['stage']))
+
+# Stage timings of the request being handled, None outside of requests
+_request_stages = ContextVar('request_stages', default=None)
+
+_disabled_stage = nullcontext()
+
+
+def timing_enabled():
+    """
+    Stages are timed when the metrics or the request logs need the timings.
+    """
+    return settings.METRICS_ENABLED or settings.METRICS_LOG_REQUESTS
+
+
+def observe_stage(name, seconds):
+    """
+    Record time spent in a stage, also in the stage timings of the current request.
+    """
+    if settings.METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _request_stages.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def _timed_stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def stage(name):
+    """
+    Context manager timing a stage of the request handling, for example the decoding of an image.
+    Does nothing when neither metrics nor request logs are enabled.
+    """
+    if not timing_enabled():
+        return _disabled_stage
+    return _timed_stage(name)
+
+
+def timed_chunks(chunks, name):
+    """
+    Time producing each chunk of a streamed response, for example reading it from the storage.
+    Streamed responses are read after the view has returned, so the chunks are recorded in the
+    stage histogram but not in the timings of the request.
+    """
+    if not timing_enabled():
+        yield from chunks
+        return
+    chunks = iter(chunks)
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        observe_stage(name, time.perf_counter() - started)
+        yield chunk
+
+
+def start_request():
+    """
+    Start collecting the stage timings of a request.
+
+    Returns:
+        tuple: Stage timings of the request and token to reset the previous timings with.
+    """
+    timings = {}
+    return timings, _request_stages.set(timings)
+
+
+def end_request(token):
+    _request_stages.reset(token)
+
+
+def app_gauges():
+    """
+    Export the statistics the predictor, prediction cache, motion gating and connection pools already keep.
+    """
+    from django.apps import apps
+    from .db.pool import pool_stats
+    from .motion import gating_stats
+
+    api_config = apps.get_app_config('api')
+
+    def predictor():
+        stats = api_config.predictor.stats.snapshot()
+        for name in ['batches', 'frames', 'errors']:
+            yield (name,), stats[name]
+
+    def prediction_cache():
+        cache = api_config.prediction_cache
+        if cache is not None:
+            stats = cache.snapshot()
+            for name in ['lookups', 'content_hits', 'perceptual_hits', 'evictions', 'size']:
+                yield (name,), stats[name]
+
+    def motion_gating():
+        stats = gating_stats.snapshot()
+        for name in ['frames', 'skipped']:
+            yield (name,), stats[name]
+
+    def connection_pools():
+        for alias, stats in pool_stats().items():
+            for name in ['size', 'idle', 'in_use', 'checkouts', 'waits', 'timeouts']:
+                yield (alias, name), stats[name]
+
+    return [
+        Gauge('buddywatch_predictor', 'Batches, frames and errors of the batching predictor.', ['stat'], predictor),
+        Gauge('buddywatch_prediction_cache', 'Lookups, hits and size of the prediction cache.', ['stat'],
+              prediction_cache),
+        Gauge('buddywatch_motion_gating', 'Frames checked and skipped by motion gating.', ['stat'], motion_gating),
+        Gauge('buddywatch_db_pool', 'Connection counts and checkouts of the database connection pools.',
+              ['alias', 'stat'], connection_pools),
+    ]
+
+
+_app_gauges_lock = threading.Lock()
+_app_gauges_registered = False
+
+
+def render_metrics():
+    """
+    Render the metrics of this process in the Prometheus text exposition format.
+    """
+    global _app_gauges_registered
+    with _app_gauges_lock:
+        if not _app_gauges_registered:
+            for gauge in app_gauges():
+                registry.register(gauge)
+            _app_gauges_registered = True
+    return registry.render()
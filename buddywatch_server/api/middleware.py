@@ -0,0 +1,101 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+import logging
+import random
+import json
+import time
+
+from .metrics import REQUESTS, REQUEST_SECONDS, start_request, end_request
+from .profiling import RequestProfile, StackSampler
+
+logger = logging.getLogger('api.metrics')
+
+
+def request_route(request):
+    """
+    URL pattern of the request instead of its path, so the metrics of /api/videos/download/1/
+    and /api/videos/download/2/ are counted together. Unresolved paths share a single route.
+    """
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None and match.route else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Count the requests and measure their latency by route, method and status code, and log
+    the stage timings of each request when METRICS_LOG_REQUESTS is enabled.
+    Removed from the middleware chain when neither metrics nor request logs are enabled,
+    so it costs nothing then.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED and not settings.METRICS_LOG_REQUESTS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = start_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        self.record(request, response, time.perf_counter() - started, timings)
+        return response
+
+    async def __acall__(self, request):
+        timings, token = start_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        self.record(request, response, time.perf_counter() - started, timings)
+        return response
+
+    def record(self, request, response, seconds, timings):
+        route = request_route(request)
+        if settings.METRICS_ENABLED:
+            REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+            REQUEST_SECONDS.observe(seconds, route=route, method=request.method)
+        if settings.METRICS_LOG_REQUESTS:
+            logger.info(json.dumps({
+                "method": request.method,
+                "route": route,
+                "status": response.status_code,
+                "duration_ms": round(seconds * 1000, 3),
+                "stages_ms": {name: round(value * 1000, 3) for name, value in timings.items()},
+            }))
+
+
+class ProfilingMiddleware:
+    """
+    Profile a PROFILING_SAMPLE_RATE fraction of the requests with cProfile, and when PROFILING_SLOW_THRESHOLD_MS
+    is set, keep a sampled stack profile of any request slower than it. Catching slow requests samples the stack
+    and records the SQL queries of every request, so it's off by default. The SQL query count and time of
+    the profiled requests are recorded as well. Profiles are written into PROFILING_DIR with an
+    index.jsonl of the requests. Removed from the middleware chain unless PROFILING_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sampler = StackSampler(settings.PROFILING_INTERVAL_MS / 1000)
+
+    def __call__(self, request):
+        sampled = random.random() < settings.PROFILING_SAMPLE_RATE
+        if not sampled and settings.PROFILING_SLOW_THRESHOLD_MS <= 0:
+            return self.get_response(request)
+
+        with RequestProfile(sampled, self.sampler) as profile:
+            response = self.get_response(request)
+        profile.save(request, response.status_code)
+        return response
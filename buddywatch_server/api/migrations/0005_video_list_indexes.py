@@ -0,0 +1,25 @@
+# Generated by Django 5.0.4 on 2026-10-18 09:40
+
+from django.conf import settings
+from django.contrib.postgres.indexes import OpClass
+from django.db import migrations, models
+from django.db.models import F
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['owner', '-created_at', '-id'], name='video_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(F('owner'), OpClass(F('title'), name='varchar_pattern_ops'), name='video_owner_title_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_video_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='videojob',
+            name='kind',
+            field=models.CharField(choices=[('process', 'Process upload'), ('analyze', 'Analyze faces')], default='process', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='VideoTimeline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('sample_rate', models.FloatField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('detections', models.BinaryField(default=bytes)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='api.video')),
+            ],
+        ),
+    ]
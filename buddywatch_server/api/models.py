@@ -1,14 +1,210 @@
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models import F, Q
 from django.contrib.auth.models import User
+from django.utils import timezone
+import uuid
 
 
 class Video(models.Model):
+    PROCESSING_PENDING = 'pending'
+    PROCESSING_READY = 'ready'
+    PROCESSING_FAILED = 'failed'
+    PROCESSING_STATUS_CHOICES = [
+        (PROCESSING_PENDING, 'Pending'),
+        (PROCESSING_READY, 'Ready'),
+        (PROCESSING_FAILED, 'Failed'),
+    ]
+
     title = models.CharField(max_length=255)
     file = models.FileField(upload_to='videos/')
     thumbnail = models.ImageField(upload_to='thumbnails/', null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Filled in by the background job after the upload
+    processing_status = models.CharField(max_length=20, choices=PROCESSING_STATUS_CHOICES, default=PROCESSING_PENDING)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    fps = models.FloatField(null=True, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='videos')
 
+    class Meta:
+        indexes = [
+            # Listing and keyset pagination of the user's videos from newest to oldest
+            models.Index(fields=['owner', '-created_at', '-id'], name='video_owner_created_idx'),
+            # Filtering the user's videos by title prefix, the pattern operator class lets LIKE 'prefix%'
+            # use the index under a non-C collation
+            models.Index(F('owner'), OpClass(F('title'), name='varchar_pattern_ops'), name='video_owner_title_idx'),
+        ]
+        constraints = [
+            # A stored file belongs to one video, deleting the video deletes the file.
+            # Files are cleared before bulk deletes, so empty names aren't unique
+            models.UniqueConstraint(fields=['file'], condition=~Q(file=''), name='video_file_unique'),
+        ]
+
     def __str__(self):
         return self.title
+
+
+class VideoListVersion(models.Model):
+    """
+    Version of a user's video list, increased whenever a video of the user is created, changed
+    or deleted. Kept in the database and fronted by the shared cache, so the version survives a cleared
+    cache and changes in the same transaction as the videos.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='video_list_version')
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.owner_id} ({self.version})'
+
+
+class VideoJob(models.Model):
+    """
+    Background job for processing a video after it has been uploaded.
+    Jobs are run by the run_video_worker management command.
+    """
+    KIND_PROCESS = 'process'
+    KIND_ANALYZE = 'analyze'
+    KIND_CHOICES = [
+        (KIND_PROCESS, 'Process upload'),
+        (KIND_ANALYZE, 'Analyze faces'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_PROCESS)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for the oldest queued job that is due
+            models.Index(fields=['status', 'run_after'], name='videojob_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.video_id} ({self.status})'
+
+
+class VideoTimeline(models.Model):
+    """
+    Face detections of a video sampled at sample_rate frames per second, created by the
+    analyze job. The detections are packed into a single binary array of records with the
+    time in seconds, confidence and bounding box of each sampled frame, see api.analysis.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_READY, 'Ready'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='timeline')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    sample_rate = models.FloatField()
+    samples = models.PositiveIntegerField(default=0)
+    detections = models.BinaryField(default=bytes)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.video_id} ({self.status}, {self.samples} samples)'
+
+
+class UploadSession(models.Model):
+    """
+    Resumable upload of a video sent in chunks. Each chunk is written to the storage as
+    soon as it arrives, and the video is created when all chunks have been received.
+    """
+    STATUS_ACTIVE = 'active'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_ACTIVE, 'Active'),
+        (STATUS_COMPLETED, 'Completed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    title = models.CharField(max_length=255)
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    block_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_ACTIVE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.title} ({self.offset}/{self.size})'
+
+
+class RetentionPolicy(models.Model):
+    """
+    Limits of how many videos, how many bytes of videos and how old videos a user can keep.
+    The oldest videos over any limit are deleted by the purge_videos management command.
+    Limits left empty fall back to the RETENTION_* settings, and 0 means no limit.
+    """
+    owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='retention_policy')
+    max_age_days = models.PositiveIntegerField(null=True, blank=True)
+    max_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    max_count = models.PositiveIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'retention policies'
+
+    def __str__(self):
+        return f'{self.owner_id} (age {self.max_age_days}, bytes {self.max_bytes}, count {self.max_count})'
+
+
+class StorageDeletion(models.Model):
+    """
+    File of a deleted video that is still to be deleted from the storage. Created in the same
+    transaction as the videos are deleted, and removed when the file is gone, so files whose
+    delete failed or was interrupted are deleted again by the purge_videos management command.
+    """
+    name = models.CharField(max_length=1024)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TokenRevocation(models.Model):
+    """
+    Time until which the tokens of a user are revoked, set when the user is deactivated or deleted.
+    Kept in the database so revocations survive a restarted or cleared cache, which only fronts them.
+    The user ID isn't a foreign key, because the tokens of a deleted user must stay revoked.
+    """
+    user_id = models.BigIntegerField(primary_key=True)
+    revoked_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user_id} ({self.revoked_at})'
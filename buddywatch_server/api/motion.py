@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import hashlib
+import time
+import math
+
+import numpy as np
+
+# Side of the square blocks the input is averaged over before frames are compared
+MOTION_BLOCK_SIZE = 4
+
+
+def motion_signature(image_array):
+    """
+    Downscale the preprocessed (120, 120, 3) input into a 30x30 grayscale frame of 8-bit values.
+    Averaging 4x4 blocks removes most of the sensor noise before frames are compared.
+    """
+    size = image_array.shape[0] // MOTION_BLOCK_SIZE
+    gray = image_array.mean(axis=2)
+    blocks = gray.reshape(size, MOTION_BLOCK_SIZE, size, MOTION_BLOCK_SIZE).mean(axis=(1, 3))
+    return (blocks * 255).astype(np.uint8)
+
+
+def motion_score(previous, current, pixel_threshold):
+    """
+    Fraction of the blocks whose brightness changed by more than pixel_threshold (0-1) between the frames.
+    """
+    difference = np.abs(current.astype(np.int16) - previous.astype(np.int16))
+    return float(np.count_nonzero(difference > pixel_threshold * 255)) / difference.size
+
+
+class GatingStats:
+    """
+    Thread safe counters of the frames checked and skipped by motion gating.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.skipped = 0
+
+    def record(self, skipped):
+        with self._lock:
+            self.frames += 1
+            if skipped:
+                self.skipped += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+            }
+
+
+gating_stats = GatingStats()
+
+
+class MotionGate:
+    """
+    Skip inference of a camera session's frames that have no motion compared to the frame
+    the session's last prediction was made from. The reference frame and its prediction are
+    kept in the Django cache for MOTION_GATING_MAX_AGE seconds, so all server processes share
+    them and every session gets a fresh prediction at least that often.
+    """
+
+    def __init__(self, user_id, session, threshold=None):
+        session_hash = hashlib.md5(str(session).encode()).hexdigest()
+        self.key = f'motion-gate:{user_id}:{session_hash}'
+        self.threshold = settings.MOTION_GATING_THRESHOLD if threshold is None else threshold
+        self.signature = None
+
+    def check(self, image_array):
+        """
+        Compare the frame with the reference frame of the session.
+
+        Returns:
+            dict: Prediction of the reference frame if the frame has no motion, otherwise None.
+        """
+        self.signature = motion_signature(image_array)
+        state = cache.get(self.key)
+        skipped = False
+        if state is not None and time.time() - state['predicted_at'] <= settings.MOTION_GATING_MAX_AGE:
+            previous = np.frombuffer(state['signature'], dtype=np.uint8).reshape(self.signature.shape)
+            skipped = motion_score(previous, self.signature, settings.MOTION_GATING_PIXEL_THRESHOLD) <= self.threshold
+        gating_stats.record(skipped)
+        return state['prediction'] if skipped else None
+
+    def update(self, prediction):
+        """
+        Make the checked frame the new reference frame of the session.
+        """
+        state = {'signature': self.signature.tobytes(), 'prediction': prediction, 'predicted_at': time.time()}
+        # Age is checked from the state, the cache entry only needs to outlive it
+        cache.set(self.key, state, max(1, math.ceil(settings.MOTION_GATING_MAX_AGE)))
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+import base64
+import json
+
+
+class VideoKeysetPagination(BasePagination):
+    """
+    Keyset pagination of videos ordered from newest to oldest. The cursor holds the
+    created_at and id of the last video on the page, and the next page continues from
+    the videos older than it, so every page is a range read of the (owner, created_at, id)
+    index no matter how deep into the list the client is.
+
+    Pagination is used only when the request has 'cursor' or 'page_size' query parameter,
+    so clients expecting the whole list as an array keep working.
+    """
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        # Fetch one extra video to know if there is a next page
+        videos = list(queryset[:self.page_size + 1])
+        self.has_next = len(videos) > self.page_size
+        self.videos = videos[:self.page_size]
+        return self.videos
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, settings.VIDEO_LIST_PAGE_SIZE))
+        except ValueError:
+            page_size = settings.VIDEO_LIST_PAGE_SIZE
+        return max(1, min(page_size, settings.VIDEO_LIST_MAX_PAGE_SIZE))
+
+    @staticmethod
+    def encode_cursor(video):
+        position = json.dumps([video.created_at.isoformat(), video.pk])
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError
+            return created_at, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.videos[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,12 @@
+from rest_framework.parsers import BaseParser
+
+
+class FrameBufferParser(BaseParser):
+    """
+    Parse application/octet-stream request body into raw bytes.
+    Used for packed frame buffers sent to the batch prediction endpoint.
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read() if stream is not None else b''
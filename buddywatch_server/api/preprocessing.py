@@ -0,0 +1,140 @@
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+import numpy as np
+import threading
+import cv2
+
+from .metrics import stage
+
+# Size of the images the object detection model expects
+MODEL_IMAGE_SIZE = (120, 120)
+
+# Image formats accepted for prediction. MPO is the JPEG variant written by many phone cameras
+ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'BMP', 'GIF', 'TIFF'}
+
+
+class InvalidImageError(ValueError):
+    """
+    Raised when an image can't be used for prediction.
+    """
+
+
+def open_image(image_file):
+    """
+    Open the image and check its format and dimensions from the header, before
+    any pixels are decoded. Raises InvalidImageError if the image isn't accepted.
+    """
+    try:
+        image = Image.open(image_file)
+    except UnidentifiedImageError:
+        raise InvalidImageError('Image format is not recognized')
+
+    if image.format not in ALLOWED_FORMATS:
+        raise InvalidImageError(f'Image format {image.format} is not supported')
+    width, height = image.size
+    if width <= 0 or height <= 0:
+        raise InvalidImageError('Image has no pixels')
+    if width * height > settings.PREPROCESS_MAX_PIXELS:
+        raise InvalidImageError(f'Image is too large, at most {settings.PREPROCESS_MAX_PIXELS} pixels are allowed')
+    return image
+
+
+def preprocess_image(image_file, out=None, draft=None):
+    """
+    Decode the image, resize it to the size of the model's input and write the normalized
+    pixels into out, a float32 array of shape (120, 120, 3). JPEG images are decoded at reduced
+    size with draft mode when the image is at least twice the model's input size, which skips
+    most of the decoding work. A new array is allocated if out isn't given.
+    Raises InvalidImageError if the image is rejected or can't be decoded.
+
+    Returns:
+        numpy.ndarray: Normalized image of shape (120, 120, 3).
+    """
+    if out is None:
+        out = np.empty((*MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+    if draft is None:
+        draft = settings.PREPROCESS_DRAFT_DECODE
+
+    image = open_image(image_file)
+    try:
+        with stage('decode'):
+            if draft:
+                # Only affects JPEG, the decoder picks the largest scale still at least the requested size
+                image.draft('RGB', MODEL_IMAGE_SIZE)
+            image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+        with stage('resize'):
+            if image.size != MODEL_IMAGE_SIZE:
+                image = image.resize(MODEL_IMAGE_SIZE)
+            # Normalize the 8-bit pixels straight into the float32 output without a float64 temporary
+            np.divide(np.asarray(image), 255, out=out, dtype=np.float32)
+    except OSError as e:
+        # Pixel data is truncated or corrupted
+        raise InvalidImageError(str(e))
+    return out
+
+
+def preprocess_batch(image_files, out=None, draft=None):
+    """
+    Decode and resize the images into a single float32 batch of shape (N, 120, 120, 3).
+    The batch is written into out when given, for example a buffer from batch_buffer.
+
+    Returns:
+        numpy.ndarray: Normalized images of shape (N, 120, 120, 3).
+    """
+    if out is None:
+        out = np.empty((len(image_files), *MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+    for index, image_file in enumerate(image_files):
+        preprocess_image(image_file, out[index], draft)
+    return out
+
+
+def preprocess_frame(frame, out=None):
+    """
+    Resize a frame decoded by OpenCV, which is in BGR order, to the size of the model's
+    input and write the normalized RGB pixels into out. Used for frames of stored videos.
+
+    Returns:
+        numpy.ndarray: Normalized image of shape (120, 120, 3).
+    """
+    if out is None:
+        out = np.empty((*MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+    # Area interpolation averages the pixels when shrinking, like the resize of the image path
+    resized = cv2.resize(frame, MODEL_IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+    np.divide(cv2.cvtColor(resized, cv2.COLOR_BGR2RGB), 255, out=out, dtype=np.float32)
+    return out
+
+
+class BatchBuffer:
+    """
+    Float32 array for model inputs that is reused between requests, so preprocessing
+    doesn't allocate a new batch for every request. The array grows when a larger
+    batch is needed and is never shrunk.
+    """
+
+    def __init__(self, capacity=1):
+        self._array = np.empty((capacity, *MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+
+    @property
+    def capacity(self):
+        return len(self._array)
+
+    def get(self, size):
+        if size > self.capacity:
+            self._array = np.empty((max(size, self.capacity * 2), *MODEL_IMAGE_SIZE, 3), dtype=np.float32)
+        return self._array[:size]
+
+
+_buffers = threading.local()
+
+
+def batch_buffer(size):
+    """
+    Get a reusable buffer of shape (size, 120, 120, 3) owned by the current thread.
+    The buffer is overwritten by the next call in the same thread, so the caller must
+    be done with it, for example have its prediction back, before preprocessing again.
+    """
+    if not hasattr(_buffers, 'buffer'):
+        _buffers.buffer = BatchBuffer()
+    return _buffers.buffer.get(size)
@@ -0,0 +1,267 @@
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from django.conf import settings
+from django.db import connections
+import threading
+import cProfile
+import logging
+import uuid
+import json
+import time
+import sys
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the index is only locked between the threads of a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Only one cProfile profiler can be active at a time, other requests are sampled instead
+_profiler_lock = threading.Lock()
+_index_lock = threading.Lock()
+
+
+class QueryRecorder:
+    """
+    Count the SQL queries of a request and their time with an execute wrapper of each database connection.
+    """
+
+    def __init__(self, slowest=5):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []
+        self.keep = slowest
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - started
+            self.count += 1
+            self.seconds += seconds
+            if len(self.slowest) < self.keep or seconds > self.slowest[-1][0]:
+                self.slowest.append((seconds, sql))
+                self.slowest.sort(key=lambda query: query[0], reverse=True)
+                del self.slowest[self.keep:]
+
+    def recording(self):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    def report(self):
+        return {
+            "count": self.count,
+            "duration_ms": round(self.seconds * 1000, 3),
+            "slowest": [{"duration_ms": round(seconds * 1000, 3), "sql": sql} for seconds, sql in self.slowest],
+        }
+
+
+class StackSampler:
+    """
+    Statistical profiler that records the stacks of the threads handling requests every interval
+    from a single background thread. Unlike cProfile it doesn't slow down the profiled code, so every
+    request can be sampled and the profile of a request is kept only when it turns out to be slow.
+    The thread sleeps while no request is being sampled.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+                self._thread.start()
+            self._active.set()
+
+    def stop(self, thread_id):
+        """
+        Stop sampling the thread.
+
+        Returns:
+            collections.Counter: Times each stack was seen, stacks as tuples of frames from the outermost.
+        """
+        with self._lock:
+            stacks = self._threads.pop(thread_id, Counter())
+            if not self._threads:
+                self._active.clear()
+        return stacks
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[frame_stack(frame)] += 1
+
+
+def frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def collapsed_stacks(stacks):
+    """
+    Stacks in the collapsed format read by flame graph tools such as speedscope and flamegraph.pl.
+    """
+    return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def profile_name(started_at):
+    return f"{started_at.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+@contextmanager
+def locked_index(directory):
+    """
+    Lock the index of the profiles against the other threads and the other server processes,
+    which append to the same index and remove the same oldest profiles. The lock is held on a
+    separate file, because the index is replaced when the entries of removed profiles are dropped.
+    """
+    with _index_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, 'index.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_profile(entry, profiler=None, stacks=None):
+    """
+    Write the cProfile stats or the sampled stacks of a request into PROFILING_DIR and append the
+    entry to index.jsonl. The oldest profiles are removed when there are more than PROFILING_MAX_PROFILES.
+    """
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    # The profile is written under the lock too, so other processes never remove a profile that isn't indexed yet
+    with locked_index(directory):
+        if profiler is not None:
+            entry['profile'] = entry['id'] + '.prof'
+            entry['format'] = 'cprofile'
+            profiler.dump_stats(os.path.join(directory, entry['profile']))
+        else:
+            entry['profile'] = entry['id'] + '.stacks'
+            entry['format'] = 'collapsed'
+            with open(os.path.join(directory, entry['profile']), 'w') as file:
+                file.write(collapsed_stacks(stacks))
+
+        with open(os.path.join(directory, 'index.jsonl'), 'a') as index:
+            index.write(json.dumps(entry) + '\n')
+        profiles = sorted(name for name in os.listdir(directory) if name.endswith(('.prof', '.stacks')))
+        # Names start with the time, so the oldest sort first
+        removed = set(profiles[:max(0, len(profiles) - settings.PROFILING_MAX_PROFILES)])
+        if removed:
+            for name in removed:
+                os.remove(os.path.join(directory, name))
+            remove_index_entries(directory, removed)
+
+
+def remove_index_entries(directory, profiles):
+    """
+    Rewrite index.jsonl without the entries of the removed profiles.
+    """
+    path = os.path.join(directory, 'index.jsonl')
+    with open(path) as index:
+        lines = [line for line in index if json.loads(line).get('profile') not in profiles]
+    # Replace the index at once, so it's never read half written
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as index:
+        index.writelines(lines)
+    os.replace(temporary_path, path)
+
+
+class RequestProfile:
+    """
+    Profile of a single request. Requests chosen by PROFILING_SAMPLE_RATE are profiled with cProfile,
+    other requests are sampled by the stack sampler, so the profile of a request that turns out
+    to be slow can be kept. Sampled requests fall back to the stack sampler while another
+    request is being profiled with cProfile.
+    """
+
+    def __init__(self, sampled, sampler):
+        self.started_at = datetime.now(timezone.utc)
+        self.queries = QueryRecorder()
+        self.profiler = None
+        self.sampler = None
+        self.thread_id = threading.get_ident()
+        if sampled and _profiler_lock.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+        else:
+            self.sampler = sampler
+        self.sampled = sampled
+
+    def __enter__(self):
+        self._queries = self.queries.recording()
+        self._queries.__enter__()
+        if self.profiler is not None:
+            self.profiler.enable()
+        elif self.sampler is not None:
+            self.sampler.start(self.thread_id)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._started
+        self.stacks = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiler_lock.release()
+        elif self.sampler is not None:
+            self.stacks = self.sampler.stop(self.thread_id)
+        self._queries.__exit__(*exc_info)
+
+    def save(self, request, status_code):
+        """
+        Write the profile if the request was sampled or slower than PROFILING_SLOW_THRESHOLD_MS.
+
+        Returns:
+            bool: True if the profile was written.
+        """
+        threshold = settings.PROFILING_SLOW_THRESHOLD_MS
+        slow = threshold > 0 and self.seconds * 1000 >= threshold
+        if not self.sampled and not slow:
+            return False
+        if self.profiler is None and not self.stacks:
+            return False
+        match = getattr(request, 'resolver_match', None)
+        entry = {
+            "id": profile_name(self.started_at),
+            "started_at": self.started_at.isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "route": match.route if match is not None else None,
+            "status": status_code,
+            "duration_ms": round(self.seconds * 1000, 3),
+            "reason": "sampled" if self.sampled else "slow",
+            "sql": self.queries.report(),
+        }
+        try:
+            write_profile(entry, self.profiler, self.stacks)
+        except OSError as e:
+            logger.warning("Could not write the profile of %s: %s", request.path, e)
+            return False
+        return True
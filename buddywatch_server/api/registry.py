@@ -0,0 +1,124 @@
+import threading
+import logging
+import resource
+import time
+import os
+
+import numpy as np
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def max_rss_mb():
+    """
+    Peak resident memory of the process in megabytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ModelRegistry:
+    """
+    Load TensorFlow and the object detection model lazily on first prediction or
+    when warm_up is called, so processes that never predict (migrate, shell, tests)
+    don't pay for importing TensorFlow and loading the model.
+    Loading is thread safe and happens only once per process.
+    """
+
+    def __init__(self, model_path, backend_name, backend_options=None, intra_op_threads=0, inter_op_threads=0):
+        self.model_path = model_path
+        self.backend_name = backend_name
+        self.backend_options = backend_options or {}
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.timings = {}
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    def get_backend(self):
+        """
+        Get the inference backend, loading TensorFlow and the model on first call.
+        """
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self._load()
+        return self._backend
+
+    def predict(self, inputs):
+        return self.get_backend().predict(inputs)
+
+    @property
+    def custom_backend(self):
+        # Backend class can be given with its import path, for example a stub model in benchmarks
+        return '.' in self.backend_name
+
+    def _load(self):
+        if self.custom_backend:
+            started = time.perf_counter()
+            backend = import_string(self.backend_name)(self.model_path, **self.backend_options)
+            self.timings['model_load_ms'] = (time.perf_counter() - started) * 1000
+            return backend
+
+        started = time.perf_counter()
+        # Importing the backends imports TensorFlow, which is the slowest part of loading
+        from .backends import configure_threads, load_backend
+        imported = time.perf_counter()
+
+        # Thread pools must be configured before TensorFlow runs anything
+        configure_threads(self.intra_op_threads, self.inter_op_threads)
+        logger.info('Loading model with %s backend...', self.backend_name)
+        backend = load_backend(self.backend_name, self.model_path, **self.backend_options)
+        logger.info('Model loaded successfully')
+
+        # TensorFlow may have been imported already by preload
+        self.timings.setdefault('tensorflow_import_ms', (imported - started) * 1000)
+        self.timings['model_load_ms'] = (time.perf_counter() - imported) * 1000
+        return backend
+
+    def preload(self):
+        """
+        Import TensorFlow and read the model before the server forks its workers, so the workers
+        share the imported modules and the model bytes copy-on-write instead of each loading their own.
+        TensorFlow runtime isn't fork safe, so nothing is run here: the TensorFlow Lite interpreter
+        is created from the preloaded bytes in each worker, and Keras models are loaded in each worker.
+        """
+        if self.custom_backend:
+            return
+        started = time.perf_counter()
+        from .backends import TFLiteBackend
+        self.timings['tensorflow_import_ms'] = (time.perf_counter() - started) * 1000
+
+        quantization = self.backend_options.get('quantization', 'none')
+        if self.backend_name == 'tflite' and TFLiteBackend.is_converted(self.model_path, quantization):
+            converted_path = TFLiteBackend.converted_path_for(self.model_path, quantization)
+            self.backend_options['model_content'] = converted_path.read_bytes()
+            logger.info('Preloaded %s for the server workers', converted_path.name)
+
+    def warm_up(self, batch_sizes=(1,)):
+        """
+        Load the model and run predictions with blank images, so the graph is traced and
+        compiled before the first real request. Predicting every batch size that will be
+        used avoids retracing or reallocating on the first batch of that size.
+        """
+        backend = self.get_backend()
+        started = time.perf_counter()
+        for batch_size in batch_sizes:
+            backend.predict(np.zeros((batch_size, 120, 120, 3), dtype=np.float32))
+        self.timings['warm_up_ms'] = (time.perf_counter() - started) * 1000
+
+    def report(self):
+        """
+        Return the load and warm-up timings of the model in a serializable format.
+        """
+        return {
+            "pid": os.getpid(),
+            "backend": self.backend_name,
+            "loaded": self.loaded,
+            "timings": dict(self.timings),
+            "max_rss_mb": max_rss_mb(),
+        }
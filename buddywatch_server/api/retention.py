@@ -0,0 +1,104 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+import time
+
+from .deletion import delete_videos
+from .models import Video, RetentionPolicy
+
+# Newest first, the order the user's videos are kept in
+NEWEST_FIRST = ['-created_at', '-id']
+
+
+def effective_policy(owner_id, policy=None):
+    """
+    Limits of the user, with the limits the user's RetentionPolicy leaves empty taken from the settings.
+
+    Returns:
+        dict: max_age_days, max_bytes and max_count of the user, 0 when there is no limit.
+    """
+    if policy is None:
+        policy = RetentionPolicy.objects.filter(owner_id=owner_id).first()
+    defaults = {
+        'max_age_days': settings.RETENTION_MAX_AGE_DAYS,
+        'max_bytes': settings.RETENTION_MAX_BYTES,
+        'max_count': settings.RETENTION_MAX_COUNT,
+    }
+    if policy is not None:
+        for limit in defaults:
+            if getattr(policy, limit) is not None:
+                defaults[limit] = getattr(policy, limit)
+    return defaults
+
+
+def at_or_before(video):
+    """
+    Filter of the video and all the videos created before it, in the order of the video list.
+    """
+    return Q(created_at__lt=video['created_at']) | Q(created_at=video['created_at'], id__lte=video['id'])
+
+
+def purge_filter(owner_id, limits, now=None):
+    """
+    Filter of the user's videos that are over any limit. The oldest videos are the first over
+    the count and bytes limits, so each limit is a boundary video found from the (owner, created_at)
+    index, and everything at or before the boundary is purged. Videos whose size isn't known yet
+    count as 0 bytes.
+
+    Returns:
+        Q: Filter of the videos to purge, or None if nothing is over the limits.
+    """
+    videos = Video.objects.filter(owner_id=owner_id)
+    conditions = []
+    if limits['max_age_days']:
+        now = now or timezone.now()
+        conditions.append(Q(created_at__lt=now - timedelta(days=limits['max_age_days'])))
+    if limits['max_count']:
+        boundary = videos.order_by(*NEWEST_FIRST).values('id', 'created_at')[limits['max_count']:][:1]
+        conditions.extend(at_or_before(video) for video in boundary)
+    if limits['max_bytes']:
+        total = Window(Sum(Coalesce('size', 0)), order_by=[F('created_at').desc(), F('id').desc()])
+        boundary = (videos.annotate(total=total).filter(total__gt=limits['max_bytes'])
+                    .order_by(*NEWEST_FIRST).values('id', 'created_at')[:1])
+        conditions.extend(at_or_before(video) for video in boundary)
+    if not conditions:
+        return None
+    purge = conditions[0]
+    for condition in conditions[1:]:
+        purge |= condition
+    return purge
+
+
+def purge_user(owner_id, chunk_size=None, dry_run=False, deadline=None, now=None):
+    """
+    Delete the user's videos that are over the limits of the user's retention policy, oldest first,
+    chunk_size videos per transaction. The videos to purge are found again from the current state
+    of the table, so a purge that was interrupted or stopped at the deadline continues from where
+    it was left by running it again.
+
+    Returns:
+        dict: Amount and bytes of the purged videos, and whether the deadline stopped the purge.
+    """
+    chunk_size = chunk_size or settings.RETENTION_CHUNK_SIZE
+    purge = purge_filter(owner_id, effective_policy(owner_id), now)
+    result = {"videos": 0, "bytes": 0, "complete": True}
+    if purge is None:
+        return result
+    videos = Video.objects.filter(owner_id=owner_id).filter(purge)
+
+    if dry_run:
+        result.update(videos.aggregate(videos=Count('id'), bytes=Coalesce(Sum('size'), 0)))
+        return result
+
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            result['complete'] = False
+            return result
+        chunk = list(videos.order_by('created_at', 'id').values_list('pk', 'size')[:chunk_size])
+        if not chunk:
+            return result
+        deleted = {report['id'] for report in delete_videos(Video.objects.filter(pk__in=[pk for pk, _ in chunk]))}
+        result['videos'] += len(deleted)
+        result['bytes'] += sum(size or 0 for pk, size in chunk if pk in deleted)
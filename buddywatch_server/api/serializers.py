@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import Video
+from .storage import resolve_urls
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -32,6 +35,16 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+
+        # Add claims used by the stateless authentication, access tokens get them from the refresh token
+        token['username'] = user.username
+        token['is_active'] = user.is_active
+        token['is_staff'] = user.is_staff
+        return token
+
     def validate(self, attrs):
         token = super().validate(attrs)
 
@@ -40,8 +53,90 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return token
 
 
+class CachedUrlMixin:
+    """
+    Represent the file with its URL from the URLs resolved for the whole list by
+    VideoListSerializer, or from the URL cache when a single video is serialized.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = self.context.get('storage_urls', {}).get(value.name)
+        if url is None:
+            url = resolve_urls(value.storage, [value.name])[value.name]
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class CachedFileField(CachedUrlMixin, serializers.FileField):
+    pass
+
+
+class CachedImageField(CachedUrlMixin, serializers.ImageField):
+    pass
+
+
+class VideoListSerializer(serializers.ListSerializer):
+    """
+    Resolve the URLs of all the files on the list in one batch before serializing the videos,
+    so the storage backend isn't called separately for each file.
+    """
+
+    def to_representation(self, data):
+        videos = data.all() if isinstance(data, models.manager.BaseManager) else data
+        files = [file for video in videos for file in (video.file, video.thumbnail) if file]
+        if files:
+            self.context['storage_urls'] = resolve_urls(files[0].storage, [file.name for file in files])
+        return super().to_representation(videos)
+
+
 class VideoSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.FileField: CachedFileField,
+        models.ImageField: CachedImageField,
+    }
+
     class Meta:
         model = Video
-        fields = ['id', 'title', 'file', 'thumbnail', 'created_at', 'owner']
+        list_serializer_class = VideoListSerializer
+        fields = ['id', 'title', 'file', 'thumbnail', 'created_at', 'owner', 'processing_status',
+                  'size', 'duration', 'fps', 'width', 'height']
+        read_only_fields = ['processing_status', 'size', 'duration', 'fps', 'width', 'height']
         extra_kwargs = {'owner': {'read_only': True}}
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+
+
+class CompleteDirectUploadSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    upload_token = serializers.CharField()
+
+
+class ChunkedUploadSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=255)
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+
+
+class VideoAnalysisSerializer(serializers.Serializer):
+    sample_rate = serializers.FloatField(min_value=0.01, max_value=30, required=False)
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, required=False)
+    created_after = serializers.CharField(required=False)
+    created_before = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        has_range = 'created_after' in attrs or 'created_before' in attrs
+        if ('ids' in attrs) == has_range:
+            raise serializers.ValidationError('Give either ids or created_after and/or created_before')
+        if len(attrs.get('ids', [])) > settings.BULK_DELETE_MAX_IDS:
+            raise serializers.ValidationError({'ids': f'At most {settings.BULK_DELETE_MAX_IDS} ids are allowed'})
+        return attrs
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import revoke_user_tokens, user_cache
+from .caching import bump_video_list_version
+from .models import Video
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_changed(sender, instance, **kwargs):
+    """
+    Invalidate the owner's video list when a video is created, changed or deleted.
+    The version is changed in the same transaction as the video, so a list read before
+    the commit is cached with the old version.
+    """
+    # Videos deleted with their owner have no list left, and the version row is deleted with the owner
+    if isinstance(kwargs.get('origin'), User):
+        return
+    bump_video_list_version(instance.owner_id)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    """
+    Forget the cached user when it changes, and revoke the tokens of a deactivated user.
+    The stateless authentication would otherwise accept the tokens until they expire.
+    """
+    user_cache.discard(instance.pk)
+    if not instance.is_active:
+        revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    revoke_user_tokens(instance.pk)
@@ -0,0 +1,357 @@
+from azure.core.exceptions import ResourceNotFoundError
+from concurrent.futures import ThreadPoolExecutor
+from azure.storage.blob import BlobClient, BlobSasPermissions, ContentSettings, generate_blob_sas
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+from urllib.parse import quote
+from storages.backends.azure_storage import AzureStorage
+import mimetypes
+import hashlib
+import base64
+import uuid
+import os
+
+# Errors raised by the storage backends when a file doesn't exist
+FILE_NOT_FOUND_ERRORS = (FileNotFoundError, ResourceNotFoundError)
+
+# Most blobs Azure deletes with a single batch request
+AZURE_DELETE_BATCH_SIZE = 256
+
+# Salt of the signed tokens of the local storage stand-in and direct uploads
+LOCAL_STORAGE_SALT = 'api.storage.local'
+DIRECT_UPLOAD_SALT = 'api.storage.direct-upload'
+
+
+def is_azure(storage):
+    return isinstance(storage, AzureStorage)
+
+
+def azure_blob_client(storage, name):
+    """
+    Get Azure blob client for the file. The name is normalized the same way as
+    the storage backend does when it saves files.
+    """
+    return storage.client.get_blob_client(storage._get_valid_path(name))
+
+
+def iter_file_range(storage, name, start, length, chunk_size=None):
+    """
+    Read length bytes of the file starting at start in chunks, so only one chunk
+    is held in memory at a time regardless of the file size. Azure blobs are read
+    with ranged downloads instead of downloading the whole blob first.
+    """
+    chunk_size = chunk_size or settings.DOWNLOAD_CHUNK_SIZE
+    if length <= 0:
+        return
+
+    if is_azure(storage):
+        stream = azure_blob_client(storage, name).download_blob(offset=start, length=length,
+                                                                  timeout=storage.timeout)
+        yield from stream.chunks()
+        return
+
+    with storage.open(name, 'rb') as file:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def url_cache_key(name):
+    # Hash the name so it's a valid key for every cache backend
+    return 'storage-url:' + hashlib.md5(name.encode()).hexdigest()
+
+
+def azure_urls(storage, names):
+    """
+    Create URLs of many blobs at once. Gives the same URLs as storage.url, but builds
+    them from the container URL instead of creating a blob client for each blob.
+    """
+    container_url = storage.custom_client.url.split('?')[0].rstrip('/')
+    expiry = None
+    if storage.expiration_secs:
+        expiry = datetime.now(timezone.utc) + timedelta(seconds=storage.expiration_secs)
+        # Same user delegation key is used for every blob
+        user_delegation_key = storage.get_user_delegation_key(expiry.replace(tzinfo=None))
+
+    urls = {}
+    for name in names:
+        blob_name = storage._get_valid_path(name)
+        url = f"{container_url}/{quote(blob_name, safe='~/')}"
+        if expiry is not None:
+            url += '?' + generate_blob_sas(
+                storage.account_name,
+                storage.azure_container,
+                blob_name,
+                account_key=storage.account_key,
+                user_delegation_key=user_delegation_key,
+                permission=BlobSasPermissions(read=True),
+                expiry=expiry,
+            )
+        urls[name] = url
+    return urls
+
+
+def url_cache_timeout(storage):
+    """
+    Seconds a URL of the storage can be cached. URLs with shared access signature
+    are cached only for half of their lifetime, so cached URLs are never expired.
+    """
+    if is_azure(storage) and storage.expiration_secs:
+        return min(settings.STORAGE_URL_CACHE_TTL, storage.expiration_secs // 2)
+    return settings.STORAGE_URL_CACHE_TTL
+
+
+def resolve_urls(storage, names):
+    """
+    Get URLs of the files in the storage. URLs are cached by file name, and URLs
+    that aren't in the cache are created in one batch.
+
+    Returns:
+        dict: URL of each file name.
+    """
+    names = {name for name in names if name}
+    if not names:
+        return {}
+
+    keys = {url_cache_key(name): name for name in names}
+    cached = cache.get_many(keys)
+    urls = {keys[key]: url for key, url in cached.items()}
+
+    missing = [name for name in names if name not in urls]
+    if missing:
+        if is_azure(storage):
+            created = azure_urls(storage, missing)
+        else:
+            created = {name: storage.url(name) for name in missing}
+        timeout = url_cache_timeout(storage)
+        if timeout > 0:
+            cache.set_many({url_cache_key(name): url for name, url in created.items()}, timeout)
+        urls.update(created)
+    return urls
+
+
+def generate_video_name(filename):
+    """
+    Generate unique name in the videos folder for a file uploaded directly to the storage.
+    """
+    filename = get_valid_filename(filename or 'video.webm')[-100:]
+    return f'videos/{uuid.uuid4().hex}_{filename}'
+
+
+def azure_sas_url(storage, name, permission, expiry):
+    """
+    Create URL of the blob with shared access signature giving the permission until expiry.
+    User delegation key is used when the storage authenticates with Azure credential.
+    """
+    blob_name = storage._get_valid_path(name)
+    sas_token = generate_blob_sas(
+        storage.account_name,
+        storage.azure_container,
+        blob_name,
+        account_key=storage.account_key,
+        user_delegation_key=storage.get_user_delegation_key(expiry.replace(tzinfo=None)),
+        permission=permission,
+        expiry=expiry,
+    )
+    blob_url = storage.custom_client.get_blob_client(blob_name).url
+    return BlobClient.from_blob_url(blob_url, credential=sas_token).url
+
+
+def local_signed_url(request, name, operation):
+    """
+    Create signed URL to the local storage view, which stands in for Azure when
+    files are stored on the local file system.
+    """
+    token = signing.dumps({'name': name, 'operation': operation}, salt=LOCAL_STORAGE_SALT)
+    return request.build_absolute_uri(reverse('local-storage', args=[token]))
+
+
+def verify_local_token(token, operation):
+    """
+    Get the file name from a signed local storage token.
+    Raises signing.BadSignature if the token is invalid, expired or for another operation.
+    """
+    data = signing.loads(token, salt=LOCAL_STORAGE_SALT, max_age=settings.SIGNED_URL_EXPIRY)
+    if data.get('operation') != operation:
+        raise signing.BadSignature('Token is for another operation')
+    return data['name']
+
+
+def create_upload_url(storage, request, name):
+    """
+    Create short-lived URL where the client can PUT the file directly to the storage.
+
+    Returns:
+        dict: URL, HTTP method and headers the client must use, and expiry time of the URL.
+    """
+    expiry = datetime.now(timezone.utc) + timedelta(seconds=settings.SIGNED_URL_EXPIRY)
+    if is_azure(storage):
+        url = azure_sas_url(storage, name, BlobSasPermissions(create=True, write=True), expiry)
+        headers = {'x-ms-blob-type': 'BlockBlob'}
+    else:
+        url = local_signed_url(request, name, 'upload')
+        headers = {}
+    return {"url": url, "method": "PUT", "headers": headers, "expires_at": expiry.isoformat()}
+
+
+def create_download_url(storage, request, name):
+    """
+    Create short-lived URL where the client can download the file directly from the storage.
+
+    Returns:
+        dict: URL and its expiry time.
+    """
+    expiry = datetime.now(timezone.utc) + timedelta(seconds=settings.SIGNED_URL_EXPIRY)
+    if is_azure(storage):
+        url = azure_sas_url(storage, name, BlobSasPermissions(read=True), expiry)
+    else:
+        url = local_signed_url(request, name, 'download')
+    return {"url": url, "expires_at": expiry.isoformat()}
+
+
+def create_direct_upload_token(user, name):
+    """
+    Sign the name of a directly uploaded file for the user, so only that user
+    can later create a video from the file.
+    """
+    return signing.dumps({'name': name, 'owner': user.pk}, salt=DIRECT_UPLOAD_SALT)
+
+
+def verify_direct_upload_token(token, user):
+    """
+    Get the name of the directly uploaded file from the token.
+    Raises signing.BadSignature if the token is invalid, expired or for another user.
+    """
+    # Client may finish the upload a while after the upload URL expired
+    data = signing.loads(token, salt=DIRECT_UPLOAD_SALT, max_age=settings.SIGNED_URL_EXPIRY * 2)
+    if data.get('owner') != user.pk:
+        raise signing.BadSignature('Token belongs to another user')
+    return data['name']
+
+
+def block_id(index):
+    """
+    Azure block IDs must be base64 strings of the same length within a blob.
+    """
+    return base64.b64encode(f'{index:08d}'.encode()).decode()
+
+
+def partial_path(storage, name):
+    """
+    Path of the file where chunks are collected in local storage before the upload is completed.
+    """
+    return storage.path(name) + '.partial'
+
+
+def stage_chunk(storage, name, index, offset, data):
+    """
+    Write a chunk of a resumable upload to the storage. In Azure the chunk is staged
+    as an uncommitted block of the blob, locally it's written to a partial file.
+
+    Returns:
+        str: ID of the staged block.
+    """
+    chunk_id = block_id(index)
+    if is_azure(storage):
+        azure_blob_client(storage, name).stage_block(chunk_id, data, length=len(data), timeout=storage.timeout)
+        return chunk_id
+
+    path = partial_path(storage, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as partial_file:
+        partial_file.seek(offset)
+        partial_file.write(data)
+        partial_file.truncate()
+    return chunk_id
+
+
+def commit_chunks(storage, name, block_ids):
+    """
+    Assemble the staged chunks into the final file.
+    """
+    if is_azure(storage):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        azure_blob_client(storage, name).commit_block_list(
+            block_ids, content_settings=ContentSettings(content_type=content_type), timeout=storage.timeout)
+        return
+    os.replace(partial_path(storage, name), storage.path(name))
+
+
+def discard_chunks(storage, name):
+    """
+    Remove chunks of an aborted upload. Uncommitted Azure blocks are removed
+    by Azure automatically after a week, so only local partial files are removed.
+    """
+    if not is_azure(storage):
+        try:
+            os.remove(partial_path(storage, name))
+        except FileNotFoundError:
+            pass
+
+
+def delete_azure_batch(storage, names):
+    """
+    Delete up to AZURE_DELETE_BATCH_SIZE blobs with a single batch request.
+    """
+    blobs = [storage._get_valid_path(name) for name in names]
+    responses = storage.client.delete_blobs(*blobs, raise_on_any_failure=False, timeout=storage.timeout)
+    results = {}
+    for name, response in zip(names, responses):
+        if response.status_code == 404:
+            results[name] = 'missing'
+        elif response.status_code < 300:
+            results[name] = 'deleted'
+        else:
+            results[name] = f'Status {response.status_code}: {response.reason}'
+    return results
+
+
+def delete_file(storage, name):
+    try:
+        if not storage.exists(name):
+            return {name: 'missing'}
+        storage.delete(name)
+    except FILE_NOT_FOUND_ERRORS:
+        return {name: 'missing'}
+    return {name: 'deleted'}
+
+
+def delete_files(storage, names, workers=None):
+    """
+    Delete many files of the storage concurrently. Azure blobs are deleted with batch
+    requests of up to 256 blobs, other storages delete a file at a time in each thread.
+    An error deleting one file doesn't stop deleting the others.
+
+    Returns:
+        dict: Result of each file: 'deleted', 'missing', or the error message.
+    """
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    workers = workers or settings.BULK_DELETE_WORKERS
+    if is_azure(storage):
+        tasks = [names[i:i + AZURE_DELETE_BATCH_SIZE] for i in range(0, len(names), AZURE_DELETE_BATCH_SIZE)]
+        delete = delete_azure_batch
+    else:
+        tasks = names
+        delete = delete_file
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(tasks)), thread_name_prefix='storage-delete') as executor:
+        futures = [(task, executor.submit(delete, storage, task)) for task in tasks]
+        for task, future in futures:
+            try:
+                results.update(future.result())
+            except Exception as e:
+                for name in (task if isinstance(task, list) else [task]):
+                    results[name] = str(e)
+    return results
@@ -1,11 +1,47 @@
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.test import TestCase, SimpleTestCase, Client, TransactionTestCase, override_settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
 from rest_framework.utils import json
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from datetime import datetime, timedelta
+from storages.backends.azure_storage import AzureStorage
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from PIL import Image
+import numpy as np
+import tempfile
+import hashlib
+import pstats
+import base64
 import json
+import cv2
+import time
+import io
 import os
 
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.core.management import call_command
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .analysis import analyze_video_file
+from .consumers import PredictConsumer, CLOSE_UNAUTHORIZED
+from .db.pool import ConnectionPool, PoolTimeout, pool_stats, pools
+from .inference import BatchingPredictor, PredictionCache, predict_image
+from .metrics import Counter, Histogram, Registry, stage, start_request, end_request
+from .models import Video, VideoJob, VideoListVersion, RetentionPolicy, StorageDeletion
+from .motion import MotionGate
+from .profiling import RequestProfile, StackSampler
+from .preprocessing import InvalidImageError, preprocess_image, preprocess_batch, batch_buffer
+from .registry import ModelRegistry
+from .storage import azure_urls, verify_direct_upload_token
+from .utils import FRAME_HEADER, unpack_frame_buffer, local_video_path, create_thumbnail, \
+    parse_range_header, read_video_metadata
+
 
 class JWTClient(Client):
     def __init__(self, *args, **kwargs):
@@ -37,8 +73,9 @@ class JWTClient(Client):
 class ApiTest(TestCase):
     def setUp(self):
         """
-        Set up the test client and test user.
+        Set up the test client and test user, and clear cached video lists of earlier tests.
         """
+        cache.clear()
         self.client = JWTClient()
         self.user = User.objects.create_user(username='testuser', password='testing')
         self.client.authenticate(username='testuser', password='testing')
@@ -75,6 +112,112 @@ class ApiTest(TestCase):
         self.assertEqual(len(bbox), 4, 'Bounding box should have 4 coordinates')
         self.assertTrue(label, 'Confidence should be returned')
 
+    def test_predict_skips_frames_without_motion(self):
+        """
+        Test that a camera session's frame without motion gets the previous prediction without inference.
+        """
+        test_image = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_image.png')
+        with open(test_image, 'rb') as image_file:
+            frame = image_file.read()
+
+        def predict(data):
+            image = SimpleUploadedFile('test_image.jpg', frame, content_type='image/jpeg')
+            return self.client.post('/api/predict/', {'image': image, **data})
+
+        first = json.loads(predict({'session': 'camera-1'}).content)
+        second = json.loads(predict({'session': 'camera-1'}).content)
+        self.assertFalse(first['skipped'], 'First frame of the session should be predicted')
+        self.assertTrue(second['skipped'], 'Frame without motion should be skipped')
+        self.assertEqual(first['prediction'], second['prediction'], 'Skipped frame should get the last prediction')
+        self.assertFalse(json.loads(predict({'session': 'camera-2'}).content)['skipped'],
+                         'Sessions should be gated separately')
+        self.assertFalse(json.loads(predict({}).content)['skipped'], 'Frames without session should be predicted')
+
+        response = predict({'session': 'camera-1', 'motion_threshold': '2'})
+        self.assertEqual(response.status_code, 400, 'Threshold should be between 0 and 1')
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape-token')
+    def test_metrics_view(self):
+        """
+        Test that requests and their stages are counted and served to the scraper and admin users only.
+        """
+        # Middleware is loaded with the first request of a client
+        client = JWTClient()
+        client.authenticate(username='testuser', password='testing')
+        test_image = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_image.png')
+        with open(test_image, 'rb') as image_file:
+            image = SimpleUploadedFile('test_image.jpg', image_file.read(), content_type='image/jpeg')
+            client.post('/api/predict/', {'image': image})
+
+        self.assertEqual(client.get('/api/metrics/').status_code, 403, 'Users should not see the metrics')
+        scraper = Client(HTTP_AUTHORIZATION='Bearer scrape-token')
+        response = scraper.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200, 'Scraper should see the metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        metrics = response.content.decode()
+        self.assertIn('buddywatch_http_requests_total{route="api/predict/",method="POST",status="200"}', metrics)
+        for name in ['parse', 'decode', 'resize', 'inference', 'forward', 'serialize']:
+            self.assertIn(f'buddywatch_stage_duration_seconds_count{{stage="{name}"}}', metrics,
+                          f'Stage {name} should be timed')
+        self.assertIn('buddywatch_predictor{stat="frames"}', metrics, 'Predictor statistics should be exported')
+
+        wrong = Client(HTTP_AUTHORIZATION='Bearer wrong-token')
+        self.assertEqual(wrong.get('/api/metrics/').status_code, 401, 'Wrong token should be rejected')
+        with override_settings(METRICS_ENABLED=False):
+            self.assertEqual(scraper.get('/api/metrics/').status_code, 404)
+
+    def test_batch_predict_view(self):
+        """
+        Test the batch predict view with a packed frame buffer of test images.
+        """
+        test_image = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_image.png')
+        with open(test_image, 'rb') as image_file:
+            frame = image_file.read()
+        frame_buffer = (FRAME_HEADER.pack(len(frame)) + frame) * 3
+
+        response = self.client.post('/api/predict/batch/', frame_buffer, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 200, 'Response should be successfully returned')
+
+        predictions = json.loads(response.content.decode('utf-8'))['predictions']
+        self.assertEqual(len(predictions), 3, 'Every image should have a prediction')
+        self.assertEqual(predictions[0], predictions[2], 'Same images should have the same prediction')
+
+    def test_predict_without_user_query(self):
+        """
+        Test that the predict view authenticates from the token claims without querying the database.
+        """
+        test_image = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_image.png')
+        with open(test_image, 'rb') as image_file:
+            image = SimpleUploadedFile('test_image.jpg', image_file.read(), content_type='image/jpeg')
+        # Whether the user's tokens are revoked is read from the database once, then from the cache
+        self.client.post('/api/predict/', {'image': image})
+        image.seek(0)
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/predict/', {'image': image})
+        self.assertEqual(response.status_code, 200, 'Response should be successfully returned')
+
+        token = AccessToken(self.client.token)
+        self.assertEqual(token['username'], 'testuser', 'Token should have the username')
+        self.assertTrue(token['is_active'], 'Token should have the active flag')
+
+    def test_deactivated_user_token_is_revoked(self):
+        """
+        Test that tokens of a deactivated user are rejected by both authentication modes.
+        """
+        # Revocation is cached, don't let it affect other tests
+        self.addCleanup(cache.clear)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.post('/api/predict/', {})
+        self.assertEqual(response.status_code, 401, 'Stateless authentication should reject the token')
+        response = self.client.get('/api/videos/')
+        self.assertEqual(response.status_code, 401, 'Full authentication should reject the token')
+
+        cache.clear()
+        response = self.client.post('/api/predict/', {})
+        self.assertEqual(response.status_code, 401, 'Revocation should be kept when the cache is cleared')
+
     def test_get_videos(self):
         """
         Test list video view by getting all videos for test user.
@@ -82,6 +225,153 @@ class ApiTest(TestCase):
         response = self.client.get('/api/videos/')
         self.assertEqual(response.status_code, 200)
 
+    def test_get_videos_paginated(self):
+        """
+        Test paging through the video list with cursor and filtering it by title prefix.
+        """
+        for i in range(5):
+            Video.objects.create(title=f'Video {i}', file=f'videos/video_{i}.webm', owner=self.user)
+        all_ids = [video['id'] for video in json.loads(self.client.get('/api/videos/').content.decode('utf-8'))]
+
+        paged_ids = []
+        url = '/api/videos/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, 'Page should be returned')
+            page = json.loads(response.content.decode('utf-8'))
+            self.assertLessEqual(len(page['results']), 2, 'Page should have at most page_size videos')
+            paged_ids += [video['id'] for video in page['results']]
+            url = page['next']
+        self.assertEqual(paged_ids, all_ids, 'Pages should contain every video once in the same order')
+
+        response = self.client.get('/api/videos/?title_prefix=Video 3')
+        videos = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([video['title'] for video in videos], ['Video 3'], 'Only matching video should be listed')
+
+        response = self.client.get('/api/videos/?cursor=invalid')
+        self.assertEqual(response.status_code, 404, 'Invalid cursor should be rejected')
+
+    def test_get_videos_not_modified(self):
+        """
+        Test that unchanged video list is answered with 304 and that the ETag changes
+        when a video is added or deleted.
+        """
+        response = self.client.get('/api/videos/')
+        etag = response['ETag']
+        response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304, 'Unchanged list should not be sent again')
+
+        video = Video.objects.create(title='New video', file='videos/new_video.webm', owner=self.user)
+        response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200, 'Changed list should be sent')
+        videos = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([v['id'] for v in videos], [video.id], 'New video should be listed')
+        self.assertNotEqual(response['ETag'], etag, 'ETag should change with the list')
+
+        etag = response['ETag']
+        video.delete()
+        response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(json.loads(response.content.decode('utf-8')), [], 'Deleted video should not be listed')
+
+    def test_list_version_kept_in_database(self):
+        """
+        Test that polling an unchanged list doesn't query the database, and that the version
+        continues from the database when the cache is cleared.
+        """
+        etag = self.client.get('/api/videos/')['ETag']
+        self.assertFalse(VideoListVersion.objects.exists(), 'Reading the list should not write the version')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304, 'Unchanged list should not be sent again')
+
+        Video.objects.create(title='New video', file='videos/new_video.webm', owner=self.user)
+        etag = self.client.get('/api/videos/')['ETag']
+        cache.clear()
+        response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304, 'Version should not start over when the cache is cleared')
+
+        Video.objects.create(title='Other video', file='videos/other_video.webm', owner=self.user)
+        response = self.client.get('/api/videos/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200, 'Changed list should be sent')
+
+    def test_upload_processed_by_worker(self):
+        """
+        Test that uploaded video is processed by the background worker, which
+        creates the thumbnail and reads the metadata of the video.
+        """
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with open(test_video, 'rb') as video_file:
+            video = SimpleUploadedFile('test_video.webm', video_file.read(), content_type='video/mp4')
+            response_upload = self.client.post('/api/videos/upload/', {'file': video, 'title': 'Test video'})
+        self.assertEqual(response_upload.status_code, 201, 'Video should be successfully uploaded')
+        video = Video.objects.get(pk=json.loads(response_upload.content.decode('utf-8'))['id'])
+        self.assertEqual(video.processing_status, Video.PROCESSING_PENDING, 'Video should wait for processing')
+
+        call_command('run_video_worker', '--burst', stdout=io.StringIO())
+
+        video.refresh_from_db()
+        self.assertEqual(video.processing_status, Video.PROCESSING_READY, 'Video should be processed')
+        self.assertTrue(video.thumbnail, 'Thumbnail should be created')
+        self.assertTrue(video.width and video.height, 'Video dimensions should be read')
+        self.assertEqual(video.jobs.get().status, VideoJob.STATUS_DONE, 'Job should be done')
+        video.delete()
+
+    def test_video_timeline(self):
+        """
+        Test that the analyze job stores the face detections of the sampled frames of a video
+        and the timeline endpoint returns them.
+        """
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with open(test_video, 'rb') as video_file:
+            video = SimpleUploadedFile('test_video.webm', video_file.read(), content_type='video/mp4')
+            response_upload = self.client.post('/api/videos/upload/', {'file': video, 'title': 'Test video'})
+        video_id = json.loads(response_upload.content.decode('utf-8'))['id']
+        self.assertEqual(self.client.get(f'/api/videos/timeline/{video_id}/').status_code, 404,
+                         'Video should not have a timeline before the analysis')
+
+        response = self.client.post(f'/api/videos/timeline/{video_id}/', {'sample_rate': 5})
+        self.assertEqual(response.status_code, 202, 'Analysis should be queued')
+        self.assertEqual(self.client.post(f'/api/videos/timeline/{video_id}/').status_code, 409,
+                         'Video should not be analyzed twice at the same time')
+
+        registry = apps.get_app_config('api').registry
+        with mock.patch.object(registry, 'predict', fake_model_predict):
+            call_command('run_video_worker', '--burst', stdout=io.StringIO())
+
+        response = self.client.get(f'/api/videos/timeline/{video_id}/?min_confidence=0&detections=true&end=1')
+        self.assertEqual(response.status_code, 200)
+        timeline = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(timeline['status'], 'ready', 'Timeline should be ready')
+        self.assertGreater(timeline['samples'], 1, 'Several frames should be sampled')
+        self.assertEqual(len(timeline['segments']), 1, 'Every sample should be in one segment')
+        times = timeline['detections']['time']
+        self.assertTrue(all(0.2 - 1e-3 <= b - a for a, b in zip(times, times[1:])), 'Frames should be sampled')
+        self.assertLessEqual(times[-1], 1, 'Detections should be limited to the range')
+        self.assertEqual(len(timeline['detections']['bbox'][0]), 4)
+        Video.objects.get(pk=video_id).delete()
+
+    def test_download_video_range(self):
+        """
+        Test that the download view returns the requested part of the video
+        and that an unchanged video is not downloaded again.
+        """
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with open(test_video, 'rb') as video_file:
+            content = video_file.read()
+        video = SimpleUploadedFile('test_video.webm', content, content_type='video/mp4')
+        response_upload = self.client.post('/api/videos/upload/', {'file': video, 'title': 'Test video'})
+        video_id = json.loads(response_upload.content.decode('utf-8'))['id']
+
+        response = self.client.get(f'/api/videos/download/{video_id}/', HTTP_RANGE='bytes=10-109')
+        self.assertEqual(response.status_code, 206, 'Only the requested range should be returned')
+        self.assertEqual(b''.join(response.streaming_content), content[10:110], 'Range should match the file')
+        self.assertEqual(response['Content-Range'], f'bytes 10-109/{len(content)}')
+
+        response = self.client.get(f'/api/videos/download/{video_id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304, 'Unchanged video should not be downloaded again')
+
+        self.client.delete(f'/api/videos/delete/{video_id}/')
+
     def test_upload_and_delete_video(self):
         """
         Test upload and delete video view by first uploading
@@ -112,3 +402,954 @@ class ApiTest(TestCase):
         videos_after = json.loads(response_after.content.decode('utf-8'))
         video_amount_after = len(videos_after)
         self.assertEqual(video_amount_after, video_amount_before, 'Video amount should be the same as before')
+
+
+def fake_model_predict(inputs):
+    """
+    Return model-like output where the confidence is the mean of the image
+    and the bounding box is filled with the same value.
+    """
+    means = inputs.reshape(len(inputs), -1).mean(axis=1)
+    return [means.reshape(-1, 1), np.repeat(means.reshape(-1, 1), 4, axis=1)]
+
+
+class BatchingPredictorTest(SimpleTestCase):
+    def test_concurrent_predictions_are_batched(self):
+        """
+        Test that concurrent predictions are combined into batches
+        and each request gets the result of its own image.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=8, max_wait=0.05)
+        images = [np.full((120, 120, 3), i / 100, dtype=np.float32) for i in range(16)]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(predictor.predict, images))
+
+        for i, result in enumerate(results):
+            self.assertAlmostEqual(result['confidence'], i / 100, places=5, msg='Result should match the image')
+            self.assertEqual(len(result['bbox']), 4, 'Bounding box should have 4 coordinates')
+
+        stats = predictor.stats.snapshot()
+        self.assertEqual(stats['frames'], 16, 'Every image should be predicted once')
+        self.assertLess(stats['batches'], 16, 'Concurrent images should share batches')
+        self.assertLessEqual(stats['max_batch_size'], 8, 'Batch should not exceed the maximum size')
+
+    def test_model_error_is_raised_to_every_request(self):
+        """
+        Test that an error in the forward pass is raised for the waiting requests.
+        """
+        def failing_predict(inputs):
+            raise ValueError('Model failed')
+
+        predictor = BatchingPredictor(failing_predict, max_batch_size=4, max_wait=0.001)
+        with self.assertRaises(ValueError):
+            predictor.predict(np.zeros((120, 120, 3), dtype=np.float32))
+        self.assertEqual(predictor.stats.snapshot()['errors'], 1, 'Error should be counted')
+
+
+class PredictionCacheTest(SimpleTestCase):
+    def create_frame(self, noise=0):
+        """
+        Create a PNG frame of a gradient, with a few pixels brightened by noise.
+        """
+        pixels = np.tile(np.linspace(0, 255, 160, dtype=np.uint8)[None, :, None], (120, 1, 3))
+        pixels[::17, ::13] = np.minimum(pixels[::17, ::13].astype(np.int32) + noise, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def test_repeated_frames_are_cached(self):
+        """
+        Test that a frame with the same bytes is predicted only once.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        cache = PredictionCache(max_size=8, ttl=60)
+        frame = self.create_frame()
+
+        first, first_source = predict_image(predictor, frame, cache)
+        second, second_source = predict_image(predictor, SimpleUploadedFile('frame.png', frame), cache)
+        self.assertEqual(first_source, 'model')
+        self.assertEqual(second_source, 'cache', 'Same frame should come from the cache')
+        self.assertEqual(first, second, 'Cached prediction should match the predicted one')
+        self.assertEqual(predictor.stats.snapshot()['frames'], 1, 'Model should run only once')
+        self.assertEqual(cache.snapshot()['hit_ratio'], 0.5)
+
+    def test_nearly_identical_frames(self):
+        """
+        Test that frames differing only by small noise match by the perceptual hash when it's enabled.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        exact_cache = PredictionCache(max_size=8, ttl=60)
+        perceptual_cache = PredictionCache(max_size=8, ttl=60, perceptual=True)
+        for cache in [exact_cache, perceptual_cache]:
+            predict_image(predictor, self.create_frame(), cache)
+            predict_image(predictor, self.create_frame(noise=2), cache)
+
+        self.assertEqual(exact_cache.snapshot()['content_hits'], 0, 'Different bytes should not match exactly')
+        self.assertEqual(perceptual_cache.snapshot()['perceptual_hits'], 1, 'Noisy frame should match')
+
+    def test_expired_and_evicted_predictions(self):
+        """
+        Test that predictions expire after the TTL and the least recently used prediction is evicted.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        expiring_cache = PredictionCache(max_size=8, ttl=0)
+        frame = self.create_frame()
+        predict_image(predictor, frame, expiring_cache)
+        self.assertEqual(predict_image(predictor, frame, expiring_cache)[1], 'model',
+                         'Expired prediction should not be used')
+
+        small_cache = PredictionCache(max_size=1, ttl=60)
+        predict_image(predictor, frame, small_cache)
+        predict_image(predictor, self.create_frame(noise=50), small_cache)
+        self.assertEqual(predict_image(predictor, frame, small_cache)[1], 'model',
+                         'Evicted prediction should not be used')
+        self.assertEqual(small_cache.snapshot()['evictions'], 2)
+
+
+class MotionGateTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_motion_is_detected(self):
+        """
+        Test that noise is ignored but a moving object and old predictions cause inference.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        rng = np.random.default_rng(0)
+        background = rng.integers(60, 200, (120, 120, 3), dtype=np.uint8)
+
+        def frame(noise=0, square_at=None):
+            pixels = background.astype(np.int16) + rng.integers(-noise, noise + 1, background.shape)
+            if square_at is not None:
+                pixels[square_at:square_at + 20, square_at:square_at + 20] = 255
+            buffer = io.BytesIO()
+            Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='PNG')
+            return buffer.getvalue()
+
+        def source(image, threshold=None):
+            return predict_image(predictor, image, gate=MotionGate(1, 'camera', threshold))[1]
+
+        self.assertEqual(source(frame()), 'model')
+        self.assertEqual(source(frame(noise=3)), 'motion', 'Sensor noise should not count as motion')
+        self.assertEqual(source(frame(square_at=10)), 'model', 'Moving object should be predicted')
+        self.assertEqual(source(frame(square_at=10), threshold=0.5), 'motion')
+        self.assertEqual(source(frame(square_at=60), threshold=0.5), 'motion', 'Client threshold should be used')
+
+        with override_settings(MOTION_GATING_MAX_AGE=0):
+            self.assertEqual(source(frame(square_at=10)), 'model', 'Old prediction should not be reused')
+
+    def test_gated_frame_is_cache_miss(self):
+        """
+        Test that a frame skipped by the motion gate counts as a miss of the prediction cache.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        prediction_cache = PredictionCache(max_size=8, ttl=60)
+        frames = []
+        for color in (100, 101):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 48), (color, color, color)).save(buffer, format='PNG')
+            frames.append(buffer.getvalue())
+
+        sources = [predict_image(predictor, image, prediction_cache, MotionGate(1, 'camera'))[1]
+                   for image in (frames[0], frames[1], frames[0])]
+        self.assertEqual(sources, ['model', 'motion', 'cache'])
+        stats = prediction_cache.snapshot()
+        self.assertEqual(stats['lookups'], 3, 'Gated frame should be counted as a lookup')
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3)
+
+
+class VideoAnalysisTest(SimpleTestCase):
+    def test_parallel_decoding_matches_serial(self):
+        """
+        Test that decoding parts of the video in parallel threads samples the same frames in order.
+        """
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        duration = read_video_metadata(test_video)['duration']
+        serial = analyze_video_file(test_video, fake_model_predict, 3, batch_size=2)
+        parallel = analyze_video_file(test_video, fake_model_predict, 3, batch_size=2, workers=3, duration=duration)
+
+        self.assertGreater(len(serial), 1, 'Several frames should be sampled')
+        np.testing.assert_array_equal(serial['time'], parallel['time'])
+        np.testing.assert_allclose(serial['confidence'], parallel['confidence'], atol=1e-2)
+
+    def test_model_error_stops_decoding(self):
+        """
+        Test that an error of the model is raised and the decoding threads stop.
+        """
+        def failing_predict(inputs):
+            raise ValueError('Model failed')
+
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with self.assertRaises(ValueError):
+            analyze_video_file(test_video, failing_predict, 10, batch_size=1, workers=2, duration=2)
+
+
+class MetricsTest(SimpleTestCase):
+    def test_render(self):
+        """
+        Test the Prometheus text format of counters and cumulative histogram buckets.
+        """
+        registry = Registry()
+        counter = registry.register(Counter('test_requests', 'Requests.', ['route']))
+        histogram = registry.register(Histogram('test_seconds', 'Latency.', ['route'], buckets=(0.1, 1)))
+        counter.inc(route='a"b')
+        counter.inc(2, route='a"b')
+        for value in [0.05, 0.5, 5]:
+            histogram.observe(value, route='x')
+
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE test_requests counter', lines)
+        self.assertIn('test_requests_total{route="a\\"b"} 3.0', lines, 'Quotes in labels should be escaped')
+        self.assertIn('test_seconds_bucket{route="x",le="0.1"} 1.0', lines)
+        self.assertIn('test_seconds_bucket{route="x",le="1.0"} 2.0', lines, 'Buckets should be cumulative')
+        self.assertIn('test_seconds_bucket{route="x",le="+Inf"} 3.0', lines)
+        self.assertIn('test_seconds_count{route="x"} 3.0', lines)
+        self.assertIn('test_seconds_sum{route="x"} 5.55', lines)
+
+    def test_stage_timings(self):
+        """
+        Test that stages are added to the timings of the current request only when timing is enabled.
+        """
+        timings, token = start_request()
+        try:
+            with override_settings(METRICS_ENABLED=False, METRICS_LOG_REQUESTS=False), stage('decode'):
+                pass
+            self.assertEqual(timings, {}, 'Nothing should be timed when disabled')
+            with override_settings(METRICS_ENABLED=False, METRICS_LOG_REQUESTS=True):
+                with stage('decode'):
+                    pass
+                with stage('decode'):
+                    pass
+        finally:
+            end_request(token)
+        self.assertEqual(list(timings), ['decode'], 'Repeated stages should be summed')
+        self.assertGreaterEqual(timings['decode'], 0)
+
+    @override_settings(METRICS_LOG_REQUESTS=True)
+    def test_forward_in_request_timings(self):
+        """
+        Test that the forward pass run by the predictor's worker thread is in the timings of the request.
+        """
+        predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        timings, token = start_request()
+        try:
+            predictor.predict(np.zeros((120, 120, 3), dtype=np.float32), timeout=5)
+        finally:
+            end_request(token)
+        self.assertIn('forward', timings, 'Forward pass should be timed for the request')
+
+
+class ProfilingTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(PROFILING_ENABLED=True, PROFILING_DIR=self.temp_dir.name,
+                                                   PROFILING_SLOW_THRESHOLD_MS=0)
+        self.settings_override.enable()
+        User.objects.create_user(username='testuser', password='testing')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.temp_dir.cleanup()
+
+    def read_index(self):
+        with open(os.path.join(self.temp_dir.name, 'index.jsonl')) as index:
+            return [json.loads(line) for line in index]
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_request_is_profiled(self):
+        """
+        Test that a sampled request gets a cProfile profile and its SQL queries in the index.
+        """
+        client = JWTClient()
+        client.authenticate(username='testuser', password='testing')
+
+        entries = self.read_index()
+        self.assertEqual(len(entries), 1, 'Request should be added to the index')
+        self.assertEqual(entries[0]['route'], 'api/token/')
+        self.assertEqual(entries[0]['reason'], 'sampled')
+        self.assertEqual(entries[0]['format'], 'cprofile')
+        self.assertGreater(entries[0]['sql']['count'], 0, 'Queries of the request should be counted')
+        stats = pstats.Stats(os.path.join(self.temp_dir.name, entries[0]['profile']))
+        self.assertGreater(stats.total_calls, 0, 'Profile should be readable with pstats')
+
+    @override_settings(PROFILING_SAMPLE_RATE=0, PROFILING_SLOW_THRESHOLD_MS=20, PROFILING_MAX_PROFILES=1)
+    def test_slow_request_keeps_stack_samples(self):
+        """
+        Test that only requests over the latency threshold keep their sampled stacks,
+        and that the oldest profiles are removed.
+        """
+        request = mock.Mock(method='GET', path='/api/videos/', resolver_match=None)
+        sampler = StackSampler(0.001)
+        with RequestProfile(False, sampler) as profile:
+            pass
+        self.assertFalse(profile.save(request, 200), 'Fast request should not be written')
+
+        for _ in range(2):
+            with RequestProfile(False, sampler) as profile:
+                time.sleep(0.05)
+            self.assertTrue(profile.save(request, 200), 'Slow request should be written')
+
+        entries = self.read_index()
+        self.assertEqual(len(entries), 1, 'Only the newest profile should be kept')
+        self.assertEqual(entries[0]['reason'], 'slow')
+        self.assertEqual(entries[0]['format'], 'collapsed')
+        with open(os.path.join(self.temp_dir.name, entries[0]['profile'])) as stacks:
+            self.assertIn('test_slow_request_keeps_stack_samples', stacks.read(),
+                          'Stack of the request should be sampled')
+
+
+class ModelRegistryTest(SimpleTestCase):
+    def test_backend_by_import_path(self):
+        """
+        Test that a backend given with its import path is loaded without TensorFlow,
+        like the stub model used by the benchmarks.
+        """
+        registry = ModelRegistry('unused.h5', 'benchmarks.stub.StubBackend')
+        registry.preload()
+        self.assertFalse(registry.loaded, 'Preload should not load a custom backend')
+
+        confidence, bbox = registry.predict(np.zeros((3, 120, 120, 3), dtype=np.float32))
+        self.assertEqual(confidence.shape, (3, 1), 'Every image should get a confidence')
+        self.assertEqual(bbox.shape, (3, 4), 'Every image should get a bounding box')
+        self.assertEqual(registry.get_backend().name, 'stub')
+
+
+class FrameBufferTest(SimpleTestCase):
+    def create_frame(self, color):
+        """
+        Create a small PNG image with a single color.
+        """
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 24), color).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def test_unpack_frame_buffer(self):
+        """
+        Test that packed frames are unpacked in order and decoded into a single batch.
+        """
+        frames = [self.create_frame((255, 0, 0)), self.create_frame((0, 0, 255))]
+        frame_buffer = b''.join(FRAME_HEADER.pack(len(frame)) + frame for frame in frames)
+
+        image_batch = preprocess_batch(unpack_frame_buffer(frame_buffer))
+        self.assertEqual(image_batch.shape, (2, 120, 120, 3), 'Images should be resized into one batch')
+        self.assertAlmostEqual(float(image_batch[0, :, :, 0].mean()), 1.0, places=5, msg='First image should be red')
+        self.assertAlmostEqual(float(image_batch[1, :, :, 2].mean()), 1.0, places=5, msg='Second image should be blue')
+
+    def test_truncated_frame_buffer(self):
+        """
+        Test that a truncated frame buffer is rejected.
+        """
+        frame = self.create_frame((0, 255, 0))
+        with self.assertRaises(ValueError):
+            unpack_frame_buffer(FRAME_HEADER.pack(len(frame)) + frame[:-10])
+
+
+class PreprocessingTest(SimpleTestCase):
+    def create_image(self, size, image_format):
+        """
+        Create an image with a smooth gradient, so reduced decoding changes it only a little.
+        """
+        x = np.linspace(0, 255, size[0], dtype=np.uint8)
+        y = np.linspace(0, 255, size[1], dtype=np.uint8)
+        pixels = np.stack([np.tile(x, (size[1], 1)), np.tile(y[:, None], (1, size[0])),
+                           np.full((size[1], size[0]), 128, dtype=np.uint8)], axis=2)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format=image_format)
+        return buffer.getvalue()
+
+    def reference(self, data):
+        """
+        Preprocess the image by decoding it at full size.
+        """
+        image = Image.open(io.BytesIO(data)).convert('RGB').resize((120, 120))
+        return np.asarray(image, dtype=np.float32) / 255.0
+
+    def test_preprocess_image(self):
+        """
+        Test that preprocessing gives the same float32 input as full decoding, and that
+        large JPEG images decoded at reduced size stay close to it.
+        """
+        png = self.create_image((200, 150), 'PNG')
+        image_array = preprocess_image(io.BytesIO(png))
+        self.assertEqual(image_array.dtype, np.float32, 'Input should be float32')
+        np.testing.assert_array_equal(image_array, self.reference(png))
+
+        jpeg = self.create_image((960, 720), 'JPEG')
+        difference = np.abs(preprocess_image(io.BytesIO(jpeg), draft=True) - self.reference(jpeg))
+        self.assertLess(float(difference.mean()), 0.02, 'Reduced decoding should be close to full decoding')
+        np.testing.assert_array_equal(preprocess_image(io.BytesIO(jpeg), draft=False), self.reference(jpeg))
+
+    def test_invalid_images_are_rejected(self):
+        """
+        Test that unknown formats and too large images are rejected before decoding.
+        """
+        with self.assertRaises(InvalidImageError):
+            preprocess_image(io.BytesIO(b'not an image'))
+        with override_settings(PREPROCESS_MAX_PIXELS=100), self.assertRaises(InvalidImageError):
+            preprocess_image(io.BytesIO(self.create_image((20, 20), 'PNG')))
+
+    def test_batch_buffer_is_reused(self):
+        """
+        Test that batches are written into the same buffer of the thread until a larger one is needed.
+        """
+        png = self.create_image((60, 40), 'PNG')
+        first = preprocess_batch([io.BytesIO(png)] * 2, batch_buffer(2))
+        second = batch_buffer(1)
+        self.assertTrue(np.shares_memory(first, second), 'Smaller batch should reuse the buffer')
+        self.assertEqual(batch_buffer(8).shape, (8, 120, 120, 3), 'Buffer should grow for larger batches')
+
+
+class PredictConsumerTest(TransactionTestCase):
+    def setUp(self):
+        """
+        Create test user and replace the predictor with one using a fake model.
+        """
+        self.user = User.objects.create_user(username='testuser', password='testing')
+        self.api_config = apps.get_app_config('api')
+        self.original_predictor = self.api_config.predictor
+        self.api_config.predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+
+    def tearDown(self):
+        self.api_config.predictor = self.original_predictor
+
+    def create_frame(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), (255, 255, 255)).save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    async def test_stream_frames(self):
+        """
+        Test that authenticated client gets a prediction for a streamed frame.
+        """
+        token = str(AccessToken.for_user(self.user))
+        scope = {'type': 'websocket', 'path': '/ws/predict/', 'query_string': f'token={token}'.encode(),
+                 'headers': []}
+        communicator = ApplicationCommunicator(PredictConsumer(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept',
+                         'Connection should be accepted')
+
+        await communicator.send_input({'type': 'websocket.receive', 'bytes': self.create_frame()})
+        message = json.loads((await communicator.receive_output(5))['text'])
+        self.assertTrue(message['success'], 'Frame should be successfully predicted')
+        self.assertEqual(message['frame'], 1, 'Result should tell which frame was predicted')
+        self.assertEqual(len(message['prediction']['bbox']), 4, 'Bounding box should have 4 coordinates')
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    async def test_failed_prediction_is_reported(self):
+        """
+        Test that a failing predictor is reported for the frame and the stream keeps being predicted.
+        """
+        def failing_predict(inputs):
+            raise RuntimeError('Model failed')
+
+        self.api_config.predictor = BatchingPredictor(failing_predict, max_batch_size=4, max_wait=0.001)
+        token = str(AccessToken.for_user(self.user))
+        scope = {'type': 'websocket', 'path': '/ws/predict/', 'query_string': f'token={token}'.encode(),
+                 'headers': []}
+        communicator = ApplicationCommunicator(PredictConsumer(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output(5)
+
+        with self.assertLogs('api.consumers', level='ERROR'):
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': self.create_frame()})
+            message = json.loads((await communicator.receive_output(5))['text'])
+        self.assertEqual(message, {"success": False, "frame": 1, "error": "Prediction failed"},
+                         'Failed prediction should be reported for the frame')
+
+        self.api_config.predictor = BatchingPredictor(fake_model_predict, max_batch_size=4, max_wait=0.001)
+        await communicator.send_input({'type': 'websocket.receive', 'bytes': self.create_frame()})
+        message = json.loads((await communicator.receive_output(5))['text'])
+        self.assertTrue(message['success'], 'Next frame should still be predicted')
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+    async def test_connection_without_token_is_rejected(self):
+        """
+        Test that connection without access token is closed before it's accepted.
+        """
+        scope = {'type': 'websocket', 'path': '/ws/predict/', 'query_string': b'', 'headers': []}
+        communicator = ApplicationCommunicator(PredictConsumer(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        message = await communicator.receive_output(5)
+        self.assertEqual(message, {'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED},
+                         'Connection should be rejected')
+
+
+class ThumbnailTest(SimpleTestCase):
+    def create_video(self):
+        """
+        Create a short 640x480 video and return it as an in-memory upload.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_path = os.path.join(temp_dir, 'video.avi')
+            writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (640, 480))
+            for i in range(5):
+                writer.write(np.full((480, 640, 3), i * 40, dtype=np.uint8))
+            writer.release()
+            with open(video_path, 'rb') as video_file:
+                return SimpleUploadedFile('video.avi', video_file.read(), content_type='video/x-msvideo')
+
+    @override_settings(THUMBNAIL_MAX_SIZE=160, THUMBNAIL_FORMAT='jpeg', THUMBNAIL_QUALITY=80)
+    def test_create_thumbnail(self):
+        """
+        Test that the thumbnail is a JPEG scaled down to the maximum size
+        and that the temporary copy of the upload is removed afterwards.
+        """
+        with local_video_path(self.create_video()) as video_path:
+            thumbnail = create_thumbnail(video_path)
+        self.assertFalse(os.path.exists(video_path), 'Temporary video file should be deleted')
+
+        image = Image.open(io.BytesIO(thumbnail))
+        self.assertEqual(image.format, 'JPEG', 'Thumbnail should be a JPEG image')
+        self.assertEqual(image.size, (160, 120), 'Thumbnail should keep the aspect ratio of the video')
+
+
+class RangeHeaderTest(SimpleTestCase):
+    def test_parse_range_header(self):
+        """
+        Test parsing of single byte ranges.
+        """
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=500-5000', 1000), (500, 999), 'Range should end at the file end')
+        self.assertIsNone(parse_range_header(None, 1000), 'Missing header means the whole file')
+        self.assertIsNone(parse_range_header('bytes=0-1,5-9', 1000), 'Multiple ranges return the whole file')
+
+    def test_unsatisfiable_range(self):
+        """
+        Test that ranges outside the file are rejected.
+        """
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=1000-', 1000)
+        with self.assertRaises(ValueError):
+            parse_range_header('bytes=20-10', 1000)
+        with self.assertRaises(ValueError, msg='Empty file has no bytes to return'):
+            parse_range_header('bytes=-100', 0)
+
+
+def local_storages(location):
+    """
+    Storage settings that keep the files in a local directory instead of Azure.
+    """
+    return {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': location},
+        },
+        'staticfiles': settings.STORAGES['staticfiles'],
+    }
+
+
+class LocalStorageTestCase(TestCase):
+    """
+    Keep the stored files in a temporary directory instead of Azure, start with an empty cache
+    and authenticate the test client as the test user.
+    """
+
+    def local_settings(self):
+        """
+        Other settings of the tests, overridden together with the storage.
+        """
+        return {}
+
+    def setUp(self):
+        cache.clear()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        settings_override = override_settings(STORAGES=local_storages(temp_dir.name), **self.local_settings())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = JWTClient()
+        self.user = User.objects.create_user(username='testuser', password='testing')
+        self.client.authenticate(username='testuser', password='testing')
+
+
+class DirectStorageTest(LocalStorageTestCase):
+    def local_settings(self):
+        return {'DIRECT_STORAGE_ENABLED': True, 'VIDEO_JOBS_ASYNC': False}
+
+    def test_direct_upload_and_download(self):
+        """
+        Test uploading a video directly to the storage with signed URL, completing
+        the upload and downloading the video with signed URL.
+        """
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with open(test_video, 'rb') as video_file:
+            content = video_file.read()
+
+        response = self.client.post('/api/videos/upload/direct/', {'filename': 'test_video.webm'})
+        self.assertEqual(response.status_code, 200, 'Upload URL should be returned')
+        response_content = json.loads(response.content.decode('utf-8'))
+        upload = response_content['upload']
+
+        response = self.client.put(upload['url'], content, content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 201, 'File should be uploaded to the storage')
+
+        response = self.client.post('/api/videos/upload/direct/complete/',
+                                    {'title': 'Direct video', 'upload_token': response_content['upload_token']})
+        self.assertEqual(response.status_code, 201, 'Video should be created from the uploaded file')
+        video = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(video['size'], len(content), 'Video size should match the uploaded file')
+
+        response = self.client.get(f"/api/videos/download/{video['id']}/url/")
+        download_url = json.loads(response.content.decode('utf-8'))['download']['url']
+        response = self.client.get(download_url)
+        self.assertEqual(b''.join(response.streaming_content), content, 'Downloaded file should match the upload')
+
+    def test_tampered_upload_url_is_rejected(self):
+        """
+        Test that the signed URL can't be used after it has been modified.
+        """
+        response = self.client.post('/api/videos/upload/direct/', {'filename': 'test_video.webm'})
+        upload_url = json.loads(response.content.decode('utf-8'))['upload']['url']
+
+        response = self.client.put(upload_url.replace('/storage/', '/storage/x'), b'data',
+                                   content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 403, 'Tampered URL should be rejected')
+
+    def test_concurrent_uploads_of_same_file(self):
+        """
+        Test that uploads and completes racing with another request for the same file are rejected.
+        """
+        response = self.client.post('/api/videos/upload/direct/', {'filename': 'test_video.webm'})
+        response_content = json.loads(response.content.decode('utf-8'))
+        upload_url = response_content['upload']['url']
+        response = self.client.put(upload_url, b'video', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 201, 'File should be uploaded to the storage')
+        name = verify_direct_upload_token(response_content['upload_token'], self.user)
+        directory, filename = name.split('/')
+
+        # Other upload stores the file after this one checked that it doesn't exist yet
+        exists = default_storage.exists
+        checks = iter([False])
+        with mock.patch.object(default_storage, 'exists', side_effect=lambda file: next(checks, exists(file))):
+            response = self.client.put(upload_url, b'other', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 409, 'Second upload of the same URL should be rejected')
+        self.assertEqual([file for file in default_storage.listdir(directory)[1] if file.startswith(filename[:32])],
+                         [filename], 'Rejected upload should not be left in the storage')
+        with default_storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'video', 'First upload should be kept')
+
+        # Other complete creates the video after this one checked that it doesn't exist yet
+        size = default_storage.size
+
+        def complete_concurrently(file_name):
+            Video.objects.create(title='Other', file=file_name, owner=self.user)
+            return size(file_name)
+
+        with mock.patch.object(default_storage, 'size', side_effect=complete_concurrently):
+            response = self.client.post('/api/videos/upload/direct/complete/',
+                                        {'title': 'Direct video', 'upload_token': response_content['upload_token']})
+        self.assertEqual(response.status_code, 400, 'Second complete of the same upload should be rejected')
+        self.assertEqual(Video.objects.filter(file=name).count(), 1, 'File should belong to a single video')
+
+
+class BulkDeleteTest(LocalStorageTestCase):
+    def setUp(self):
+        """
+        Create videos with thumbnails for two users.
+        """
+        super().setUp()
+        self.other = User.objects.create_user(username='otheruser', password='testing')
+        self.videos = []
+        for index, owner in enumerate([self.user, self.user, self.user, self.other]):
+            video = Video(title=f'Video {index}', owner=owner, processing_status=Video.PROCESSING_READY)
+            video.file.save(f'video_{index}.webm', ContentFile(b'video'), save=False)
+            video.thumbnail.save(f'thumbnail_{index}.jpg', ContentFile(b'thumbnail'), save=False)
+            video.save()
+            self.videos.append(video)
+
+    def stored(self, video):
+        return default_storage.exists(video.file.name)
+
+    def test_delete_by_ids(self):
+        """
+        Test that the user's videos are deleted with their files and other users' videos are left alone.
+        """
+        first, second, kept, other = self.videos
+        etag = self.client.get('/api/videos/')['ETag']
+        default_storage.delete(second.thumbnail.name)
+
+        response = self.client.post('/api/videos/delete/', {'ids': [first.pk, second.pk, other.pk, 999]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, 'Videos should be deleted')
+        response_content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(response_content['deleted'], 2)
+        self.assertEqual(response_content['not_found'], [other.pk, 999], 'Other users\' videos should not be found')
+        results = {result['id']: result['files'] for result in response_content['results']}
+        self.assertEqual(results[first.pk], {'file': 'deleted', 'thumbnail': 'deleted'})
+        self.assertEqual(results[second.pk]['thumbnail'], 'missing', 'Missing file should be reported')
+
+        self.assertEqual(list(Video.objects.values_list('pk', flat=True).order_by('pk')), [kept.pk, other.pk])
+        self.assertFalse(self.stored(first) or self.stored(second), 'Files should be deleted from the storage')
+        self.assertTrue(self.stored(kept) and self.stored(other), 'Other files should be kept')
+        self.assertNotEqual(self.client.get('/api/videos/')['ETag'], etag, 'Video list should change')
+
+    def test_delete_by_date_range(self):
+        """
+        Test deleting the videos created in a date range, and that ids and a range can't be combined.
+        """
+        first, second, kept, other = self.videos
+        Video.objects.filter(pk__in=[first.pk, second.pk, other.pk]).update(
+            created_at=timezone.make_aware(datetime(2024, 1, 1, 12)))
+
+        response = self.client.post('/api/videos/delete/', {'created_after': '2024-01-01',
+                                                             'created_before': '2024-01-02'},
+                                    content_type='application/json')
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['deleted'], 2,
+                         'Videos of the day should be deleted')
+        self.assertEqual(Video.objects.filter(pk__in=[kept.pk, other.pk]).count(), 2)
+
+        response = self.client.post('/api/videos/delete/', {'ids': [kept.pk], 'created_after': '2024-01-01'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400, 'Ids and range should not be combined')
+        response = self.client.post('/api/videos/delete/', {'created_after': 'yesterday'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400, 'Invalid date should be rejected')
+
+
+class RetentionTest(LocalStorageTestCase):
+    def local_settings(self):
+        return {'RETENTION_MAX_AGE_DAYS': 0, 'RETENTION_MAX_BYTES': 0, 'RETENTION_MAX_COUNT': 0}
+
+    def setUp(self):
+        """
+        Create five videos of 100 bytes a day apart, newest first.
+        """
+        super().setUp()
+        self.videos = []
+        now = timezone.now()
+        for age in range(5):
+            video = Video(title=f'Video {age}', owner=self.user, size=100)
+            video.file.save(f'retention_{age}.webm', ContentFile(b'video'), save=False)
+            video.save()
+            Video.objects.filter(pk=video.pk).update(created_at=now - timedelta(days=age, hours=1))
+            self.videos.append(video)
+
+    def purge(self, *args):
+        out = io.StringIO()
+        call_command('purge_videos', *args, stdout=out)
+        return out.getvalue()
+
+    def remaining(self):
+        return list(Video.objects.order_by('-created_at').values_list('title', flat=True))
+
+    def test_policy_limits(self):
+        """
+        Test that the oldest videos over each limit are purged, with their files, and that the
+        settings are used for the limits the user's policy leaves empty.
+        """
+        policy = RetentionPolicy.objects.create(owner=self.user, max_count=4)
+        with override_settings(RETENTION_MAX_COUNT=1):
+            self.assertIn('Would purge 1 videos, 100 bytes', self.purge('--dry-run'))
+        self.assertEqual(len(self.remaining()), 5, 'Dry run should not delete anything')
+
+        self.purge('--chunk-size', '1')
+        self.assertEqual(self.remaining(), ['Video 0', 'Video 1', 'Video 2', 'Video 3'])
+        self.assertFalse(default_storage.exists(self.videos[4].file.name), 'File should be deleted')
+
+        policy.max_count = None
+        policy.max_bytes = 250
+        policy.save()
+        self.purge()
+        self.assertEqual(self.remaining(), ['Video 0', 'Video 1'], 'Videos over the bytes limit should be purged')
+
+        policy.max_bytes = None
+        policy.save()
+        with override_settings(RETENTION_MAX_AGE_DAYS=1):
+            self.purge()
+        self.assertEqual(self.remaining(), ['Video 0'], 'Videos over the age limit should be purged')
+        self.assertIn('Purged 0 videos', self.purge(), 'Purge should be idempotent')
+
+    def test_failed_storage_deletes_are_retried(self):
+        """
+        Test that files which couldn't be deleted are kept as pending and deleted by the next purge.
+        """
+        RetentionPolicy.objects.create(owner=self.user, max_count=3)
+        with mock.patch('api.deletion.delete_files',
+                        side_effect=lambda storage, names: {name: 'Storage unavailable' for name in names}):
+            self.purge()
+        self.assertEqual(len(self.remaining()), 3, 'Videos should be deleted from the database')
+        self.assertEqual(StorageDeletion.objects.filter(attempts=1).count(), 2, 'Failed files should be pending')
+        self.assertTrue(default_storage.exists(self.videos[4].file.name))
+
+        self.assertIn('Deleted 2 files left by earlier deletes', self.purge())
+        self.assertFalse(StorageDeletion.objects.exists(), 'Deleted files should not be pending')
+        self.assertFalse(default_storage.exists(self.videos[4].file.name), 'File should be deleted on retry')
+
+
+class ChunkedUploadTest(LocalStorageTestCase):
+    def local_settings(self):
+        """
+        Chunks small enough to split the test video in three.
+        """
+        return {'CHUNKED_UPLOAD_MAX_CHUNK_SIZE': len(self.content) // 3 + 1, 'VIDEO_JOBS_ASYNC': False}
+
+    def setUp(self):
+        test_video = os.path.join(settings.MEDIA_ROOT, 'testing', 'test_video.webm')
+        with open(test_video, 'rb') as video_file:
+            self.content = video_file.read()
+        super().setUp()
+
+    def start_upload(self):
+        response = self.client.post('/api/videos/upload/chunked/',
+                                    {'title': 'Chunked video', 'filename': 'test_video.webm',
+                                     'size': len(self.content)})
+        self.assertEqual(response.status_code, 201, 'Upload should be started')
+        return json.loads(response.content.decode('utf-8'))
+
+    def put_chunk(self, upload_id, offset, chunk, **headers):
+        return self.client.put(f'/api/videos/upload/chunked/{upload_id}/', chunk,
+                               content_type='application/octet-stream',
+                               headers={'Upload-Offset': str(offset), **headers})
+
+    def test_chunked_upload(self):
+        """
+        Test uploading a video in chunks with checksums, resuming after a wrong offset
+        and completing the upload.
+        """
+        upload = self.start_upload()
+        chunk_size = upload['chunk_size']
+
+        offset = 0
+        while offset < len(self.content):
+            chunk = self.content[offset:offset + chunk_size]
+            checksum = base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+            response = self.put_chunk(upload['upload_id'], offset, chunk, **{'Upload-Checksum': f'sha256 {checksum}'})
+            self.assertEqual(response.status_code, 200, 'Chunk should be accepted')
+            offset = int(response['Upload-Offset'])
+
+            # Sending the same chunk again must not write it twice
+            if offset < len(self.content):
+                response = self.put_chunk(upload['upload_id'], 0, chunk)
+                self.assertEqual(response.status_code, 409, 'Chunk with wrong offset should be rejected')
+                self.assertEqual(int(response['Upload-Offset']), offset, 'Current offset should be returned')
+
+        response = self.client.post(f"/api/videos/upload/chunked/{upload['upload_id']}/complete/")
+        self.assertEqual(response.status_code, 201, 'Video should be created from the chunks')
+        video = Video.objects.get(pk=json.loads(response.content.decode('utf-8'))['id'])
+        with video.file.open('rb') as video_file:
+            self.assertEqual(video_file.read(), self.content, 'Assembled file should match the original')
+        self.assertEqual(video.processing_status, Video.PROCESSING_READY, 'Video should be processed')
+
+    def test_invalid_chunks_are_rejected(self):
+        """
+        Test that chunks with wrong checksum and uploads with missing chunks are rejected.
+        """
+        upload = self.start_upload()
+
+        chunk = self.content[:upload['chunk_size']]
+        response = self.put_chunk(upload['upload_id'], 0, chunk, **{'Upload-Checksum': 'sha256 AAAA'})
+        self.assertEqual(response.status_code, 400, 'Chunk with wrong checksum should be rejected')
+
+        response = self.put_chunk(upload['upload_id'], 0, self.content[:upload['chunk_size'] + 1])
+        self.assertEqual(response.status_code, 413, 'Too large chunk should be rejected')
+
+        response = self.client.post(f"/api/videos/upload/chunked/{upload['upload_id']}/complete/")
+        self.assertEqual(response.status_code, 409, 'Upload with missing chunks should not be completed')
+
+
+class StorageUrlTest(LocalStorageTestCase):
+    def test_list_urls_are_cached(self):
+        """
+        Test that URLs of the listed videos are created once and then taken from the cache.
+        """
+        for i in range(3):
+            Video.objects.create(title=f'Video {i}', file=f'videos/video_{i}.webm',
+                                 thumbnail=f'thumbnails/video_{i}.jpeg', owner=self.user)
+
+        with mock.patch.object(FileSystemStorage, 'url', autospec=True, side_effect=FileSystemStorage.url) as url:
+            response = self.client.get('/api/videos/')
+            self.assertEqual(url.call_count, 6, 'URL of each file should be created once')
+            self.client.get('/api/videos/')
+            self.assertEqual(url.call_count, 6, 'URLs should be taken from the cache')
+
+        videos = json.loads(response.content.decode('utf-8'))
+        self.assertTrue(videos[0]['file'].startswith('http://testserver/media/videos/'), 'File URL should be absolute')
+        self.assertTrue(videos[0]['thumbnail'].startswith('http://testserver/media/thumbnails/'),
+                        'Thumbnail URL should be absolute')
+
+    def test_azure_urls_match_storage(self):
+        """
+        Test that URLs built in a batch are the same as the URLs of the Azure storage backend.
+        """
+        storage = AzureStorage(account_name='buddywatch', account_key=base64.b64encode(b'key').decode(),
+                               azure_container='media')
+        name = 'videos/test video ä.webm'
+        self.assertEqual(azure_urls(storage, [name])[name], storage.url(name), 'URLs should match')
+
+        storage.expiration_secs = 300
+        url = azure_urls(storage, [name])[name]
+        self.assertEqual(url.split('?')[0], storage.url(name).split('?')[0], 'Signed URLs should point to same blob')
+        self.assertIn('sig=', url, 'URL should have a shared access signature')
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    def test_stats_of_alias_pools_are_added(self):
+        """
+        Test that pools of the same alias with different connection parameters are all counted.
+        """
+        first = ConnectionPool(FakeConnection, min_size=1, max_size=2)
+        second = ConnectionPool(FakeConnection, min_size=2, max_size=2)
+        second.getconn()
+        alias_pools = {('stats', os.getpid(), (('dbname', 'buddywatch'),)): first,
+                       ('stats', os.getpid(), (('dbname', 'test_buddywatch'),)): second}
+        with mock.patch.dict(pools, alias_pools):
+            stats = pool_stats()['stats']
+        self.assertEqual(stats['pools'], 2)
+        self.assertEqual((stats['size'], stats['idle'], stats['in_use']), (3, 2, 1))
+        self.assertEqual(stats['max_size'], 4)
+
+    def test_connections_are_reused(self):
+        """
+        Test that returned connections are handed out again instead of connecting again.
+        """
+        pool = ConnectionPool(FakeConnection, max_size=2, is_broken=lambda connection: connection.closed != 0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection, 'Idle connection should be reused')
+        self.assertEqual(pool.snapshot()['created'], 1, 'Only one connection should be created')
+
+    def test_full_pool_times_out(self):
+        """
+        Test that a request for a connection waits for a free connection and times out when none is returned.
+        """
+        pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+        connection = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+        pool.timeout = 5
+        with ThreadPoolExecutor(1) as executor:
+            waiting = executor.submit(pool.getconn)
+            pool.putconn(connection)
+            self.assertIs(waiting.result(), connection, 'Returned connection should be given to the waiting thread')
+
+    def test_broken_connections_are_replaced(self):
+        """
+        Test that closed connections and connections failing the health check are replaced.
+        """
+        def check(connection):
+            raise OSError('Connection lost')
+
+        pool = ConnectionPool(FakeConnection, max_size=1, check=check, check_after=0,
+                              is_broken=lambda connection: connection.closed != 0)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertIsNot(pool.getconn(), connection, 'Connection failing the check should be replaced')
+        self.assertEqual(pool.snapshot()['discarded'], 1, 'Broken connection should be discarded')
+        self.assertEqual(pool.snapshot()['size'], 1, 'Pool should not grow past max_size')
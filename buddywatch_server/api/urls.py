@@ -2,7 +2,9 @@ from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .views import CreateUserView, CustomTokenObtainPairView, ListVideoView, UploadVideoView, DeleteVideoView, \
-    DownloadVideoView, PredictView
+    DownloadVideoView, PredictView, BatchPredictView, InferenceStatsView, DirectUploadView, CompleteDirectUploadView, \
+    VideoDownloadUrlView, LocalStorageView, ChunkedUploadView, ChunkedUploadChunkView, CompleteChunkedUploadView, \
+    DatabaseStatsView, VideoTimelineView, MetricsView, BulkDeleteVideoView
 
 urlpatterns = [
     path('user/register/', CreateUserView.as_view(), name='register'),
@@ -10,7 +12,21 @@ urlpatterns = [
     path('token/refresh/', TokenRefreshView.as_view(), name='refresh_token'),
     path('videos/', ListVideoView.as_view(), name='videos'),
     path('videos/upload/', UploadVideoView.as_view(), name='upload-video'),
+    path('videos/delete/', BulkDeleteVideoView.as_view(), name='bulk-delete-videos'),
     path('videos/delete/<int:pk>/', DeleteVideoView.as_view(), name='delete-video'),
     path('videos/download/<int:pk>/', DownloadVideoView.as_view(), name='download-video'),
-    path('predict/', PredictView.as_view(), name='predict')
+    path('videos/upload/direct/', DirectUploadView.as_view(), name='direct-upload'),
+    path('videos/upload/direct/complete/', CompleteDirectUploadView.as_view(), name='complete-direct-upload'),
+    path('videos/upload/chunked/', ChunkedUploadView.as_view(), name='chunked-upload'),
+    path('videos/upload/chunked/<uuid:pk>/', ChunkedUploadChunkView.as_view(), name='chunked-upload-chunk'),
+    path('videos/upload/chunked/<uuid:pk>/complete/', CompleteChunkedUploadView.as_view(),
+         name='complete-chunked-upload'),
+    path('videos/download/<int:pk>/url/', VideoDownloadUrlView.as_view(), name='download-video-url'),
+    path('videos/timeline/<int:pk>/', VideoTimelineView.as_view(), name='video-timeline'),
+    path('storage/<str:token>/', LocalStorageView.as_view(), name='local-storage'),
+    path('predict/', PredictView.as_view(), name='predict'),
+    path('predict/batch/', BatchPredictView.as_view(), name='predict-batch'),
+    path('predict/stats/', InferenceStatsView.as_view(), name='predict-stats'),
+    path('db/stats/', DatabaseStatsView.as_view(), name='db-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics')
 ]
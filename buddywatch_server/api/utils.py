@@ -1,39 +1,179 @@
+from contextlib import contextmanager
+from django.conf import settings
 from django.core.files.base import ContentFile
+import tempfile
+import logging
+import struct
+import re
 import uuid
 import cv2
+import io
 import os
 
+logger = logging.getLogger(__name__)
 
-def generate_and_save_thumbnail(video, instance):
+# Every frame in a packed frame buffer is prefixed with its length as unsigned 32-bit big-endian integer
+FRAME_HEADER = struct.Struct('>I')
+
+# Single byte range of HTTP Range header, for example bytes=0-1023, bytes=1024- or bytes=-512
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# File extension and OpenCV quality parameter of the supported thumbnail formats
+THUMBNAIL_FORMATS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def get_local_path(file):
+    """
+    Get the path of the file on the local disk, or None if the file isn't on the local disk.
+    """
+    if hasattr(file, 'temporary_file_path'):
+        return file.temporary_file_path()
+    try:
+        # Files in local storage have a path, files in remote storage raise NotImplementedError
+        return file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        return None
+
+
+@contextmanager
+def local_video_path(video):
     """
-    Capture the first frame from video with OpenCV and save the frame as
-    thumbnail to Video instance
+    Yield path to the video file that OpenCV can read. Large uploads are already
+    written to a temporary file by Django and files in local storage are read from
+    there directly. Other files, like in-memory uploads and files in Azure, are copied
+    to a unique temporary file, so concurrent uploads don't overwrite each other.
     """
-    # Save the video to a temporary file that OpenCV can read
-    temp_video_path = "temp_video.mp4"
-    with open(temp_video_path, "wb") as temp_video_file:
-        for chunk in video.chunks():
-            temp_video_file.write(chunk)
+    local_path = get_local_path(video)
+    if local_path is not None:
+        yield local_path
+        return
 
+    suffix = os.path.splitext(video.name or '')[1]
+    temp_video_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with temp_video_file:
+            for chunk in video.chunks():
+                temp_video_file.write(chunk)
+        yield temp_video_file.name
+    finally:
+        try:
+            os.remove(temp_video_file.name)
+        except OSError as e:
+            logger.warning("Error while deleting temporary video file: %s", e)
+
+
+def create_thumbnail(video_path):
+    """
+    Read the first frame of the video with OpenCV and encode it as a thumbnail
+    that fits into THUMBNAIL_MAX_SIZE. Returns the encoded image as bytes,
+    or None if the frame couldn't be read.
+    """
     # Start capturing the video
-    cap = cv2.VideoCapture(temp_video_path)
-    # Read first frame of the video
-    ret, frame = cap.read()
-
-    if ret:
-        # Convert the frame to PNG format in memory
-        is_success, buffer = cv2.imencode(".png", frame)
-        if is_success:
-            # Convert to bytes and then to a Django ContentFile
-            thumbnail = ContentFile(buffer.tobytes())
-            # Generate a unique ID for the thumbnail
-            unique_id = uuid.uuid4()
-            # Save thumbnail to the model's thumbnail field
-            instance.thumbnail.save(f'{unique_id}_thumbnail.png', thumbnail, save=True)
-
-    cap.release()
+    cap = cv2.VideoCapture(video_path)
+    try:
+        # Read only the first frame of the video
+        ret, frame = cap.read()
+    finally:
+        cap.release()
+    if not ret:
+        return None
+
+    # Scale the frame down to the thumbnail size, keeping the aspect ratio
+    height, width = frame.shape[:2]
+    scale = min(settings.THUMBNAIL_MAX_SIZE / width, settings.THUMBNAIL_MAX_SIZE / height)
+    if scale < 1:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    extension, params = THUMBNAIL_FORMATS[settings.THUMBNAIL_FORMAT]
+    is_success, buffer = cv2.imencode(extension, frame, [params, settings.THUMBNAIL_QUALITY])
+    return buffer.tobytes() if is_success else None
+
 
+def read_video_metadata(video_path):
+    """
+    Read frame rate, frame count and dimensions of the video with OpenCV.
+    Duration is None if the container doesn't tell the frame count, which is
+    common for WebM files recorded in the browser.
+    """
+    cap = cv2.VideoCapture(video_path)
     try:
-        os.remove(temp_video_path)
-    except Exception as e:
-        print(f"Error while deleting temporary video file: {e}")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    return {
+        "fps": fps if fps > 0 else None,
+        "duration": frame_count / fps if fps > 0 and frame_count > 0 else None,
+        "width": width or None,
+        "height": height or None,
+    }
+
+
+def save_thumbnail(thumbnail, instance, save=True):
+    """
+    Save encoded thumbnail to the thumbnail field of Video instance with unique filename.
+    """
+    extension = THUMBNAIL_FORMATS[settings.THUMBNAIL_FORMAT][0]
+    # Generate a unique ID for the thumbnail
+    unique_id = uuid.uuid4()
+    # Save thumbnail to the model's thumbnail field
+    instance.thumbnail.save(f'{unique_id}_thumbnail{extension}', ContentFile(thumbnail), save=save)
+
+
+def unpack_frame_buffer(data):
+    """
+    Split packed frame buffer into separate image files. Every frame in the buffer
+    is prefixed with its length as unsigned 32-bit big-endian integer.
+    Raises ValueError if the buffer is truncated.
+    """
+    view = memoryview(data)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if offset + FRAME_HEADER.size > len(view):
+            raise ValueError('Frame buffer ends in the middle of a frame header')
+        (length,) = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        if length == 0 or offset + length > len(view):
+            raise ValueError('Frame buffer has a frame with invalid length')
+        frames.append(io.BytesIO(view[offset:offset + length]))
+        offset += length
+    return frames
+
+
+def parse_range_header(header, size):
+    """
+    Parse HTTP Range header of a file with the given size. Only single ranges are
+    supported, multiple ranges are ignored and the whole file is returned.
+
+    Returns:
+        tuple: First and last byte of the range, or None if the whole file should be returned.
+    Raises:
+        ValueError: If the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range is the last N bytes of the file
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        if size == 0:
+            raise ValueError('Suffix range of an empty file')
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError('Range is outside of the file')
+    return first, last
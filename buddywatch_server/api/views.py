@@ -2,17 +2,52 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import generics
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core import signing
+from django.core.files import File
 from django.core.files.storage import default_storage
-from PIL import Image
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, quote_etag
+from datetime import datetime, time
+import mimetypes
+import logging
+import hashlib
+import base64
+
 import numpy as np
 
-from .models import Video
-from .serializers import UserSerializer, CustomTokenObtainPairSerializer, VideoSerializer
-from .utils import generate_and_save_thumbnail
+from .authentication import StatelessJWTAuthentication, CachedJWTAuthentication, MetricsTokenAuthentication, \
+    IsMetricsScraper
+from .db.pool import pool_stats
+from .deletion import delete_videos
+from .caching import get_video_list_version, video_list_cache_key
+from .analysis import unpack_detections, detection_segments
+from .models import Video, UploadSession, VideoTimeline
+from .motion import MotionGate, gating_stats
+from .serializers import UserSerializer, CustomTokenObtainPairSerializer, VideoSerializer, DirectUploadSerializer, \
+    CompleteDirectUploadSerializer, ChunkedUploadSerializer, VideoAnalysisSerializer, BulkDeleteSerializer
+from .pagination import VideoKeysetPagination
+from .parsers import FrameBufferParser
+from .jobs import enqueue_job, request_analysis
+from .storage import FILE_NOT_FOUND_ERRORS, iter_file_range, generate_video_name, create_upload_url, \
+    create_download_url, create_direct_upload_token, verify_direct_upload_token, verify_local_token, stage_chunk, \
+    commit_chunks, discard_chunks, url_cache_timeout
+from .inference import predict_image
+from .metrics import render_metrics, stage, timed_chunks
+from .preprocessing import InvalidImageError, preprocess_batch, batch_buffer
+from .utils import parse_range_header, unpack_frame_buffer
+
+logger = logging.getLogger(__name__)
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -41,27 +76,85 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
+def parse_query_datetime(param, value):
+    """
+    Parse ISO 8601 date or datetime from a query parameter. Dates mean midnight of the day
+    and datetimes without timezone are in the server's timezone.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValidationError({param: 'Expected ISO 8601 date or datetime'})
+        parsed = datetime.combine(parsed_date, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
 class ListVideoView(generics.ListAPIView):
     """
-    Lists all videos uploaded by the user.
+    Lists videos uploaded by the user from newest to oldest. The list is paginated with
+    keyset pagination when the request has 'cursor' or 'page_size' query parameter.
+    Videos can be filtered with 'created_after' and 'created_before' (ISO 8601 date or
+    datetime) and 'title_prefix' query parameters.
+
+    The list has an ETag that changes whenever the user's videos change, so polling clients
+    get 304 Not Modified with If-None-Match until there is something new. The serialized
+    list is cached until the next change, at most VIDEO_LIST_CACHE_TTL seconds.
 
     Returns:
-        Video: List of videos uploaded by the user.
+        Video: List of videos uploaded by the user, or a page of them with the URL of the next page.
+        HttpResponse: Not modified if the client already has the current list.
     """
     serializer_class = VideoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VideoKeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        version = get_video_list_version(request.user.pk)
+        # Pages and filters of the list are cached separately
+        variant = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        etag = quote_etag(f'{version}-{variant}')
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            cache_key = video_list_cache_key(request.user.pk, version, variant)
+            data = cache.get(cache_key) if settings.VIDEO_LIST_CACHE_TTL else None
+            if data is None:
+                data = super().list(request, *args, **kwargs).data
+                # Cached list must not outlive the signed URLs in it
+                timeout = min(settings.VIDEO_LIST_CACHE_TTL, url_cache_timeout(default_storage))
+                if timeout > 0:
+                    cache.set(cache_key, data, timeout)
+            response = Response(data)
+
+        response['ETag'] = etag
+        # Clients must revalidate the list every time, and shared caches must not store it
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ['Authorization'])
+        return response
 
     def get_queryset(self):
         user = self.request.user
         # Show user only their own videos
-        return Video.objects.filter(owner=user)
+        queryset = Video.objects.filter(owner=user).order_by(*VideoKeysetPagination.ordering)
+
+        params = self.request.query_params
+        for param, lookup in [('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')]:
+            if params.get(param):
+                queryset = queryset.filter(**{lookup: parse_query_datetime(param, params[param])})
+        if params.get('title_prefix'):
+            queryset = queryset.filter(title__startswith=params['title_prefix'])
+        return queryset
 
 
 class UploadVideoView(generics.CreateAPIView):
     """
     Uploads a video file to the server.
     Request must be multipart/form-data with the video file in the 'file' field
-    and video title in the 'title' field.
+    and video title in the 'title' field. Thumbnail and metadata are created by
+    a background job, the processing_status of the video tells when they are ready.
 
     Returns:
         JsonResponse: Success message and video data if successful, error message if not.
@@ -70,6 +163,12 @@ class UploadVideoView(generics.CreateAPIView):
     serializer_class = VideoSerializer
     permission_classes = [IsAuthenticated]
 
+    def create(self, request, *args, **kwargs):
+        # Multipart body is parsed on the first access to the data, before the serializer is created
+        with stage('parse'):
+            request.data
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         video_file = self.request.FILES.get('file')
         if not video_file:
@@ -77,13 +176,15 @@ class UploadVideoView(generics.CreateAPIView):
                                 status=status.HTTP_400_BAD_REQUEST)
         elif serializer.is_valid():
             # Validate and save the video to Azure
-            video = serializer.save(owner=self.request.user)
+            with stage('storage_write'):
+                video = serializer.save(owner=self.request.user)
 
-            # Generate and save the thumbnail to Azure
-            generate_and_save_thumbnail(video_file, video)
+            # Generate the thumbnail and read metadata in background job,
+            # or right away with the uploaded file if background jobs are disabled
+            enqueue_job(video, source=video_file)
             return JsonResponse({"success": True, "video": serializer.data}, status=status.HTTP_201_CREATED)
         else:
-            print(serializer.errors)
+            logger.info("Rejected video upload: %s", serializer.errors)
             return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -103,12 +204,59 @@ class DeleteVideoView(generics.DestroyAPIView):
         return Video.objects.filter(owner=user)
 
 
+class BulkDeleteVideoView(generics.GenericAPIView):
+    """
+    Delete many of the user's videos at once, either the videos in the 'ids' list or the videos
+    created in the range given by 'created_after' and/or 'created_before' (ISO 8601 date or datetime).
+    The videos are deleted from the database with one delete, and their files from the storage
+    concurrently afterwards.
+
+    Returns:
+        JsonResponse: IDs of the deleted videos with the result of deleting each of their files,
+        and the requested IDs that weren't found, if successful, error message if not.
+    """
+    serializer_class = BulkDeleteSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        videos = Video.objects.filter(owner=request.user)
+        ids = serializer.validated_data.get('ids')
+        try:
+            if ids is not None:
+                videos = videos.filter(pk__in=ids)
+            if 'created_after' in serializer.validated_data:
+                videos = videos.filter(created_at__gte=parse_query_datetime(
+                    'created_after', serializer.validated_data['created_after']))
+            if 'created_before' in serializer.validated_data:
+                videos = videos.filter(created_at__lt=parse_query_datetime(
+                    'created_before', serializer.validated_data['created_before']))
+        except ValidationError as e:
+            return JsonResponse({"success": False, "error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = delete_videos(videos)
+        deleted = {result['id'] for result in results}
+        return JsonResponse({
+            "success": True,
+            "deleted": len(results),
+            "results": results,
+            # Videos of other users are reported the same as videos that don't exist
+            "not_found": [pk for pk in dict.fromkeys(ids) if pk not in deleted] if ids is not None else [],
+        }, status=status.HTTP_200_OK)
+
+
 class DownloadVideoView(generics.RetrieveAPIView):
     """
-    Download video file from the server by id.
+    Download video file from the server by id. The file is streamed in chunks and
+    supports Range requests, so clients can seek in the video and resume downloads.
+    ETag and Last-Modified headers let clients skip downloading unchanged files.
 
     Returns:
-        HttpResponse: Video file as a response if successful
+        StreamingHttpResponse: Video file or requested part of it as a response if successful
+        HttpResponse: Not modified if the client already has the file
         JsonResponse: Error message if not.
     """
     serializer_class = VideoSerializer
@@ -121,58 +269,598 @@ class DownloadVideoView(generics.RetrieveAPIView):
 
     def get(self, request, *args, **kwargs):
         video = self.get_object()
+        name = video.file.name
+
+        # Stored files are never overwritten, so the name identifies the content
+        etag = quote_etag(hashlib.md5(name.encode()).hexdigest())
+        last_modified = int(video.created_at.timestamp())
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(last_modified),
+            'Accept-Ranges': 'bytes',
+            # Let clients read filename and range headers
+            'Access-Control-Expose-Headers': 'Content-Disposition, Content-Range, Accept-Ranges, ETag',
+        }
+
+        # Answer If-None-Match and If-Modified-Since without touching the storage
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            for header, value in headers.items():
+                not_modified[header] = value
+            return not_modified
+
+        try:
+            size = default_storage.size(name)
+        except FILE_NOT_FOUND_ERRORS:
+            return JsonResponse({"success": False, "error": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # If file exists, open the Azure Blob Storage file and return it as a response
-        if default_storage.exists(video.file.name):
-            file = default_storage.open(video.file.name, 'rb')
-            response = HttpResponse(file, content_type='video/webm', status=status.HTTP_200_OK)
-            # Add filename to the response headers
-            response['Content-Disposition'] = f"attachment; filename=\"{video.file.name.split('/')[-1]}\""
-            # Let clients read filename from header
-            response['Access-Control-Expose-Headers'] = 'Content-Disposition'
-
+        # Range is ignored if If-Range doesn't match the current version of the file
+        if_range = request.headers.get('If-Range')
+        range_header = request.headers.get('Range') if not if_range or if_range == etag else None
+        try:
+            byte_range = parse_range_header(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
             return response
-        else:
+
+        first, last = byte_range if byte_range else (0, size - 1)
+        content_type = mimetypes.guess_type(name)[0] or 'video/webm'
+        # Stream the file in chunks so the whole video is never held in memory
+        response = StreamingHttpResponse(
+            timed_chunks(iter_file_range(default_storage, name, first, last - first + 1), 'storage_read'),
+            content_type=content_type,
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK
+        )
+        response['Content-Length'] = last - first + 1
+        if byte_range:
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        # Add filename to the response headers
+        response['Content-Disposition'] = f"attachment; filename=\"{name.split('/')[-1]}\""
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+class DirectStorageMixin:
+    """
+    Reject requests when direct storage access is disabled.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.DIRECT_STORAGE_ENABLED:
+            raise NotFound('Direct storage access is disabled')
+
+
+class DirectUploadView(DirectStorageMixin, generics.GenericAPIView):
+    """
+    Start uploading a video directly to the storage without sending it through the server.
+    Request must have the name of the video file in the 'filename' field.
+    The client then uploads the file to the returned URL and completes the upload
+    with CompleteDirectUploadView.
+
+    Returns:
+        JsonResponse: Short-lived upload URL and upload token if successful, error message if not.
+    """
+    serializer_class = DirectUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        name = generate_video_name(serializer.validated_data['filename'])
+        return JsonResponse({
+            "success": True,
+            "upload": create_upload_url(default_storage, request, name),
+            "upload_token": create_direct_upload_token(request.user, name)
+        }, status=status.HTTP_200_OK)
+
+
+class CompleteDirectUploadView(DirectStorageMixin, generics.GenericAPIView):
+    """
+    Create video from a file the client has uploaded directly to the storage.
+    Request must have the upload token got from DirectUploadView in the 'upload_token'
+    field and video title in the 'title' field. Thumbnail and metadata are created by a background job.
+
+    Returns:
+        JsonResponse: Video data if successful, error message if not.
+    """
+    serializer_class = CompleteDirectUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            name = verify_direct_upload_token(serializer.validated_data['upload_token'], request.user)
+        except signing.BadSignature:
+            return JsonResponse({"success": False, "error": "Invalid or expired upload token"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if Video.objects.filter(file=name).exists():
+            return JsonResponse({"success": False, "error": "Upload has already been completed"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            size = default_storage.size(name)
+        except FILE_NOT_FOUND_ERRORS:
+            return JsonResponse({"success": False, "error": "Uploaded file not found"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Concurrent completes of the same upload are stopped by the unique file constraint
+            with transaction.atomic():
+                video = Video.objects.create(title=serializer.validated_data['title'], file=name, size=size,
+                                             owner=request.user)
+        except IntegrityError:
+            return JsonResponse({"success": False, "error": "Upload has already been completed"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        # Generate the thumbnail and read metadata in background job
+        enqueue_job(video)
+        return JsonResponse(VideoSerializer(video, context=self.get_serializer_context()).data,
+                            status=status.HTTP_201_CREATED)
+
+
+class VideoDownloadUrlView(DirectStorageMixin, generics.RetrieveAPIView):
+    """
+    Get short-lived URL for downloading video directly from the storage by id.
+
+    Returns:
+        JsonResponse: Download URL and its expiry time if successful, error message if not.
+    """
+    serializer_class = VideoSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        # Let user download only their only videos
+        return Video.objects.filter(owner=user)
+
+    def get(self, request, *args, **kwargs):
+        video = self.get_object()
+        download = create_download_url(default_storage, request, video.file.name)
+        return JsonResponse({"success": True, "download": download}, status=status.HTTP_200_OK)
+
+
+class LocalStorageView(DirectStorageMixin, generics.GenericAPIView):
+    """
+    Stand-in for Azure signed URLs when files are stored on the local file system,
+    for example in development and tests. Files can be uploaded with PUT and downloaded
+    with GET using the signed URLs created by DirectUploadView and VideoDownloadUrlView.
+    The signature in the URL is the only authentication.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token, *args, **kwargs):
+        try:
+            name = verify_local_token(token, 'download')
+            return FileResponse(default_storage.open(name, 'rb'), as_attachment=True,
+                                filename=name.split('/')[-1])
+        except signing.BadSignature:
+            return JsonResponse({"success": False, "error": "Invalid or expired URL"}, status=status.HTTP_403_FORBIDDEN)
+        except FILE_NOT_FOUND_ERRORS:
             return JsonResponse({"success": False, "error": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
+    def put(self, request, token, *args, **kwargs):
+        try:
+            name = verify_local_token(token, 'upload')
+        except signing.BadSignature:
+            return JsonResponse({"success": False, "error": "Invalid or expired URL"}, status=status.HTTP_403_FORBIDDEN)
+        if default_storage.exists(name):
+            return JsonResponse({"success": False, "error": "File has already been uploaded"},
+                                status=status.HTTP_409_CONFLICT)
+
+        if request.stream is None:
+            return JsonResponse({"success": False, "error": "Request must have a file"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        # Write the request body to the storage in chunks without parsing it
+        saved_name = default_storage.save(name, File(request.stream, name=name))
+        if saved_name != name:
+            # Another upload with the same URL created the file first, the storage saved this one under a new name
+            default_storage.delete(saved_name)
+            return JsonResponse({"success": False, "error": "File has already been uploaded"},
+                                status=status.HTTP_409_CONFLICT)
+        return HttpResponse(status=status.HTTP_201_CREATED)
+
+
+def upload_session_response(session, status_code=status.HTTP_200_OK, **extra):
+    """
+    Describe the state of the chunked upload, the offset is also sent in the Upload-Offset header.
+    """
+    response = JsonResponse({
+        "success": status_code < 400,
+        "upload_id": str(session.id),
+        "offset": session.offset,
+        "size": session.size,
+        "status": session.status,
+        **extra
+    }, status=status_code)
+    response['Upload-Offset'] = session.offset
+    response['Access-Control-Expose-Headers'] = 'Upload-Offset'
+    return response
+
+
+class ChunkedUploadView(generics.GenericAPIView):
+    """
+    Start a resumable upload of a video sent in chunks. Request must have video title in
+    the 'title' field, name of the video file in the 'filename' field and size of the file
+    in bytes in the 'size' field. The chunks are then sent to ChunkedUploadChunkView, and
+    the upload is finished with CompleteChunkedUploadView.
+
+    Returns:
+        JsonResponse: ID of the upload, current offset and largest allowed chunk size if successful,
+        error message if not.
+    """
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        session = UploadSession.objects.create(
+            owner=request.user,
+            title=serializer.validated_data['title'],
+            name=generate_video_name(serializer.validated_data['filename']),
+            size=serializer.validated_data['size']
+        )
+        return upload_session_response(session, status.HTTP_201_CREATED,
+                                       chunk_size=settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE)
+
+
+class ChunkedUploadChunkView(generics.GenericAPIView):
+    """
+    Send chunks of a resumable upload. Each chunk is sent with PUT as the raw request body,
+    and the Upload-Offset header must match the current offset of the upload, so chunks
+    are never written twice or out of order. Optional Upload-Checksum header in format
+    'sha256 <base64 digest>' is used to verify the chunk. After a dropped connection,
+    the client asks the current offset with GET and continues from there.
+    DELETE aborts the upload.
+
+    Returns:
+        JsonResponse: Current offset of the upload if successful, error message if not.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        # Let user continue only their own uploads
+        return UploadSession.objects.filter(owner=user, status=UploadSession.STATUS_ACTIVE)
+
+    def get(self, request, *args, **kwargs):
+        return upload_session_response(self.get_object())
+
+    def put(self, request, *args, **kwargs):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return JsonResponse({"success": False, "error": "Upload-Offset header is required"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        # Read one byte more than allowed to tell if the chunk is too large
+        max_chunk_size = settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE
+        chunk = request.stream.read(max_chunk_size + 1) if request.stream is not None else b''
+        if not chunk:
+            return JsonResponse({"success": False, "error": "Request must have a chunk"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if len(chunk) > max_chunk_size:
+            return JsonResponse({"success": False, "error": f"Chunk can be at most {max_chunk_size} bytes"},
+                                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        checksum = request.headers.get('Upload-Checksum')
+        if checksum:
+            algorithm, _, digest = checksum.partition(' ')
+            if algorithm != 'sha256' or base64.b64encode(hashlib.sha256(chunk).digest()).decode() != digest:
+                return JsonResponse({"success": False, "error": "Checksum of the chunk doesn't match"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+        # Lock the upload so concurrent requests can't write to the same offset
+        with transaction.atomic():
+            session = self.get_queryset().select_for_update().filter(pk=self.kwargs['pk']).first()
+            if session is None:
+                raise NotFound()
+            if offset != session.offset:
+                return upload_session_response(session, status.HTTP_409_CONFLICT,
+                                               error="Upload-Offset doesn't match the current offset")
+            if offset + len(chunk) > session.size:
+                return upload_session_response(session, status.HTTP_400_BAD_REQUEST,
+                                               error="Chunk goes past the size of the upload")
+
+            block_id = stage_chunk(default_storage, session.name, len(session.block_ids), offset, chunk)
+            session.block_ids.append(block_id)
+            session.offset += len(chunk)
+            session.save(update_fields=['block_ids', 'offset', 'updated_at'])
+        return upload_session_response(session)
+
+    def delete(self, request, *args, **kwargs):
+        session = self.get_object()
+        discard_chunks(default_storage, session.name)
+        session.delete()
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+class CompleteChunkedUploadView(generics.GenericAPIView):
+    """
+    Finish a resumable upload after all chunks have been sent. The chunks are assembled
+    into the video file and the video is created. Thumbnail and metadata are created by a background job.
+
+    Returns:
+        JsonResponse: Video data if successful, error message if not.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        user = self.request.user
+        return UploadSession.objects.filter(owner=user, status=UploadSession.STATUS_ACTIVE)
+
+    def post(self, request, *args, **kwargs):
+        with transaction.atomic():
+            session = self.get_queryset().select_for_update().filter(pk=self.kwargs['pk']).first()
+            if session is None:
+                raise NotFound()
+            if session.offset != session.size:
+                return upload_session_response(session, status.HTTP_409_CONFLICT,
+                                               error="All chunks haven't been uploaded yet")
+
+            commit_chunks(default_storage, session.name, session.block_ids)
+            video = Video.objects.create(title=session.title, file=session.name, size=session.size,
+                                         owner=session.owner)
+            session.status = UploadSession.STATUS_COMPLETED
+            session.save(update_fields=['status', 'updated_at'])
+
+        # Generate the thumbnail and read metadata in background job
+        enqueue_job(video)
+        return JsonResponse(VideoSerializer(video, context=self.get_serializer_context()).data,
+                            status=status.HTTP_201_CREATED)
+
+
+def parse_query_float(request, param, default=None):
+    value = request.query_params.get(param)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValidationError({param: 'Expected a number'})
+
+
+class VideoTimelineView(generics.GenericAPIView):
+    """
+    Face detection timeline of a video. POST queues the analysis of the video, optionally with
+    'sample_rate' frames per second. GET returns the status of the analysis and the segments of
+    time when a face was detected with at least 'min_confidence' query parameter. With 'detections'
+    query parameter set to 'true', the detections of every sampled frame between 'start' and 'end'
+    seconds are returned as well.
+
+    Returns:
+        JsonResponse: Status and segments of the timeline if successful, error message if not.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = VideoAnalysisSerializer
+
+    def get_queryset(self):
+        # Let user analyze only their own videos
+        return Video.objects.filter(owner=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        video = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"success": False, "error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        running = VideoTimeline.objects.filter(
+            video=video, status__in=[VideoTimeline.STATUS_PENDING, VideoTimeline.STATUS_RUNNING]).exists()
+        if running:
+            return JsonResponse({"success": False, "error": "Video is already being analyzed"},
+                                status=status.HTTP_409_CONFLICT)
+
+        timeline = request_analysis(video, serializer.validated_data.get('sample_rate'))
+        return JsonResponse({"success": True, "status": timeline.status, "sample_rate": timeline.sample_rate},
+                            status=status.HTTP_202_ACCEPTED)
+
+    def get(self, request, *args, **kwargs):
+        video = self.get_object()
+        try:
+            timeline = video.timeline
+        except VideoTimeline.DoesNotExist:
+            return JsonResponse({"success": False, "error": "Video has not been analyzed"},
+                                status=status.HTTP_404_NOT_FOUND)
+
+        min_confidence = parse_query_float(request, 'min_confidence', settings.VIDEO_ANALYSIS_MIN_CONFIDENCE)
+        detections = unpack_detections(timeline.detections)
+        data = {
+            "success": True,
+            "status": timeline.status,
+            "sample_rate": timeline.sample_rate,
+            "samples": timeline.samples,
+            "updated_at": timeline.updated_at.isoformat(),
+            "segments": detection_segments(detections, min_confidence, timeline.sample_rate),
+        }
+        if timeline.status == VideoTimeline.STATUS_FAILED:
+            # Show only the exception of the traceback
+            lines = timeline.error.strip().splitlines()
+            data["error"] = lines[-1] if lines else ''
+
+        if request.query_params.get('detections') == 'true':
+            start = parse_query_float(request, 'start', 0.0)
+            end = parse_query_float(request, 'end', float('inf'))
+            selected = detections[(detections['time'] >= start) & (detections['time'] <= end)]
+            data["detections"] = {
+                "time": np.round(selected['time'].astype(np.float64), 3).tolist(),
+                "confidence": np.round(selected['confidence'].astype(np.float64), 3).tolist(),
+                "bbox": np.round(selected['bbox'].astype(np.float64), 3).tolist(),
+            }
+        return JsonResponse(data, status=status.HTTP_200_OK)
+
 
 class PredictView(generics.CreateAPIView):
     """
     Predict the bounding box coordinates and confidence score of human face in an image.
     Request must be multipart/form-data with the image file in the 'image' field.
+    Cameras can send an ID of their stream in the 'session' field to skip inference of frames
+    without motion, and tune the sensitivity with 'motion_threshold' between 0 and 1.
 
     Returns:
         JsonResponse: Bounding box coordinates and confidence score if successful, error message if not.
     """
+    # Authenticate from the token claims without querying the user
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
+    def get_motion_gate(self, request):
+        session = request.data.get('session')
+        if not session or not settings.MOTION_GATING_ENABLED:
+            return None
+        threshold = request.data.get('motion_threshold')
+        if threshold is not None:
+            try:
+                threshold = float(threshold)
+            except ValueError:
+                threshold = -1
+            if not 0 <= threshold <= 1:
+                raise ValidationError({"motion_threshold": "Must be a number between 0 and 1"})
+        return MotionGate(request.user.id, session, threshold)
+
     def post(self, request, *args, **kwargs):
-        if request.FILES.get('image'):
-            # Get the model from the app registry
-            model = apps.get_app_config('api').model
+        # Multipart body is parsed on the first access to the files
+        with stage('parse'):
+            has_image = bool(request.FILES.get('image'))
+        if has_image:
+            # Get the batching predictor and the prediction cache from the app registry
+            api_config = apps.get_app_config('api')
             image_file = request.FILES['image']
-            # Open the image file and convert to RGB format
-            image = Image.open(image_file)
-            image = image.convert('RGB')
+            try:
+                gate = self.get_motion_gate(request)
+                # Convert the image into normalized 120x120 RGB array and wait until it has been
+                # predicted together with other concurrent requests, unless the cache has the prediction
+                # or the session's camera hasn't seen motion since its last prediction
+                prediction_result, source = predict_image(api_config.predictor, image_file,
+                                                          api_config.prediction_cache, gate)
+            except ValidationError as e:
+                return JsonResponse({"success": False, "error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+            except InvalidImageError as e:
+                return JsonResponse({"success": False, "error": f"Invalid image: {e}"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+            logger.debug("Prediction: %s", prediction_result)
+            with stage('serialize'):
+                return JsonResponse({"success": True, "prediction": prediction_result, "cached": source == 'cache',
+                                     "skipped": source == 'motion'}, status=status.HTTP_200_OK)
 
-            # Resize the image to 120x120 for faster processing
-            image = image.resize((120, 120))
+        return JsonResponse({"success": False, "error": "Request must have an image"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-            # Convert the image to a numpy array and normalize
-            image_array = np.asarray(image) / 255.0
 
-            # Expand dimensions to match the model's input shape
-            image_array = np.expand_dims(image_array, axis=0)
+class BatchPredictView(generics.CreateAPIView):
+    """
+    Predict the bounding box coordinates and confidence scores of human faces in multiple images
+    with a single forward pass. Request must be either multipart/form-data with the image files
+    in the 'images' field, or application/octet-stream containing a packed frame buffer where
+    each frame is prefixed with its length as unsigned 32-bit big-endian integer.
 
-            y_pred = model.predict(image_array)
+    Returns:
+        JsonResponse: List of bounding box coordinates and confidence scores in the same order
+        as the images if successful, error message if not.
+    """
+    parser_classes = [MultiPartParser, FormParser, FrameBufferParser]
+    # Authenticate from the token claims without querying the user
+    authentication_classes = [StatelessJWTAuthentication]
+    permission_classes = [IsAuthenticated]
 
-            # Get bounding boxes and accuracy from the prediction and convert into serializable format
-            prediction_result = {
-                "bbox": y_pred[1][0].tolist(),
-                "confidence": float(y_pred[0][0][0])
-            }
-            print(prediction_result)
-            return JsonResponse({"success": True, "prediction": prediction_result}, status=status.HTTP_200_OK)
+    def post(self, request, *args, **kwargs):
+        with stage('parse'):
+            data = request.data
+        if isinstance(data, bytes):
+            try:
+                image_files = unpack_frame_buffer(data)
+            except ValueError as e:
+                return JsonResponse({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            image_files = request.FILES.getlist('images')
 
-        return JsonResponse({"success": False, "error": "Request must have an image"},
-                            status=status.HTTP_400_BAD_REQUEST)
+        if not image_files:
+            return JsonResponse({"success": False, "error": "Request must have at least one image"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        if len(image_files) > settings.PREDICT_BATCH_MAX_IMAGES:
+            return JsonResponse({"success": False,
+                                 "error": f"Request can have at most {settings.PREDICT_BATCH_MAX_IMAGES} images"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Decode and resize all the images into the reusable batch buffer of this thread
+            image_batch = preprocess_batch(image_files, batch_buffer(len(image_files)))
+        except (OSError, ValueError) as e:
+            return JsonResponse({"success": False, "error": f"Invalid image: {e}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        # Predict the whole batch with one forward pass
+        predictor = apps.get_app_config('api').predictor
+        with stage('inference'):
+            predictions = predictor.predict_batch(image_batch)
+        with stage('serialize'):
+            return JsonResponse({"success": True, "predictions": predictions}, status=status.HTTP_200_OK)
+
+
+class InferenceStatsView(generics.GenericAPIView):
+    """
+    Show batch size and queue wait statistics of the batching predictor, hit ratio of the
+    prediction cache, frames skipped by motion gating and the load times of the model. Only admin users can see the statistics.
+
+    Returns:
+        JsonResponse: Statistics of the batching predictor.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        api_config = apps.get_app_config('api')
+        predictor = api_config.predictor
+        cache = api_config.prediction_cache
+        return JsonResponse({
+            "success": True,
+            "max_batch_size": predictor.max_batch_size,
+            "max_wait_ms": predictor.max_wait * 1000,
+            "stats": predictor.stats.snapshot(),
+            "prediction_cache": cache.snapshot() if cache is not None else None,
+            "motion_gating": gating_stats.snapshot(),
+            "model": api_config.registry.report()
+        }, status=status.HTTP_200_OK)
+
+
+class DatabaseStatsView(generics.GenericAPIView):
+    """
+    Show the connection counts and checkout statistics of the database connection pools
+    of the process. Only admin users can see the statistics.
+
+    Returns:
+        JsonResponse: Statistics of each connection pool.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({"success": True, "pools": pool_stats()}, status=status.HTTP_200_OK)
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    Serve request counts, latency histograms, stage timings and the statistics of the predictor,
+    prediction cache, motion gating and connection pools of the process in the Prometheus text format.
+    Readable with the METRICS_TOKEN bearer token or by admin users.
+
+    Returns:
+        HttpResponse: Metrics in the Prometheus text format if metrics are enabled.
+        JsonResponse: Error message if not.
+    """
+    authentication_classes = [MetricsTokenAuthentication, CachedJWTAuthentication]
+    permission_classes = [IsMetricsScraper | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_ENABLED:
+            return JsonResponse({"success": False, "error": "Metrics are not enabled"},
+                                status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,78 @@
+"""
+Compare two benchmark result files written by benchmarks.run or benchmarks.micro and
+report the change of every metric. Exits with status 1 if any metric got worse by more
+than the threshold, so the comparison can fail a CI job:
+
+    python -m benchmarks.compare results/baseline.json results/candidate.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+# Metrics compared from each result, and whether a higher value is better
+LOAD_METRICS = {'throughput_rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False}
+MICRO_METRICS = {'best_us': False, 'peak_alloc_kb': False}
+
+
+def flatten(report):
+    """
+    Collect the compared metrics of a result file.
+
+    Returns:
+        dict: (value, higher_is_better) of each metric, keyed by its readable name.
+    """
+    metrics = {}
+    for scenario, runs in report.get('results', {}).items():
+        for run in runs:
+            for metric, higher_is_better in LOAD_METRICS.items():
+                metrics[f"{scenario} c={run['concurrency']} {metric}"] = (run[metric], higher_is_better)
+    for name, result in report.get('micro', {}).items():
+        for metric, higher_is_better in MICRO_METRICS.items():
+            metrics[f'{name} {metric}'] = (result[metric], higher_is_better)
+    return metrics
+
+
+def compare(baseline, candidate, threshold):
+    """
+    Returns:
+        list: Rows of metric name, baseline value, candidate value, change in percent and
+        whether the change is a regression larger than the threshold percentage.
+    """
+    baseline_metrics = flatten(baseline)
+    rows = []
+    for name, (value, higher_is_better) in flatten(candidate).items():
+        if name not in baseline_metrics:
+            continue
+        base = baseline_metrics[name][0]
+        if not base or value is None:
+            continue
+        change = (value - base) / base * 100
+        worse = -change if higher_is_better else change
+        rows.append((name, base, value, change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10, help='Allowed regression in percent')
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline_file, open(args.candidate) as candidate_file:
+        baseline, candidate = json.load(baseline_file), json.load(candidate_file)
+
+    print(f"Baseline {baseline.get('meta', {}).get('commit')}, candidate {candidate.get('meta', {}).get('commit')}")
+    rows = compare(baseline, candidate, args.threshold)
+    for name, base, value, change, regression in rows:
+        print(f"{name:<40} {base:12.2f} {value:12.2f} {change:+8.1f}%{'  REGRESSION' if regression else ''}")
+
+    regressions = sum(1 for row in rows if row[4])
+    if regressions:
+        print(f'{regressions} metrics regressed more than {args.threshold}%')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
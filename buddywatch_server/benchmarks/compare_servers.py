@@ -0,0 +1,79 @@
+"""
+Compare the development server (manage.py runserver) to the production Gunicorn profile.
+Both servers are started in turn with the same environment, and the predict and video
+list endpoints are loaded with each concurrency level. Run in the directory of manage.py:
+
+    python -m benchmarks.compare_servers --image media/testing/test_image.png --output server_comparison.json
+
+The environment must have the variables the settings need, such as the database and Azure credentials.
+"""
+
+from pathlib import Path
+import argparse
+import json
+
+from .load import run_load, wait_for_server, authenticate
+from .server import SERVERS, start_server, stop_server
+
+
+def scenarios(base_url, token, image):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def predict(session):
+        response = session.post(f'{base_url}/api/predict/', headers=headers,
+                                files={'image': ('image.jpg', image, 'image/jpeg')})
+        return response.status_code == 200
+
+    def list_videos(session):
+        return session.get(f'{base_url}/api/videos/', headers=headers).status_code == 200
+
+    return {'predict': predict, 'list': list_videos}
+
+
+def benchmark_server(name, args):
+    process = start_server(name, args.port, args.production_settings if name == 'gunicorn' else args.settings)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        wait_for_server(base_url + '/api/videos/')
+        token = authenticate(base_url, args.username, args.password)
+        image = Path(args.image).read_bytes()
+
+        results = {}
+        for scenario, send in scenarios(base_url, token, image).items():
+            # Warm up so the model load and first connections don't count
+            run_load(send, args.concurrency[-1], args.concurrency[-1])
+            results[scenario] = [run_load(send, args.requests, concurrency) for concurrency in args.concurrency]
+        return results
+    finally:
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', required=True, help='Image sent to the predict endpoint')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--settings', default='buddywatch_server.settings', help='Settings of the runserver')
+    parser.add_argument('--production-settings', default='buddywatch_server.settings_production')
+    parser.add_argument('--username', default='benchmark')
+    parser.add_argument('--password', default='benchmark-password')
+    parser.add_argument('--output', help='File where the results are written as JSON')
+    args = parser.parse_args()
+
+    results = {name: benchmark_server(name, args) for name in SERVERS}
+
+    print(f"{'server':<10} {'scenario':<8} {'conc':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for name, server_results in results.items():
+        for scenario, runs in server_results.items():
+            for run in runs:
+                print(f"{name:<10} {scenario:<8} {run['concurrency']:>5} {run['throughput_rps']:>8.1f} "
+                      f"{run['p50_ms'] or 0:>8.1f} {run['p95_ms'] or 0:>8.1f} {run['p99_ms'] or 0:>8.1f} "
+                      f"{run['errors']:>6}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Load generator used by the benchmarks. Requests are sent from a pool of threads
+and the latency of each request is recorded.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import math
+
+import requests
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of the values, q between 0 and 100.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(latencies, errors, elapsed, concurrency):
+    """
+    Throughput and latency percentiles of a load run in a serializable format.
+    """
+    latencies_ms = [latency * 1000 for latency in latencies]
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0,
+        "mean_ms": sum(latencies_ms) / len(latencies_ms) if latencies_ms else None,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+    }
+
+
+def run_load(send, requests_count, concurrency):
+    """
+    Call send requests_count times from concurrency threads. Send gets a requests session
+    of the thread and must return True if the request succeeded.
+
+    Returns:
+        dict: Throughput and latency percentiles of the successful requests.
+    """
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def request(_):
+        nonlocal errors
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            ok = send(local.session)
+        except requests.RequestException:
+            ok = False
+        latency = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(request, range(requests_count)))
+    return summarize(latencies, errors, time.perf_counter() - started, concurrency)
+
+
+def wait_for_server(url, timeout=120):
+    """
+    Wait until the server answers any HTTP response.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise TimeoutError(f'Server at {url} did not start in {timeout} seconds')
+
+
+def authenticate(base_url, username, password):
+    """
+    Register the benchmark user if it doesn't exist yet and get an access token for it.
+    """
+    requests.post(f'{base_url}/api/user/register/', data={'username': username, 'password': password})
+    response = requests.post(f'{base_url}/api/token/', data={'username': username, 'password': password})
+    response.raise_for_status()
+    return response.json()['access']
@@ -0,0 +1,106 @@
+"""
+Micro-benchmarks of the image and video helpers on the request path. Each function is timed
+with timeit and its peak memory allocation measured with tracemalloc. Run in the directory of
+manage.py:
+
+    python -m benchmarks.micro --image media/testing/test_image.png --video media/testing/test_video.webm
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import tracemalloc
+import platform
+import argparse
+import timeit
+import json
+import io
+import os
+
+from .run import git_revision
+
+
+def measure(function, number, repeat):
+    """
+    Time the function and measure the peak memory it allocates during a single call.
+
+    Returns:
+        dict: Best and mean time of a call in microseconds and peak allocation in kilobytes.
+    """
+    function()
+    timings = [total / number * 1e6 for total in timeit.repeat(function, number=number, repeat=repeat)]
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": min(timings),
+        "mean_us": sum(timings) / len(timings),
+        "peak_alloc_kb": peak / 1024,
+    }
+
+
+def cases(image, video_path, batch_size):
+    from PIL import Image
+    from api.preprocessing import preprocess_image, preprocess_batch, batch_buffer
+    from api.utils import create_thumbnail, unpack_frame_buffer, FRAME_HEADER
+
+    # Camera sized JPEG, where reduced decoding has the largest effect
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(image)).convert('RGB').resize((1280, 720)).save(buffer, format='JPEG', quality=90)
+    jpeg = buffer.getvalue()
+
+    frame_buffer = b''.join(FRAME_HEADER.pack(len(image)) + image for _ in range(batch_size))
+    return {
+        'preprocess_image': (lambda: preprocess_image(io.BytesIO(image)), 50),
+        'preprocess_batch': (lambda: preprocess_batch([io.BytesIO(image) for _ in range(batch_size)]), 5),
+        'preprocess_jpeg_720p_full': (lambda: preprocess_image(io.BytesIO(jpeg), draft=False), 20),
+        'preprocess_jpeg_720p_draft': (lambda: preprocess_image(io.BytesIO(jpeg), batch_buffer(1)[0], draft=True), 20),
+        'preprocess_batch_buffer': (
+            lambda: preprocess_batch([io.BytesIO(image) for _ in range(batch_size)], batch_buffer(batch_size)), 5),
+        'unpack_frame_buffer': (lambda: unpack_frame_buffer(frame_buffer), 1000),
+        'create_thumbnail': (lambda: create_thumbnail(video_path), 5),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', required=True)
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--settings', default='benchmarks.settings')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', args.settings)
+    import django
+    django.setup()
+
+    image = Path(args.image).read_bytes()
+    results = {}
+    for name, (function, number) in cases(image, args.video, args.batch_size).items():
+        results[name] = measure(function, number, args.repeat)
+        print(f"{name:<20} best {results[name]['best_us']:10.1f} us, mean {results[name]['mean_us']:10.1f} us, "
+              f"peak {results[name]['peak_alloc_kb']:9.1f} KB")
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        commit, dirty = git_revision()
+        meta = {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        }
+        output.write_text(json.dumps({"meta": meta, "micro": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark the API end to end. The server is started with the benchmark settings, which use
+SQLite and local file storage instead of PostgreSQL and Azure and a stub model instead of
+TensorFlow (see benchmarks/settings.py). The database is seeded with videos, and each scenario
+is loaded with each concurrency level. Throughput and p50/p95/p99 latency are written as JSON,
+so results of different commits can be compared with benchmarks.compare. Run in the
+directory of manage.py:
+
+    python -m benchmarks.run --image media/testing/test_image.png --video media/testing/test_video.webm
+"""
+
+from datetime import datetime, timezone
+from pathlib import Path
+import subprocess
+import platform
+import argparse
+import random
+import shutil
+import json
+import sys
+import os
+
+from .load import run_load, wait_for_server, authenticate
+from .server import start_server, stop_server
+
+SCENARIOS = ['predict', 'upload', 'list', 'download']
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                    text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def prepare(settings, video_path, videos, username, password):
+    """
+    Create the database and seed it with the benchmark user and videos for the list and download
+    scenarios. Returns the ids of the seeded videos.
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings
+    subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'], check=True)
+
+    import django
+    django.setup()
+    from django.conf import settings as django_settings
+    from django.contrib.auth.models import User
+    from django.db import connections
+    from api.models import Video
+
+    name = 'videos/benchmark_video.webm'
+    target = Path(django_settings.MEDIA_ROOT) / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(video_path, target)
+
+    user, created = User.objects.get_or_create(username=username)
+    if created:
+        user.set_password(password)
+        user.save()
+    Video.objects.filter(owner=user).delete()
+    Video.objects.bulk_create([
+        Video(title=f'Benchmark video {i}', file=name, owner=user, size=target.stat().st_size,
+              processing_status=Video.PROCESSING_READY)
+        for i in range(videos)
+    ])
+    ids = list(Video.objects.filter(owner=user).values_list('id', flat=True))
+    # The server must not share the connection of this process
+    connections.close_all()
+    return ids
+
+
+def scenarios(base_url, token, image, video, video_ids):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def predict(session):
+        response = session.post(f'{base_url}/api/predict/', headers=headers,
+                                files={'image': ('image.jpg', image, 'image/jpeg')})
+        return response.status_code == 200
+
+    def upload(session):
+        response = session.post(f'{base_url}/api/videos/upload/', headers=headers, data={'title': 'Benchmark upload'},
+                                files={'file': ('benchmark_upload.webm', video, 'video/webm')})
+        return response.status_code == 201
+
+    def list_videos(session):
+        return session.get(f'{base_url}/api/videos/?page_size=50', headers=headers).status_code == 200
+
+    def download(session):
+        response = session.get(f'{base_url}/api/videos/download/{random.choice(video_ids)}/', headers=headers)
+        return response.status_code == 200 and len(response.content) == len(video)
+
+    return {'predict': predict, 'upload': upload, 'list': list_videos, 'download': download}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', required=True, help='Image sent to the predict endpoint')
+    parser.add_argument('--video', required=True, help='Video uploaded and downloaded')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+    parser.add_argument('--videos', type=int, default=200, help='Videos seeded for the list and download scenarios')
+    parser.add_argument('--server', choices=['runserver', 'gunicorn'], default='gunicorn')
+    parser.add_argument('--settings', default='benchmarks.settings')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--username', default='benchmark')
+    parser.add_argument('--password', default='benchmark-password')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random video choice of downloads')
+    parser.add_argument('--output', help='Result file, by default results/<commit>-<server>.json')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    image = Path(args.image).read_bytes()
+    video = Path(args.video).read_bytes()
+    video_ids = prepare(args.settings, args.video, args.videos, args.username, args.password)
+
+    # Gunicorn configuration defaults to the production settings, the benchmark settings are used instead
+    process = start_server(args.server, args.port, args.settings)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        wait_for_server(base_url + '/api/videos/')
+        token = authenticate(base_url, args.username, args.password)
+        available = scenarios(base_url, token, image, video, video_ids)
+
+        results = {}
+        for scenario in args.scenarios:
+            send = available[scenario]
+            # Warm up so the model load and first connections don't count
+            run_load(send, args.concurrency[-1], args.concurrency[-1])
+            results[scenario] = []
+            for concurrency in args.concurrency:
+                result = run_load(send, args.requests, concurrency)
+                results[scenario].append(result)
+                print(f"{scenario:<9} concurrency {concurrency:>3}: {result['throughput_rps']:8.1f} req/s, "
+                      f"p50 {result['p50_ms'] or 0:7.1f} ms, p95 {result['p95_ms'] or 0:7.1f} ms, "
+                      f"p99 {result['p99_ms'] or 0:7.1f} ms, {result['errors']} errors")
+    finally:
+        stop_server(process)
+
+    commit, dirty = git_revision()
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "server": args.server,
+            "settings": args.settings,
+            "inference_backend": os.environ.get('BENCHMARK_INFERENCE_BACKEND', 'benchmarks.stub.StubBackend'),
+            "requests": args.requests,
+            "videos": args.videos,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f'{commit}-{args.server}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
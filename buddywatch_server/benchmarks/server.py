@@ -0,0 +1,30 @@
+"""
+Start the development server or the production Gunicorn profile for the benchmarks.
+"""
+
+import subprocess
+import sys
+import os
+
+SERVERS = {
+    'runserver': lambda port: [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}'],
+    'gunicorn': lambda port: [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}'],
+}
+
+
+def start_server(name, port, settings, env=None):
+    """
+    Start the server in a subprocess with the given settings module.
+    Must be called in the directory of manage.py.
+    """
+    env = {**os.environ, **(env or {}), 'DJANGO_SETTINGS_MODULE': settings}
+    return subprocess.Popen(SERVERS[name](port), env=env)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
@@ -0,0 +1,46 @@
+"""
+Django settings for running the benchmarks without Azure or a PostgreSQL server.
+
+Files are stored on the local file system and the database is SQLite, both in
+BENCHMARK_DIR. PostgreSQL can be used instead with BENCHMARK_DATABASE set to
+'postgres' and the usual DB_* variables. The model is replaced with a stub
+unless BENCHMARK_INFERENCE_BACKEND names a real inference backend.
+"""
+
+import tempfile
+import os
+
+BENCHMARK_DIR = os.environ.get('BENCHMARK_DIR', os.path.join(tempfile.gettempdir(), 'buddywatch-benchmark'))
+os.makedirs(BENCHMARK_DIR, exist_ok=True)
+
+# Values for the variables the default settings require, nothing connects to Azure
+for name in ['AZURE_CLIENT_ID', 'AZURE_TENANT_ID', 'AZURE_CLIENT_SECRET', 'AZURE_STORAGE_URL',
+             'AZURE_ACCOUNT_NAME', 'AZURE_CONTAINER_NAME', 'DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_HOST']:
+    os.environ.setdefault(name, 'benchmark')
+os.environ.setdefault('DB_PORT', '5432')
+os.environ.setdefault('SECRET_KEY', 'benchmark-secret-key-that-is-long-enough-for-hmac')
+
+from buddywatch_server.settings import *  # noqa: E402, F401, F403
+
+DEBUG = False
+
+if os.environ.get('BENCHMARK_DATABASE', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+            # Wait for the write lock instead of failing when workers write at the same time
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+STORAGES = {
+    **STORAGES,
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': MEDIA_ROOT},
+    },
+}
+
+INFERENCE_BACKEND = os.environ.get('BENCHMARK_INFERENCE_BACKEND', 'benchmarks.stub.StubBackend')
@@ -0,0 +1,22 @@
+import time
+import os
+
+import numpy as np
+
+
+class StubBackend:
+    """
+    Inference backend that returns a fixed prediction without TensorFlow, so the benchmarks
+    measure the server instead of the model. STUB_INFERENCE_MS simulates the time a batch takes.
+    """
+    name = 'stub'
+
+    def __init__(self, model_path, **options):
+        self.delay = float(os.environ.get('STUB_INFERENCE_MS', 0)) / 1000
+
+    def predict(self, inputs):
+        if self.delay:
+            time.sleep(self.delay)
+        confidence = np.full((len(inputs), 1), 0.5, dtype=np.float32)
+        bbox = np.tile(np.array([0.25, 0.25, 0.75, 0.75], dtype=np.float32), (len(inputs), 1))
+        return confidence, bbox
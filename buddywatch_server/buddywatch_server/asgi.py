@@ -2,6 +2,8 @@
 ASGI config for buddywatch_server project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests are handled by Django and WebSocket connections are routed
+to the consumers listed in ``websocket_routes``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -9,8 +11,36 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 
 import os
 
+from django.apps import apps
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'buddywatch_server.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+if settings.INFERENCE_PRELOAD:
+    # Workers are forked after this, so only things that are safe to share are loaded here.
+    # The workers warm up the model after the fork (see gunicorn.conf.py).
+    apps.get_app_config('api').preload()
+elif settings.INFERENCE_WARM_UP:
+    # Load the model before the server takes requests instead of on the first prediction
+    apps.get_app_config('api').warm_up()
+
+# Import consumers only after Django has been set up
+from api.consumers import PredictConsumer  # noqa: E402
+
+websocket_routes = {
+    '/ws/predict/': PredictConsumer,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        consumer = websocket_routes.get(scope['path'])
+        if consumer is None:
+            await receive()
+            await send({'type': 'websocket.close'})
+            return
+        return await consumer()(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -51,7 +51,7 @@ ALLOWED_HOSTS = ['*']
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -63,6 +63,11 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
 }
 
+# Seconds a user loaded by the authentication is kept in process memory, 0 loads the user on every request
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 30))
+# Most users kept in process memory at once
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 10000))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -79,6 +84,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so the measured time covers all the other middleware
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -111,15 +119,44 @@ TEMPLATES = [
 WSGI_APPLICATION = 'buddywatch_server.wsgi.application'
 
 # Database
+# Connections are taken from a pool kept in each process when DB_POOL_ENABLED is 'True'.
+# Closing a connection at the end of a request then only returns it to the pool.
+
+DB_POOL_ENABLED = os.environ.get('DB_POOL_ENABLED', 'True') == 'True'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'api.db' if DB_POOL_ENABLED else 'django.db.backends.postgresql',
         'NAME': os.environ['DB_NAME'],
         'USER': os.environ['DB_USER'],
         'PASSWORD': os.environ['DB_PASSWORD'],
         'HOST': os.environ['DB_HOST'],
         'PORT': os.environ['DB_PORT'],
+        # Seconds a thread keeps its connection between requests, pooled connections
+        # are best returned after each request so other threads can use them
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        # Check persistent connections before reusing them in a new request
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 0)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                # Seconds a request waits for a free connection
+                'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                # Connections idle longer than this many seconds are checked before use
+                'check_after': float(os.environ.get('DB_POOL_CHECK_AFTER', 30)),
+            },
+        } if DB_POOL_ENABLED else {},
+    }
+}
+
+# Cache
+# Local memory cache by default, shared cache such as Redis can be set with CACHE_BACKEND and CACHE_LOCATION
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'buddywatch'),
     }
 }
 
@@ -162,6 +199,155 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Object detection model and the backend used to run it: keras, function or tflite
+INFERENCE_MODEL_PATH = os.environ.get('INFERENCE_MODEL_PATH', os.path.join(BASE_DIR, 'buddywatch_face.h5'))
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras')
+# Quantization of the converted tflite model: none, float16, dynamic or int8
+INFERENCE_QUANTIZATION = os.environ.get('INFERENCE_QUANTIZATION', 'none')
+# Images used to calibrate int8 quantization
+INFERENCE_CALIBRATION_DIR = os.environ.get('INFERENCE_CALIBRATION_DIR', os.path.join(BASE_DIR, 'media', 'testing'))
+# Threads used for inference, 0 lets TensorFlow decide
+INFERENCE_NUM_THREADS = int(os.environ.get('INFERENCE_NUM_THREADS', 0))
+INFERENCE_INTER_OP_THREADS = int(os.environ.get('INFERENCE_INTER_OP_THREADS', 0))
+
+# Load the model when the server starts instead of on the first prediction
+INFERENCE_WARM_UP = os.environ.get('INFERENCE_WARM_UP', 'False') == 'True'
+# Import TensorFlow and read the model in the master process of a pre-fork server, so workers share them
+INFERENCE_PRELOAD = os.environ.get('INFERENCE_PRELOAD', 'False') == 'True'
+
+# Batching of concurrent prediction requests
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 16))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get('INFERENCE_MAX_WAIT_MS', 5))
+# Maximum amount of images in a single batch prediction request
+PREDICT_BATCH_MAX_IMAGES = int(os.environ.get('PREDICT_BATCH_MAX_IMAGES', 64))
+
+# Decode large JPEG images at reduced size before resizing them to the model's input size
+PREPROCESS_DRAFT_DECODE = os.environ.get('PREPROCESS_DRAFT_DECODE', 'True') == 'True'
+# Images with more pixels are rejected before decoding
+PREPROCESS_MAX_PIXELS = int(os.environ.get('PREPROCESS_MAX_PIXELS', 40_000_000))
+
+# Cache predictions of repeated frames in process memory by the hash of the image bytes
+PREDICTION_CACHE_ENABLED = os.environ.get('PREDICTION_CACHE_ENABLED', 'False') == 'True'
+# Most predictions kept at once and seconds each prediction is kept
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 1024))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 5))
+# Also match nearly identical frames by the perceptual hash of the downscaled input
+PREDICTION_CACHE_PERCEPTUAL = os.environ.get('PREDICTION_CACHE_PERCEPTUAL', 'False') == 'True'
+
+# Skip inference of frames without motion when the client sends the ID of its camera session
+MOTION_GATING_ENABLED = os.environ.get('MOTION_GATING_ENABLED', 'True') == 'True'
+# Frame has motion when more than this fraction of its blocks changed, clients can send their own threshold
+MOTION_GATING_THRESHOLD = float(os.environ.get('MOTION_GATING_THRESHOLD', 0.01))
+# Change of block brightness from 0 to 1 that counts as a changed block rather than noise
+MOTION_GATING_PIXEL_THRESHOLD = float(os.environ.get('MOTION_GATING_PIXEL_THRESHOLD', 0.04))
+# Seconds a prediction is reused at most, after that the next frame is predicted even without motion
+MOTION_GATING_MAX_AGE = float(os.environ.get('MOTION_GATING_MAX_AGE', 2))
+
+# Thumbnails are scaled to fit into THUMBNAIL_MAX_SIZE x THUMBNAIL_MAX_SIZE pixels
+THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', 320))
+# Thumbnail format, jpeg or webp, and its quality from 1 to 100
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'jpeg')
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+
+# Process uploaded videos in background jobs run by the run_video_worker command.
+# When disabled, the jobs are run during the upload request
+VIDEO_JOBS_ASYNC = os.environ.get('VIDEO_JOBS_ASYNC', 'True') == 'True'
+VIDEO_JOB_MAX_ATTEMPTS = int(os.environ.get('VIDEO_JOB_MAX_ATTEMPTS', 3))
+# Seconds before the first retry, doubled for each following retry
+VIDEO_JOB_RETRY_DELAY = int(os.environ.get('VIDEO_JOB_RETRY_DELAY', 30))
+# Seconds after which a running job is considered abandoned and taken again
+VIDEO_JOB_TIMEOUT = int(os.environ.get('VIDEO_JOB_TIMEOUT', 600))
+
+# Frames per second sampled from a video for its face detection timeline, clients can ask for another rate
+VIDEO_ANALYSIS_SAMPLE_RATE = float(os.environ.get('VIDEO_ANALYSIS_SAMPLE_RATE', 2))
+# Sampled frames passed through the model at once
+VIDEO_ANALYSIS_BATCH_SIZE = int(os.environ.get('VIDEO_ANALYSIS_BATCH_SIZE', 32))
+# Threads decoding parts of the video in parallel, videos of unknown duration are decoded by one thread
+VIDEO_ANALYSIS_WORKERS = int(os.environ.get('VIDEO_ANALYSIS_WORKERS', 2))
+# Analyze every video after its upload has been processed
+VIDEO_ANALYSIS_ON_UPLOAD = os.environ.get('VIDEO_ANALYSIS_ON_UPLOAD', 'False') == 'True'
+# Confidence from which a sampled frame counts as having a face in the timeline segments
+VIDEO_ANALYSIS_MIN_CONFIDENCE = float(os.environ.get('VIDEO_ANALYSIS_MIN_CONFIDENCE', 0.5))
+
+# Videos per page when the video list is paginated, clients can ask for at most VIDEO_LIST_MAX_PAGE_SIZE
+VIDEO_LIST_PAGE_SIZE = int(os.environ.get('VIDEO_LIST_PAGE_SIZE', 50))
+VIDEO_LIST_MAX_PAGE_SIZE = int(os.environ.get('VIDEO_LIST_MAX_PAGE_SIZE', 500))
+
+# Bytes read from the storage at a time when streaming downloads
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+
+# Seconds the serialized video list of a user is cached, 0 disables the cache
+VIDEO_LIST_CACHE_TTL = int(os.environ.get('VIDEO_LIST_CACHE_TTL', 300))
+
+# Seconds the URLs of stored files are cached
+STORAGE_URL_CACHE_TTL = int(os.environ.get('STORAGE_URL_CACHE_TTL', 3600))
+
+# Let clients upload and download videos directly to and from the storage with signed URLs
+DIRECT_STORAGE_ENABLED = os.environ.get('DIRECT_STORAGE_ENABLED', 'False') == 'True'
+# Seconds the signed URLs are valid
+SIGNED_URL_EXPIRY = int(os.environ.get('SIGNED_URL_EXPIRY', 900))
+
+# Most videos deleted by ids in a single bulk delete request
+BULK_DELETE_MAX_IDS = int(os.environ.get('BULK_DELETE_MAX_IDS', 1000))
+# Threads deleting files from the storage at a time, Azure deletes up to 256 blobs per request of a thread
+BULK_DELETE_WORKERS = int(os.environ.get('BULK_DELETE_WORKERS', 8))
+
+# Default retention limits of each user enforced by the purge_videos command, 0 means no limit.
+# Limits of a single user can be changed with a RetentionPolicy in the admin site
+RETENTION_MAX_AGE_DAYS = int(os.environ.get('RETENTION_MAX_AGE_DAYS', 0))
+RETENTION_MAX_BYTES = int(os.environ.get('RETENTION_MAX_BYTES', 0))
+RETENTION_MAX_COUNT = int(os.environ.get('RETENTION_MAX_COUNT', 0))
+# Videos deleted per transaction by the purge
+RETENTION_CHUNK_SIZE = int(os.environ.get('RETENTION_CHUNK_SIZE', 500))
+
+# Largest chunk in bytes accepted at a time by the resumable chunked upload
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = int(os.environ.get('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024))
+
+# Collect request counts, latency histograms and timings of the request stages, such as image
+# decoding and the model forward pass, and serve them at /api/metrics/ in the Prometheus text format
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+# Token the Prometheus scraper sends as a bearer token, admin users can read the metrics without it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Log a JSON line with the route, status, duration and stage timings of every request
+METRICS_LOG_REQUESTS = os.environ.get('METRICS_LOG_REQUESTS', 'False') == 'True'
+
+# Profile requests and write the profiles with their SQL query counts into PROFILING_DIR
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'False') == 'True'
+# Fraction of the requests profiled with cProfile, which slows the profiled requests down
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.001))
+# Keep a sampled stack profile of requests slower than this, 0 disables. Samples the stacks and
+# records the SQL queries of every request to find the slow ones
+PROFILING_SLOW_THRESHOLD_MS = float(os.environ.get('PROFILING_SLOW_THRESHOLD_MS', 0))
+# Milliseconds between the stack samples of the requests
+PROFILING_INTERVAL_MS = float(os.environ.get('PROFILING_INTERVAL_MS', 10))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+# Oldest profiles are removed when there are more
+PROFILING_MAX_PROFILES = int(os.environ.get('PROFILING_MAX_PROFILES', 500))
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'default',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+        },
+    },
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
@@ -0,0 +1,21 @@
+"""
+Django settings for running buddywatch_server in production.
+
+Same as the default settings, but with debugging turned off and a cache shared
+by all processes required. Used by the Gunicorn configuration in gunicorn.conf.py.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from .settings import *  # noqa: F401, F403
+import os
+
+# Debug mode shows internals in error pages and keeps every SQL query in memory
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', '*').split(',')
+
+# Token revocation, video list ETags and motion gating are kept in the cache, so the Gunicorn
+# workers and the video worker must share it
+if CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':  # noqa: F405
+    raise ImproperlyConfigured('The local memory cache is not shared by the server processes, '
+                               'set CACHE_BACKEND and CACHE_LOCATION to a shared cache such as Redis')
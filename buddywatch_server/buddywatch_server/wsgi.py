@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 
 import os
 
+from django.apps import apps
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'buddywatch_server.settings')
 
 application = get_wsgi_application()
+
+if settings.INFERENCE_PRELOAD:
+    # Workers are forked after this, so only things that are safe to share are loaded here.
+    # The workers warm up the model after the fork (see gunicorn.conf.py).
+    apps.get_app_config('api').preload()
+elif settings.INFERENCE_WARM_UP:
+    # Load the model before the server takes requests instead of on the first prediction
+    apps.get_app_config('api').warm_up()
@@ -0,0 +1,57 @@
+"""
+Gunicorn configuration for running the server in production with multiple worker processes.
+
+    gunicorn
+
+Django and TensorFlow are imported once in the master process before the workers are forked,
+so the workers share them copy-on-write. Each worker limits the threads TensorFlow uses, so
+the workers together don't use more threads than there are CPU cores. The server can be run
+as WSGI (default) or as ASGI with Uvicorn workers when SERVER_INTERFACE is 'asgi', which is
+needed for WebSocket routes.
+"""
+
+import multiprocessing
+import os
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', max(2, cpu_count // 2)))
+# Threads of each worker, the threads share the worker's batching predictor
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Restart workers after this many requests to limit memory growth, 0 never restarts them
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+if os.environ.get('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    wsgi_app = 'buddywatch_server.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'buddywatch_server.wsgi:application'
+    worker_class = 'gthread'
+
+# Import the application in the master process before forking the workers
+preload_app = True
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'buddywatch_server.settings_production')
+os.environ.setdefault('INFERENCE_PRELOAD', 'True')
+os.environ.setdefault('INFERENCE_WARM_UP', 'True')
+# Split the CPU cores between the workers so TensorFlow thread pools don't oversubscribe the CPU
+os.environ.setdefault('INFERENCE_NUM_THREADS', str(max(1, cpu_count // workers)))
+os.environ.setdefault('INFERENCE_INTER_OP_THREADS', '1')
+
+# Log requests to the given file ('-' for stdout), requests aren't logged by default
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+
+def post_worker_init(worker):
+    """
+    Load and warm up the model in each worker after the fork, TensorFlow runtime must not be
+    started in the master process.
+    """
+    from django.apps import apps
+    from django.conf import settings
+
+    if settings.INFERENCE_WARM_UP:
+        apps.get_app_config('api').warm_up()